@@ -78,6 +78,28 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Wait for locks instead of failing immediately under concurrent writes
+            'timeout': 20,
+        },
+        'TEST': {
+            # File-backed so threaded tests share one database
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    }
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'farm2fork',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
     }
 }
 
@@ -145,3 +167,13 @@ DEFAULT_FROM_EMAIL = 'Farm2Fork <noreply@farm2fork.com>'
 # Media files (user uploads)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Background threads that render resized product image variants (0 = render
+# inline when the upload commits); see market/images.py
+MARKET_IMAGE_WORKERS = 2
+
+# Let the front-end server send media files (see market/serving.py):
+# None, 'x-accel-redirect' (nginx, with an internal location at
+# MARKET_MEDIA_ACCEL_PREFIX aliased to MEDIA_ROOT) or 'x-sendfile'
+MARKET_MEDIA_OFFLOAD = None
+MARKET_MEDIA_ACCEL_PREFIX = '/protected-media/'
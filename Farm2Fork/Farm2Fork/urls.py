@@ -14,16 +14,20 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from market.views import media_file
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('market/', include('market.urls')),
 ]
 
-# Serve media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Uploaded media (see market/serving.py; set MARKET_MEDIA_OFFLOAD to let the
+# front-end server send the files). Skipped when MEDIA_URL is another host.
+if not settings.MEDIA_URL.startswith(('http://', 'https://', '//')):
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), media_file),
+    ]
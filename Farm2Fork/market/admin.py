@@ -1,6 +1,6 @@
 from .models import (
     Consumer, Product, Vendor, Review, Cart, CartItem, Order, OrderItem,
-    VendorApplication, VendorTeamMember, ProductMedia, ReviewResponse, Message
+    VendorApplication, VendorTeamMember, ProductMedia, ReviewResponse, Message, VendorStats, AbandonedCartStats, MediaBlob
 )
 from django.contrib import admin
 from django.utils.html import format_html
@@ -187,6 +187,9 @@ admin.site.register(Message, MessageAdmin)
 admin.site.register(Consumer)
 admin.site.register(Cart)
 admin.site.register(CartItem)
+admin.site.register(VendorStats)
+admin.site.register(AbandonedCartStats)
+admin.site.register(MediaBlob)
 
 # Order Item Admin (inline)
 class OrderItemInline(admin.TabularInline):
@@ -0,0 +1,137 @@
+import os
+from collections import Counter
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import MediaBlob, ProductMedia
+from .storage import media_storage
+
+# Media blob reference counting
+# Every file a ProductMedia uses (its upload and its rendered variants) holds
+# one reference on that file's MediaBlob row; identical files are stored once
+# (storage.py), so several media can share a blob. Counts change with one
+# UPDATE as media are created, reprocessed and deleted. collect_garbage()
+# deletes blobs that have been unreferenced for GC_GRACE, which leaves time
+# for an in-flight upload of the same bytes to take the blob back. Files are
+# deleted while the collector still holds their rows; an upload reusing a file
+# touches its row first (storage.py), so it either keeps the blob from being
+# collected or waits, finds the row gone and writes the file again.
+
+GC_GRACE = timedelta(hours=24)
+GC_BATCH_SIZE = 500
+MEDIA_ROOT_DIRECTORY = 'products'
+
+def media_file_names(media):
+    """Storage names a media item references: its upload and its variants"""
+    names = [media.image.name] if media.image else []
+    base_url = media.image.storage.base_url
+    for formats in (media.variants or {}).values():
+        for url in formats.values():
+            if url and url.startswith(base_url):
+                names.append(url[len(base_url):])
+    return names
+
+def track(names):
+    """Make sure every name has a blob row (new rows start unreferenced)"""
+    names = {name for name in names if name}
+    if names:
+        MediaBlob.objects.bulk_create([MediaBlob(name=name) for name in names], ignore_conflicts=True)
+
+def _adjust(names, sign):
+    counts = Counter(name for name in names if name)
+    by_count = {}
+    for name, count in counts.items():
+        by_count.setdefault(count, []).append(name)
+    now = timezone.now()
+    for count, group in by_count.items():
+        MediaBlob.objects.filter(name__in=group).update(ref_count=F('ref_count') + sign * count, updated_at=now)
+
+def retain(names):
+    """Add a reference to each named file"""
+    track(names)
+    _adjust(names, 1)
+
+def release(names):
+    """Drop a reference to each named file; unreferenced files wait for collect_garbage()"""
+    _adjust(names, -1)
+
+def recount():
+    """Rebuild every blob's reference count from the media records; returns the number of referenced files"""
+    counts = Counter()
+    for media in ProductMedia.objects.only('image', 'variants').iterator():
+        counts.update(media_file_names(media))
+    with transaction.atomic():
+        track(counts)
+        MediaBlob.objects.update(ref_count=0)
+        by_count = {}
+        for name, count in counts.items():
+            by_count.setdefault(count, []).append(name)
+        for count, group in by_count.items():
+            for start in range(0, len(group), GC_BATCH_SIZE):
+                MediaBlob.objects.filter(name__in=group[start:start + GC_BATCH_SIZE]).update(ref_count=count)
+    return len(counts)
+
+def collect_garbage(grace=GC_GRACE, batch_size=GC_BATCH_SIZE, dry_run=False):
+    """
+    Delete files whose blob has had no references for at least grace, in
+    batches. Each batch locks and re-checks its rows, then deletes them and
+    their files in one transaction.
+    Returns (files deleted, bytes freed).
+    """
+    storage = media_storage()
+    cutoff = timezone.now() - grace
+    deleted = freed = 0
+    last_id = 0
+    while True:
+        blobs = list(
+            MediaBlob.objects.filter(ref_count__lte=0, updated_at__lt=cutoff, id__gt=last_id)
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not blobs:
+            return deleted, freed
+        last_id = blobs[-1]
+        with transaction.atomic():
+            collectable = MediaBlob.objects.filter(id__in=blobs, ref_count__lte=0, updated_at__lt=cutoff)
+            names = set(collectable.select_for_update().values_list('name', flat=True))
+            if not dry_run:
+                collectable.delete()
+                # Without row locks (SQLite) a retain or reuse may have landed
+                # between the select and the delete; those rows survive it
+                names -= set(MediaBlob.objects.filter(name__in=names).values_list('name', flat=True))
+            for name in names:
+                if storage.exists(name):
+                    freed += storage.size(name)
+                    if not dry_run:
+                        storage.delete(name)
+            deleted += len(names)
+
+def _walk(storage, directory):
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield f'{directory}/{name}'
+    for subdirectory in directories:
+        yield from _walk(storage, f'{directory}/{subdirectory}')
+
+def collect_orphans(grace=GC_GRACE, dry_run=False):
+    """
+    Delete media files that no blob row or media record knows about (e.g. an
+    upload whose transaction rolled back) and that are older than grace.
+    Returns (files deleted, bytes freed).
+    """
+    storage = media_storage()
+    if not os.path.isdir(storage.path(MEDIA_ROOT_DIRECTORY)):
+        return 0, 0
+    known = set(MediaBlob.objects.values_list('name', flat=True))
+    for media in ProductMedia.objects.only('image', 'variants').iterator():
+        known.update(media_file_names(media))
+    cutoff = timezone.now() - grace
+    deleted = freed = 0
+    for name in _walk(storage, MEDIA_ROOT_DIRECTORY):
+        if name in known or storage.get_modified_time(name) >= cutoff:
+            continue
+        freed += storage.size(name)
+        if not dry_run:
+            storage.delete(name)
+        deleted += 1
+    return deleted, freed
@@ -0,0 +1,525 @@
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Vendor, Product, Cart, CartItem
+from . import inventory
+from .header_state import invalidate_header_state
+
+# Cart service
+# Quantity changes are single conditional UPDATE statements
+# (SET quantity = quantity + n WHERE quantity + n <= max_quantity), so
+# concurrent requests can neither lose increments nor exceed max_quantity.
+# For tracked products each change also moves the item's stock hold (see
+# inventory.py) in the same transaction.
+
+class CartError(Exception):
+    """A cart change was rejected; the message is safe to show to the user"""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        # Per-item messages ({item_id: message}) for batched updates
+        self.errors = errors or {}
+
+def get_or_create_cart(user, vendor_id):
+    """Get or create the user's cart for a vendor (safe against concurrent creation)"""
+    cart, created = Cart.objects.get_or_create(user=user, vendor_id=vendor_id)
+    return cart
+
+def _hold_fields(product, held_quantity):
+    """Hold columns to write for a cart item, empty for untracked products"""
+    if not product.track_inventory:
+        return {}
+    return {'held_quantity': held_quantity, 'hold_expires_at': inventory.hold_expiry()}
+
+def _increment(user, product, quantity):
+    """Conditionally increment an existing item; returns True if a row was updated"""
+    return CartItem.objects.filter(
+        cart__user=user,
+        cart__vendor_id=product.vendor_id,
+        product=product,
+        quantity__lte=product.max_quantity - quantity,
+    ).update(
+        quantity=F('quantity') + quantity,
+        updated_at=timezone.now(),
+        **_hold_fields(product, F('held_quantity') + quantity),
+    ) == 1
+
+def add_item(user, product, quantity):
+    """
+    Add quantity of a product to the user's cart for the product's vendor.
+    The common case (item already in the cart) is a single UPDATE; a new item
+    costs one cart lookup and one INSERT. Raises CartError when the quantity is
+    invalid or would exceed the product's max_quantity.
+    """
+    if quantity < 1:
+        raise CartError('Quantity must be at least 1.')
+    if quantity > product.max_quantity:
+        raise CartError(f'Maximum quantity allowed is {product.max_quantity}.')
+
+    with transaction.atomic():
+        # Takes effect when (and only if) the transaction commits
+        invalidate_header_state(user.pk)
+        try:
+            inventory.reserve(product, quantity)
+        except inventory.InsufficientStock as e:
+            raise CartError(str(e))
+
+        if _increment(user, product, quantity):
+            return
+
+        # Either the item is not in the cart yet or the increment would exceed the
+        # limit. Try to insert it; a unique violation means it already exists
+        # (possibly inserted concurrently), so retry the conditional increment.
+        cart = get_or_create_cart(user, product.vendor_id)
+        try:
+            with transaction.atomic():
+                CartItem.objects.create(cart=cart, product=product, quantity=quantity, **_hold_fields(product, quantity))
+            return
+        except IntegrityError:
+            pass
+
+        if not _increment(user, product, quantity):
+            # Raising inside the transaction also rolls back the stock hold
+            raise CartError(f'Adding {quantity} would exceed the maximum quantity of {product.max_quantity}.')
+
+def set_item_quantity(item, quantity):
+    """
+    Set a cart item's quantity with a single conditional UPDATE that re-checks
+    max_quantity in the database. Raises CartError for invalid quantities.
+    """
+    if quantity < 1:
+        raise CartError('Quantity must be at least 1.')
+    if quantity > item.product.max_quantity:
+        raise CartError(f'Maximum quantity allowed is {item.product.max_quantity}.')
+
+    with transaction.atomic():
+        hold = {}
+        if item.product.track_inventory:
+            # Move the hold to the new quantity; this also renews an expired one
+            change = quantity - item.held_quantity
+            try:
+                if change > 0:
+                    inventory.reserve(item.product, change)
+                else:
+                    inventory.release(item.product_id, -change)
+            except inventory.InsufficientStock as e:
+                raise CartError(str(e))
+            hold = _hold_fields(item.product, quantity)
+
+        updated = CartItem.objects.filter(
+            id=item.id,
+            held_quantity=item.held_quantity,
+            product__max_quantity__gte=quantity,
+        ).update(quantity=quantity, updated_at=timezone.now(), **hold)
+        if not updated:
+            # Removed, changed or max_quantity lowered since the item was loaded
+            raise CartError('This item could not be updated. Please refresh your cart.')
+    item.quantity = quantity
+    item.held_quantity = hold.get('held_quantity', item.held_quantity)
+
+def remove_item(item):
+    """Delete a cart item, releasing its stock hold"""
+    with transaction.atomic():
+        items = CartItem.objects.filter(id=item.id)
+        inventory.release_holds(items, clear=False)
+        items.delete()
+
+def _validate_changes(changes, items, max_quantities):
+    """Per-item errors for a batch of {item_id: quantity} changes"""
+    errors = {}
+    for item_id, quantity in changes.items():
+        if item_id not in items:
+            errors[item_id] = 'This item is no longer in your cart.'
+        elif quantity < 0:
+            errors[item_id] = 'Quantity cannot be negative.'
+        elif quantity > max_quantities[item_id]:
+            errors[item_id] = f'Maximum quantity allowed is {max_quantities[item_id]}.'
+    if errors:
+        raise CartError('Some items could not be updated.', errors=errors)
+
+def update_items(user, vendor_id, changes):
+    """
+    Apply {item_id: quantity} changes (0 removes the item) to the user's cart
+    for a vendor in one transaction with a fixed number of queries: lock the
+    cart, load the items and products, move stock holds (one release and one
+    reserve UPDATE), one DELETE and one bulk UPDATE. Nothing is applied if any
+    change is invalid.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        if not Cart.objects.filter(user=user, vendor_id=vendor_id).update(updated_at=now):
+            raise CartError('Your cart is empty.', errors={item_id: 'This item is no longer in your cart.' for item_id in changes})
+        items = {
+            item.id: item
+            for item in CartItem.objects.filter(
+                cart__user=user, cart__vendor_id=vendor_id, id__in=list(changes),
+            ).select_related('product')
+        }
+        _validate_changes(changes, items, {item_id: item.product.max_quantity for item_id, item in items.items()})
+
+        # Holds follow the new quantities of tracked products
+        release = {}
+        reserve = {}
+        for item_id, quantity in changes.items():
+            item = items[item_id]
+            if item.product.track_inventory:
+                change = quantity - item.held_quantity
+                target = reserve if change > 0 else release
+                target[item.product_id] = target.get(item.product_id, 0) + abs(change)
+        inventory.release_many(release)
+        try:
+            inventory.reserve_many({item.product_id: item.product for item in items.values()}, reserve)
+        except inventory.InsufficientStock as e:
+            item_id = next(item_id for item_id, item in items.items() if item.product_id == e.product.id)
+            raise CartError(str(e), errors={item_id: str(e)})
+
+        removed = [item_id for item_id, quantity in changes.items() if quantity == 0]
+        updated = []
+        for item_id, quantity in changes.items():
+            if quantity:
+                item = items[item_id]
+                item.quantity = quantity
+                item.updated_at = now
+                if item.product.track_inventory:
+                    item.held_quantity = quantity
+                    item.hold_expires_at = inventory.hold_expiry()
+                updated.append(item)
+        if removed:
+            CartItem.objects.filter(id__in=removed).delete()
+        if updated:
+            CartItem.objects.bulk_update(updated, ['quantity', 'held_quantity', 'hold_expires_at', 'updated_at'])
+    invalidate_header_state(user.pk)
+    return updated, removed
+
+# Cart backends
+# Views work with a backend from get_cart_backend(request). Signed-in users
+# keep their carts in the Cart/CartItem tables; anonymous shoppers keep theirs
+# in the session, so browsing never writes cart rows. Session carts are merged
+# into the database in bulk when the shopper logs in (merge_session_cart).
+# Both backends expose the same operations and return cart/item objects with
+# the attributes the cart templates use.
+
+SESSION_CART_KEY = 'market_cart'
+
+class DatabaseCartBackend:
+    """Carts stored in the database, for signed-in users"""
+
+    def __init__(self, user):
+        self.user = user
+
+    def add(self, product, quantity):
+        add_item(self.user, product, quantity)
+
+    def get_item(self, item_id):
+        """Cart item by id, or None"""
+        return CartItem.objects.select_related('product').filter(id=item_id, cart__user=self.user).first()
+
+    def set_quantity(self, item, quantity):
+        set_item_quantity(item, quantity)
+        invalidate_header_state(self.user.pk)
+
+    def remove(self, item):
+        remove_item(item)
+        invalidate_header_state(self.user.pk)
+
+    def update_items(self, vendor_id, changes):
+        """Apply {item_id: quantity} changes; returns the new cart summary"""
+        updated, removed = update_items(self.user, vendor_id, changes)
+        totals = Cart.objects.with_totals().filter(user=self.user, vendor_id=vendor_id).values('items_quantity', 'items_total').first()
+        return _summary(updated, removed, totals['items_quantity'], totals['items_total'])
+
+    def clear(self, vendor_id):
+        """Delete the cart for a vendor; returns False if there was none"""
+        # Holds and header state are released by the Cart pre_delete handler (signals.py)
+        deleted, _ = Cart.objects.filter(user=self.user, vendor_id=vendor_id).delete()
+        return bool(deleted)
+
+    def count(self, vendor_id):
+        """Total quantity in the cart for a vendor"""
+        return CartItem.objects.filter(
+            cart__user=self.user, cart__vendor_id=vendor_id,
+        ).aggregate(total=Sum('quantity'))['total'] or 0
+
+    def get_cart(self, vendor):
+        """(cart, items) for a vendor with totals and items loaded; the cart is created if missing"""
+        cart, created = Cart.objects.with_totals().with_items().get_or_create(user=self.user, vendor=vendor)
+        return cart, cart.items.all()
+
+    def carts(self):
+        """All of the user's carts with totals"""
+        return Cart.objects.filter(user=self.user).select_related('vendor').with_totals()
+
+def _summary(updated, removed, item_count, total_price):
+    """JSON-ready result of a batched cart update"""
+    return {
+        'items': [
+            {'item_id': item.id, 'quantity': item.quantity, 'subtotal': str(item.subtotal)}
+            for item in updated
+        ],
+        'removed': removed,
+        'item_count': item_count or 0,
+        'total_price': str(Decimal(total_price or 0).quantize(Decimal('0.01'))),
+    }
+
+class SessionCartItem:
+    """A session cart line; its id is the product id"""
+
+    def __init__(self, product, quantity):
+        self.id = product.id
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def subtotal(self):
+        return Decimal(self.quantity) * self.product.price
+
+class SessionCart:
+    """A vendor's session cart, shaped like a Cart for the templates"""
+
+    def __init__(self, vendor, items, updated_at=None):
+        self.vendor = vendor
+        self.items = items
+        self.updated_at = updated_at
+
+    @property
+    def item_count(self):
+        return sum(item.quantity for item in self.items)
+
+    @property
+    def total_price(self):
+        return sum((item.subtotal for item in self.items), Decimal('0.00'))
+
+class SessionCartBackend:
+    """
+    Carts stored in the session, for anonymous shoppers.
+    Stored as {vendor_id: {'items': {product_id: quantity}, 'updated_at': iso}}.
+    Counting needs no queries; rendering a cart loads its products in one query.
+    Session carts are checked against available stock but place no holds;
+    checkout re-checks stock either way.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.data = session.get(SESSION_CART_KEY, {})
+
+    def _save(self, vendor_id):
+        if vendor_id in self.data:
+            self.data[vendor_id]['updated_at'] = timezone.now().isoformat()
+        self.session[SESSION_CART_KEY] = self.data
+
+    def _items(self, vendor_id):
+        return self.data.get(str(vendor_id), {}).get('items', {})
+
+    def add(self, product, quantity):
+        if quantity < 1:
+            raise CartError('Quantity must be at least 1.')
+        if quantity > product.max_quantity:
+            raise CartError(f'Maximum quantity allowed is {product.max_quantity}.')
+        vendor_id = str(product.vendor_id)
+        items = self.data.setdefault(vendor_id, {'items': {}})['items']
+        current = items.get(str(product.id), 0)
+        if current + quantity > product.max_quantity:
+            raise CartError(f'Adding {quantity} would exceed the maximum quantity of {product.max_quantity}.')
+        # Session carts hold no stock, but never promise more than is available
+        available = product.available_to_promise
+        if available is not None and current + quantity > available:
+            raise CartError(f'Only {available} {product.name} available.')
+        items[str(product.id)] = current + quantity
+        self._save(vendor_id)
+
+    def get_item(self, item_id):
+        """Cart item by product id, or None"""
+        product = Product.objects.filter(id=item_id).first()
+        if product is None:
+            return None
+        quantity = self._items(product.vendor_id).get(str(product.id))
+        if quantity is None:
+            return None
+        return SessionCartItem(product, quantity)
+
+    def set_quantity(self, item, quantity):
+        if quantity < 1:
+            raise CartError('Quantity must be at least 1.')
+        if quantity > item.product.max_quantity:
+            raise CartError(f'Maximum quantity allowed is {item.product.max_quantity}.')
+        available = item.product.available_to_promise
+        if available is not None and quantity > available:
+            raise CartError(f'Only {available} {item.product.name} available.')
+        self._items(item.product.vendor_id)[str(item.id)] = quantity
+        item.quantity = quantity
+        self._save(str(item.product.vendor_id))
+
+    def remove(self, item):
+        vendor_id = str(item.product.vendor_id)
+        self._items(vendor_id).pop(str(item.id), None)
+        if not self._items(vendor_id):
+            self.data.pop(vendor_id, None)
+        self._save(vendor_id)
+
+    def update_items(self, vendor_id, changes):
+        """Apply {item_id: quantity} changes; returns the new cart summary"""
+        vendor_items = self._items(vendor_id)
+        products = Product.objects.in_bulk([int(product_id) for product_id in vendor_items])
+        items = {product_id: SessionCartItem(products[product_id], vendor_items[str(product_id)]) for product_id in products}
+        _validate_changes(changes, items, {product_id: product.max_quantity for product_id, product in products.items()})
+        errors = {}
+        for item_id, quantity in changes.items():
+            available = products[item_id].available_to_promise
+            if quantity and available is not None and quantity > available:
+                errors[item_id] = f'Only {available} {products[item_id].name} available.'
+        if errors:
+            raise CartError('Some items could not be updated.', errors=errors)
+
+        removed = []
+        updated = []
+        for item_id, quantity in changes.items():
+            if quantity:
+                vendor_items[str(item_id)] = items[item_id].quantity = quantity
+                updated.append(items[item_id])
+            else:
+                vendor_items.pop(str(item_id), None)
+                items.pop(item_id)
+                removed.append(item_id)
+        if not vendor_items:
+            self.data.pop(str(vendor_id), None)
+        self._save(str(vendor_id))
+        remaining = items.values()
+        return _summary(
+            updated, removed,
+            sum(item.quantity for item in remaining),
+            sum((item.subtotal for item in remaining), Decimal('0')),
+        )
+
+    def clear(self, vendor_id):
+        removed = self.data.pop(str(vendor_id), None) is not None
+        self._save(str(vendor_id))
+        return removed
+
+    def count(self, vendor_id):
+        return sum(self._items(vendor_id).values())
+
+    def _build(self, vendors):
+        """Session carts for the given vendors, loading all their products in one query"""
+        product_ids = [pid for vendor in vendors for pid in self._items(vendor.id)]
+        products = Product.objects.in_bulk(product_ids)
+        carts = []
+        for vendor in vendors:
+            entry = self.data.get(str(vendor.id), {})
+            items = [
+                SessionCartItem(products[int(pid)], quantity)
+                for pid, quantity in entry.get('items', {}).items()
+                if int(pid) in products
+            ]
+            carts.append(SessionCart(vendor, items, parse_datetime(entry.get('updated_at', ''))))
+        return carts
+
+    def get_cart(self, vendor):
+        cart = self._build([vendor])[0]
+        return cart, cart.items
+
+    def carts(self):
+        vendors = Vendor.objects.filter(id__in=[int(vendor_id) for vendor_id in self.data]).order_by('name')
+        carts = self._build(list(vendors))
+        return sorted(carts, key=lambda cart: cart.updated_at or timezone.now(), reverse=True)
+
+def get_cart_backend(request):
+    """Cart backend for the current visitor"""
+    if request.user.is_authenticated:
+        return DatabaseCartBackend(request.user)
+    return SessionCartBackend(request.session)
+
+def has_session_cart(request):
+    """True if an anonymous visitor has anything in a session cart"""
+    session = getattr(request, 'session', None)
+    return bool(session is not None and session.get(SESSION_CART_KEY))
+
+def _reserve_up_to(products, wanted):
+    """
+    Hold as many of the wanted units ({product_id: units}) of tracked products
+    as are available; returns the units granted per product
+    """
+    granted = dict(wanted)
+    while True:
+        try:
+            inventory.reserve_many(products, granted)
+            return granted
+        except inventory.InsufficientStock as e:
+            # Always shrink, so a race for the last units cannot loop forever
+            granted[e.product.id] = max(min(e.available, granted[e.product.id] - 1), 0)
+
+def _merge_items(user, products, quantities, cart_ids, now):
+    """Add session quantities to the user's cart items, holding stock for tracked products"""
+    existing = {
+        item.product_id: item
+        for item in CartItem.objects.select_for_update().filter(cart__user=user, product_id__in=products)
+    }
+    added = {}
+    for product_id, product in products.items():
+        current = existing[product_id].quantity if product_id in existing else 0
+        added[product_id] = max(min(current + quantities[product_id], product.max_quantity) - current, 0)
+    added.update(_reserve_up_to(products, {
+        product_id: units for product_id, units in added.items() if products[product_id].track_inventory
+    }))
+
+    to_update = []
+    to_create = []
+    for product_id, units in added.items():
+        if not units:
+            continue
+        product = products[product_id]
+        item = existing.get(product_id)
+        hold = _hold_fields(product, (item.held_quantity if item else 0) + units)
+        if item is not None:
+            item.quantity += units
+            item.updated_at = now
+            for field, value in hold.items():
+                setattr(item, field, value)
+            to_update.append(item)
+        else:
+            to_create.append(CartItem(cart_id=cart_ids[product.vendor_id], product=product, quantity=units, **hold))
+    CartItem.objects.bulk_update(to_update, ['quantity', 'held_quantity', 'hold_expires_at', 'updated_at'])
+    CartItem.objects.bulk_create(to_create)
+
+def merge_session_cart(session, user):
+    """
+    Move a session cart into the user's database carts. Quantities are added
+    to what the user already has, capped at each product's max_quantity, and
+    tracked products get a stock hold for the added units as with add_item();
+    units that cannot be held are dropped. The user's carts are touched first
+    and their items locked, so a concurrent add waits instead of being
+    overwritten. Runs in a fixed number of queries, plus one retry when
+    another request inserts one of the items meanwhile.
+    """
+    data = session.pop(SESSION_CART_KEY, None)
+    if not data:
+        return
+
+    quantities = {
+        int(product_id): quantity
+        for entry in data.values()
+        for product_id, quantity in entry.get('items', {}).items()
+    }
+    products = Product.objects.in_bulk(quantities)
+    if not products:
+        return
+    vendor_ids = {product.vendor_id for product in products.values()}
+    now = timezone.now()
+
+    with transaction.atomic():
+        Cart.objects.bulk_create(
+            [Cart(user=user, vendor_id=vendor_id) for vendor_id in vendor_ids],
+            ignore_conflicts=True,
+        )
+        # The first write also takes SQLite's write lock for the whole merge
+        Cart.objects.filter(user=user, vendor_id__in=vendor_ids).update(updated_at=now)
+        cart_ids = dict(Cart.objects.filter(user=user, vendor_id__in=vendor_ids).values_list('vendor_id', 'id'))
+        try:
+            with transaction.atomic():
+                _merge_items(user, products, quantities, cart_ids, now)
+        except IntegrityError:
+            # Another request inserted one of the items after they were read;
+            # it is there now, so the retry adds to it
+            _merge_items(user, products, quantities, cart_ids, now)
+    invalidate_header_state(user.pk)
@@ -0,0 +1,342 @@
+import csv
+import io
+import json
+import re
+from decimal import Decimal
+from django.db import transaction
+from django.utils import timezone
+from .models import Product
+from .queries import parse_price
+from .pricing import MAX_PRICE
+from .signals import products_bulk_updated
+from . import search
+
+# Catalog import and export
+# A vendor's products as CSV or JSON, one record per product with the
+# CATALOG_FIELDS columns. Exports stream straight from a chunked queryset
+# iterator. Imports read the upload incrementally, validate each record on its
+# own and upsert by (vendor, name) in IMPORT_BATCH_SIZE batches: one SELECT of
+# the batch's existing products, one bulk INSERT and one bulk UPDATE, each
+# batch in its own transaction. Bulk writes skip Product.save(), so records are
+# validated here against the same rules as ProductForm and Product.clean().
+
+CATALOG_FIELDS = [
+    'name', 'description', 'price', 'category', 'is_featured',
+    'max_quantity', 'track_inventory', 'stock_quantity', 'is_available',
+]
+CATALOG_FORMATS = {'csv': 'text/csv', 'json': 'application/json'}
+EXPORT_CHUNK_SIZE = 2000
+IMPORT_BATCH_SIZE = 500
+READ_CHUNK_SIZE = 64 * 1024
+MAX_REPORTED_ERRORS = 1000
+
+NAME_MAX_LENGTH = Product._meta.get_field('name').max_length
+TRUE_VALUES = {'true', 't', 'yes', 'y', '1', 'on'}
+FALSE_VALUES = {'false', 'f', 'no', 'n', '0', 'off'}
+STOCK_ERROR = 'Stock quantity is required and must be non-negative when inventory tracking is enabled.'
+
+class CatalogError(Exception):
+    """The upload could not be read any further; the message is safe to show to the user"""
+
+class ImportReport:
+    """Outcome of a catalog import: row counts plus (row number, message) errors"""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((number, message))
+
+# Export
+
+def _export_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+def _export_rows(vendor, chunk_size):
+    return (
+        Product.objects.filter(vendor=vendor)
+        .order_by('name', 'id')
+        .values_list(*CATALOG_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+
+def _chunked(lines, chunk_size):
+    """Join lines into chunk_size-line pieces so the response isn't written row by row"""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+class _Echo:
+    """File-like object that hands back what csv.writer writes"""
+
+    def write(self, value):
+        return value
+
+def _csv_lines(vendor, chunk_size):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CATALOG_FIELDS)
+    for row in _export_rows(vendor, chunk_size):
+        yield writer.writerow([_export_value(value) for value in row])
+
+def _json_lines(vendor, chunk_size):
+    yield '['
+    separator = '\n'
+    for row in _export_rows(vendor, chunk_size):
+        record = dict(zip(CATALOG_FIELDS, row))
+        # Prices stay exact as strings; the importer accepts either form
+        record['price'] = str(record['price'])
+        yield separator + json.dumps(record)
+        separator = ',\n'
+    yield '\n]\n'
+
+def stream_catalog(vendor, fmt, chunk_size=EXPORT_CHUNK_SIZE):
+    """Iterator of text chunks for a vendor's catalog in fmt ('csv' or 'json')"""
+    lines = _csv_lines(vendor, chunk_size) if fmt == 'csv' else _json_lines(vendor, chunk_size)
+    return _chunked(lines, chunk_size)
+
+# Import: reading records
+
+def _text(upload):
+    return io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+
+def _csv_records(upload):
+    reader = csv.DictReader(_text(upload))
+    try:
+        if reader.fieldnames is None:
+            raise CatalogError('The CSV file is empty.')
+        reader.fieldnames = [(field or '').strip().lower() for field in reader.fieldnames]
+        if 'name' not in reader.fieldnames:
+            raise CatalogError('The CSV file needs a header row with at least a "name" column.')
+        for record in reader:
+            record.pop(None, None)
+            yield record
+    except csv.Error as e:
+        raise CatalogError(f'Invalid CSV near line {reader.line_num}: {e}')
+
+_WHITESPACE = re.compile(r'\s*')
+
+def _json_records(upload, chunk_size=READ_CHUNK_SIZE):
+    """Yield the items of a top-level JSON array, decoding one item at a time"""
+    text = _text(upload)
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+    state = 'open'
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                if state == 'open':
+                    raise CatalogError('The JSON file is empty.')
+                raise CatalogError('The JSON file ended before the closing "]".')
+            chunk = text.read(chunk_size)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+        char = buffer[pos]
+        if state == 'open':
+            if char != '[':
+                raise CatalogError('A JSON catalog must be a list of products.')
+            pos, state = pos + 1, 'first'
+        elif state in ('first', 'next') and char == ']':
+            return
+        elif state == 'next':
+            if char != ',':
+                raise CatalogError('Invalid JSON: expected "," between products.')
+            pos, state = pos + 1, 'item'
+        else:
+            # 'first' or 'item': decode the next product
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise CatalogError(f'Invalid JSON: {e.msg}.')
+                end = None
+            if end is None or (end == len(buffer) and not eof):
+                # The item may continue in the next chunk
+                chunk = text.read(chunk_size)
+                buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+                continue
+            pos, state = end, 'next'
+            yield record
+
+# Import: validating records
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+def _boolean(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError
+
+def _integer(value):
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, int):
+        return value
+    return int(str(value).strip())
+
+_CATEGORIES = {}
+for key, label in Product.CATEGORY_CHOICES:
+    _CATEGORIES[key] = key
+    _CATEGORIES[label.lower()] = key
+
+def clean_record(record):
+    """
+    Validate one imported record. Returns (values, errors): values holds the
+    cleaned fields present in the record, errors a list of messages.
+    """
+    if not isinstance(record, dict):
+        return {}, ['Each product must be an object with named fields.']
+    record = {str(key).strip().lower(): value for key, value in record.items()}
+    values = {}
+    errors = []
+
+    name = '' if _blank(record.get('name')) else str(record['name']).strip()
+    if not name:
+        errors.append('Name is required.')
+    elif len(name) > NAME_MAX_LENGTH:
+        errors.append(f'Name must be at most {NAME_MAX_LENGTH} characters.')
+    values['name'] = name
+
+    if 'description' in record:
+        values['description'] = None if _blank(record['description']) else str(record['description']).strip()
+
+    if 'price' in record:
+        price = parse_price(record['price'])
+        if price is None or price < 0 or price > MAX_PRICE or price.as_tuple().exponent < -2:
+            errors.append(f'Price must be a number from 0 to {MAX_PRICE} with at most 2 decimal places.')
+        else:
+            values['price'] = price.quantize(Decimal('0.01'))
+
+    if 'category' in record and not _blank(record['category']):
+        category = _CATEGORIES.get(str(record['category']).strip().lower())
+        if category is None:
+            errors.append(f'Unknown category "{record["category"]}".')
+        else:
+            values['category'] = category
+
+    for field in ('is_featured', 'track_inventory', 'is_available'):
+        if field in record and not _blank(record[field]):
+            try:
+                values[field] = _boolean(record[field])
+            except ValueError:
+                errors.append(f'{field} must be true or false.')
+
+    if 'max_quantity' in record and not _blank(record['max_quantity']):
+        try:
+            values['max_quantity'] = _integer(record['max_quantity'])
+            if values['max_quantity'] < 1:
+                raise ValueError
+        except ValueError:
+            errors.append('max_quantity must be a whole number of at least 1.')
+
+    if 'stock_quantity' in record:
+        try:
+            values['stock_quantity'] = None if _blank(record['stock_quantity']) else _integer(record['stock_quantity'])
+        except ValueError:
+            errors.append('stock_quantity must be a whole number.')
+
+    return values, errors
+
+# Import: writing batches
+
+def _import_batch(vendor, batch, report):
+    """Upsert one batch of (row number, values) with a SELECT, a bulk INSERT and a bulk UPDATE"""
+    with transaction.atomic():
+        existing = {}
+        for product in Product.objects.filter(vendor=vendor, name__in=[values['name'] for number, values in batch]).order_by('id'):
+            existing.setdefault(product.name, product)
+
+        to_create = []
+        to_update = []
+        fields = set()
+        for number, values in batch:
+            product = existing.get(values['name'])
+            if product is None:
+                if 'price' not in values:
+                    report.add_error(number, 'Price is required for new products.')
+                    continue
+                product = Product(vendor=vendor, **values)
+            else:
+                for field, value in values.items():
+                    setattr(product, field, value)
+            # Product.clean(), which bulk writes would otherwise skip
+            if product.track_inventory and (product.stock_quantity is None or product.stock_quantity < 0):
+                report.add_error(number, STOCK_ERROR)
+                continue
+            if product.pk is None:
+                to_create.append(product)
+            else:
+                fields.update(values)
+                to_update.append(product)
+
+        Product.objects.bulk_create(to_create)
+        if to_update:
+            now = timezone.now()
+            for product in to_update:
+                product.updated_at = now
+            # reserved_quantity is never in fields, so holds are left alone
+            Product.objects.bulk_update(to_update, sorted(fields - {'name'}) + ['updated_at'])
+
+    report.created += len(to_create)
+    report.updated += len(to_update)
+
+def import_catalog(vendor, upload, fmt, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Create or update a vendor's products from a CSV or JSON upload, matching
+    existing products by name. Columns left out of a record keep their current
+    values (or the model defaults for new products). Invalid records are
+    skipped and reported by row number (counting records from 1, after the
+    CSV header); valid ones are written in batches. Returns an ImportReport.
+    """
+    records = _csv_records(upload) if fmt == 'csv' else _json_records(upload)
+    report = ImportReport()
+    seen = {}
+    batch = []
+    try:
+        for number, record in enumerate(records, start=1):
+            report.rows = number
+            values, errors = clean_record(record)
+            if not errors and values['name'] in seen:
+                errors = [f'Duplicate of row {seen[values["name"]]}; only the first is imported.']
+            if errors:
+                report.add_error(number, ' '.join(errors))
+                continue
+            seen[values['name']] = number
+            batch.append((number, values))
+            if len(batch) >= batch_size:
+                _import_batch(vendor, batch, report)
+                batch = []
+    except CatalogError as e:
+        report.add_error(report.rows + 1, f'{e} Rows after this point were not read.')
+    except UnicodeDecodeError:
+        report.add_error(report.rows + 1, 'The file is not UTF-8 text. Rows after this point were not read.')
+    if batch:
+        _import_batch(vendor, batch, report)
+    report.errors.sort(key=lambda error: error[0])
+
+    if report.created or report.updated:
+        # Bulk writes send no signals
+        products_bulk_updated(vendor.id)
+        search.index_vendor(vendor.id)
+    return report
@@ -0,0 +1,124 @@
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, When
+from django.utils import timezone
+from .models import Product, Cart, CartItem, Order, OrderItem
+from .header_state import invalidate_header_state
+
+# Checkout
+# A cart becomes an order in one transaction with a fixed number of queries:
+#   1. UPDATE the cart row (locks it; on SQLite this takes the write lock)
+#   2. SELECT the items with their products
+#   3. SUM(quantity * price) for the order total
+#   4. one conditional UPDATE decrementing stock for tracked products and
+#      releasing this cart's holds on them
+#   5. INSERT the order
+#   6. bulk INSERT the order items
+#   7. DELETE the cart items
+# The cart is locked by the first statement, so reads and writes all happen
+# while it is held and nothing slow runs inside the transaction.
+
+SHIPPING_FIELDS = ['shipping_address', 'shipping_city', 'shipping_state', 'shipping_zip_code', 'shipping_country']
+
+class CheckoutError(Exception):
+    """Checkout was rejected; the message is safe to show to the user"""
+
+def _decrement_stock(items):
+    """
+    Decrement stock for tracked products in one UPDATE that only touches rows
+    with enough stock once other shoppers' holds are excluded. The same
+    statement releases this cart's holds. Raises CheckoutError (rolling back
+    the transaction) if any product would be oversold.
+    """
+    tracked = {item.product_id: item for item in items if item.product.track_inventory}
+    if not tracked:
+        return
+    quantity = Case(
+        *[When(id=product_id, then=item.quantity) for product_id, item in tracked.items()],
+        output_field=IntegerField(),
+    )
+    held = Case(
+        *[When(id=product_id, then=item.held_quantity) for product_id, item in tracked.items()],
+        output_field=IntegerField(),
+    )
+    updated = Product.objects.filter(
+        id__in=tracked, track_inventory=True,
+        stock_quantity__gte=F('reserved_quantity') - held + quantity,
+    ).update(
+        stock_quantity=F('stock_quantity') - quantity,
+        reserved_quantity=F('reserved_quantity') - held,
+        updated_at=timezone.now(),
+    )
+    if updated != len(tracked):
+        # Only reached on failure: find out which products ran short
+        stock = {
+            row['id']: (row['stock_quantity'] or 0) - row['reserved_quantity']
+            for row in Product.objects.filter(id__in=tracked).values('id', 'stock_quantity', 'reserved_quantity')
+        }
+        short = []
+        for product_id, item in tracked.items():
+            available = max(stock.get(product_id, 0) + item.held_quantity, 0)
+            if available < item.quantity:
+                short.append(f'{item.product.name} ({available} left)')
+        raise CheckoutError('Not enough stock for: ' + ', '.join(short) + '. Please adjust your cart and try again.')
+
+def checkout(user, vendor_id, shipping=None, notes=''):
+    """
+    Convert the user's cart for a vendor into a pending Order.
+    shipping may provide any of SHIPPING_FIELDS. Raises CheckoutError when the
+    cart is empty, a product is unavailable or stock is insufficient; nothing
+    is written in that case.
+    """
+    shipping = {field: (shipping or {}).get(field) or None for field in SHIPPING_FIELDS}
+
+    with transaction.atomic():
+        locked = Cart.objects.filter(user=user, vendor_id=vendor_id).update(updated_at=timezone.now())
+        if not locked:
+            raise CheckoutError('Your cart is empty.')
+
+        items = list(
+            CartItem.objects.filter(cart__user=user, cart__vendor_id=vendor_id)
+            .select_related('product')
+            .order_by('created_at')
+        )
+        if not items:
+            raise CheckoutError('Your cart is empty.')
+
+        unavailable = [item.product.name for item in items if not item.product.is_available]
+        if unavailable:
+            raise CheckoutError('No longer available: ' + ', '.join(unavailable) + '. Please remove them from your cart.')
+
+        total = CartItem.objects.filter(id__in=[item.id for item in items]).aggregate(
+            total=Sum(F('quantity') * F('product__price'))
+        )['total'] or Decimal('0')
+
+        _decrement_stock(items)
+
+        order = Order.objects.create(
+            user=user,
+            vendor_id=vendor_id,
+            cart_id=items[0].cart_id,
+            total_price=Decimal(total).quantize(Decimal('0.01')),
+            buyer_city=shipping['shipping_city'],
+            buyer_state=shipping['shipping_state'],
+            buyer_zip_code=shipping['shipping_zip_code'],
+            notes=notes or None,
+            **shipping,
+        )
+        # bulk_create skips OrderItem.save(), so subtotals are set here
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=item.product,
+                product_name=item.product.name,
+                product_category=item.product.category,
+                quantity=item.quantity,
+                unit_price=item.product.price,
+                subtotal=Decimal(item.quantity) * item.product.price,
+            )
+            for item in items
+        ])
+        CartItem.objects.filter(id__in=[item.id for item in items]).delete()
+
+    invalidate_header_state(user.pk)
+    return order
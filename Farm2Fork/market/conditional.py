@@ -0,0 +1,73 @@
+import hashlib
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max, Sum
+from .models import Vendor, Product, ProductMedia, Review, CartItem, VendorTeamMember
+from .cart import SessionCartBackend
+from .page_cache import get_version, vendor_fragment_scope
+
+# Conditional GET (ETag) validators
+# Each ETag hashes the max timestamps and row counts of the data a page
+# renders. Counts catch deletions, which leave the max timestamp unchanged.
+# There is deliberately no Last-Modified: a timestamp alone can't see
+# deletions, same-second edits, session cart changes or processed media, so a
+# client revalidating with only If-Modified-Since must always get the page.
+
+def _build(parts):
+    """ETag from validator parts"""
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+def catalog_etag(request, *args, **kwargs):
+    """ETag for pages listing every product and vendor"""
+    products = Product.objects.order_by().aggregate(updated=Max('updated_at'), count=Count('id'))
+    vendors = Vendor.objects.order_by().aggregate(updated=Max('updated_at'), count=Count('id'))
+    parts = [
+        request.get_full_path(),
+        products['updated'], products['count'],
+        vendors['updated'], vendors['count'],
+    ]
+    return _build(parts)
+
+def vendor_detail_etag(request, vendor_id):
+    """ETag for a vendor page, including the viewer's cart and team controls"""
+    # Flash messages are rendered into the page, so never answer 304 with them pending
+    if len(get_messages(request)):
+        return None
+    vendor = Vendor.objects.filter(id=vendor_id, is_active=True).values('updated_at').first()
+    if vendor is None:
+        return None
+    products = Product.objects.filter(vendor_id=vendor_id).order_by().aggregate(
+        updated=Max('updated_at'), count=Count('id'),
+    )
+    media = ProductMedia.objects.filter(product__vendor_id=vendor_id).order_by().aggregate(
+        uploaded=Max('uploaded_at'), count=Count('id'),
+    )
+    reviews = Review.objects.filter(vendor_id=vendor_id).order_by().aggregate(
+        created=Max('created_at'), count=Count('id'),
+        response_updated=Max('response__updated_at'), response_count=Count('response'),
+    )
+    parts = [
+        vendor['updated_at'],
+        products['updated'], products['count'],
+        media['uploaded'], media['count'],
+        # Processed variants and primary image changes move no media timestamp;
+        # they bump the product grid's fragment version (images.py)
+        get_version(vendor_fragment_scope(vendor_id, 'products')),
+        reviews['created'], reviews['count'], reviews['response_updated'], reviews['response_count'],
+    ]
+
+    if request.user.is_authenticated:
+        cart = CartItem.objects.filter(cart__user=request.user, cart__vendor_id=vendor_id).order_by().aggregate(
+            updated=Max('updated_at'), quantity=Sum('quantity'), count=Count('id'),
+        )
+        team = VendorTeamMember.objects.filter(vendor_id=vendor_id).order_by().aggregate(
+            joined=Max('joined_at'), count=Count('id'),
+        )
+        parts += [
+            request.user.pk, request.user.is_staff,
+            cart['updated'], cart['quantity'], cart['count'],
+            team['joined'], team['count'],
+        ]
+    else:
+        # Anonymous carts live in the session, which has no timestamp to offer
+        parts.append(SessionCartBackend(request.session).count(vendor_id))
+    return _build(parts)
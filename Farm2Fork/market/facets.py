@@ -0,0 +1,58 @@
+from django.core.cache import cache
+from django.db.models import Count, Min, Max
+from .models import Product
+
+# Facets for the market filter bar: price range and per-category counts
+GLOBAL_FACETS_CACHE_KEY = 'market:facets:global'
+GLOBAL_FACETS_TIMEOUT = 60 * 60
+# Product fields the facets are computed from
+PRODUCT_FIELDS = ('vendor', 'category', 'price')
+
+def compute_facets(products):
+    """
+    Price range and per-category vendor/product counts for a product queryset,
+    computed with a single GROUP BY category query.
+    """
+    rows = products.order_by().values('category').annotate(
+        product_count=Count('id'),
+        vendor_count=Count('vendor', distinct=True),
+        min_price=Min('price'),
+        max_price=Max('price'),
+    )
+    counts = {row['category']: row for row in rows}
+
+    categories = []
+    for value, label in Product.CATEGORY_CHOICES:
+        row = counts.get(value, {})
+        categories.append({
+            'value': value,
+            'label': label,
+            'vendor_count': row.get('vendor_count', 0),
+            'product_count': row.get('product_count', 0),
+        })
+
+    if counts:
+        price_range = {
+            'min': min(row['min_price'] for row in counts.values()),
+            'max': max(row['max_price'] for row in counts.values()),
+        }
+    else:
+        price_range = {'min': 0, 'max': 0}
+
+    return {'price_range': price_range, 'categories': categories}
+
+def global_facets():
+    """Facets across all active vendors, cached until a product changes"""
+    facets = cache.get(GLOBAL_FACETS_CACHE_KEY)
+    if facets is None:
+        facets = compute_facets(Product.objects.filter(vendor__is_active=True))
+        cache.set(GLOBAL_FACETS_CACHE_KEY, facets, GLOBAL_FACETS_TIMEOUT)
+    return facets
+
+def result_facets(vendors):
+    """Facets for the products of a vendor result set"""
+    return compute_facets(Product.objects.filter(vendor__in=vendors.order_by().values('pk')))
+
+def invalidate_global_facets():
+    """Drop the cached global facets"""
+    cache.delete(GLOBAL_FACETS_CACHE_KEY)
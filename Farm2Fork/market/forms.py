@@ -270,7 +270,11 @@ class ProductForm(forms.ModelForm):
             product.vendor = self.vendor
         
         if commit:
-            product.save()
+            if product._state.adding:
+                product.save()
+            else:
+                # is_valid() already ran the model's validation
+                product.save_changed(validate=False)
             # Handle image uploads will be done in the view
         
         return product
@@ -0,0 +1,77 @@
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import transaction
+from .models import Cart, Message, VendorTeamMember
+
+# Header state
+# Everything the site header shows about the viewer (cart counts and totals
+# per vendor, unread messages, vendor teams) in one response, built from three
+# grouped queries. Signed-in viewers' state is cached briefly per user; cart,
+# message and team changes invalidate it (see cart.py, checkout.py, signals.py).
+HEADER_STATE_TIMEOUT = 60
+
+def _cache_key(user_id):
+    return f'market:header:{user_id}'
+
+def invalidate_header_state(user_id):
+    """Drop a user's cached header state once the current transaction commits"""
+    # Deleting earlier would let a concurrent request re-cache pre-commit counts
+    transaction.on_commit(lambda: cache.delete(_cache_key(user_id)))
+
+def _money(value):
+    return str(Decimal(value or 0).quantize(Decimal('0.01')))
+
+def _user_header_state(user):
+    carts = (
+        Cart.objects.filter(user=user).with_totals()
+        .filter(items_quantity__gt=0)
+        .order_by('vendor__name')
+        .values('vendor_id', 'vendor__name', 'items_quantity', 'items_total')
+    )
+    teams = VendorTeamMember.objects.filter(user=user).order_by('vendor__name').values('vendor_id', 'vendor__name', 'is_owner')
+    return {
+        'authenticated': True,
+        'carts': [
+            {
+                'vendor_id': cart['vendor_id'],
+                'vendor_name': cart['vendor__name'],
+                'item_count': cart['items_quantity'],
+                'total_price': _money(cart['items_total']),
+            }
+            for cart in carts
+        ],
+        'unread_messages': Message.objects.filter(recipient=user, is_read=False).count(),
+        'teams': [
+            {'vendor_id': team['vendor_id'], 'vendor_name': team['vendor__name'], 'is_owner': team['is_owner']}
+            for team in teams
+        ],
+    }
+
+def _session_header_state(backend):
+    return {
+        'authenticated': False,
+        'carts': [
+            {
+                'vendor_id': cart.vendor.id,
+                'vendor_name': cart.vendor.name,
+                'item_count': cart.item_count,
+                'total_price': _money(cart.total_price),
+            }
+            for cart in sorted(backend.carts(), key=lambda cart: cart.vendor.name)
+            if cart.item_count
+        ],
+        'unread_messages': 0,
+        'teams': [],
+    }
+
+def get_header_state(user, cart_backend):
+    """Header state for a viewer; anonymous carts come from their session cart backend"""
+    if not user.is_authenticated:
+        return _session_header_state(cart_backend)
+
+    key = _cache_key(user.pk)
+    state = cache.get(key)
+    if state is None:
+        state = _user_header_state(user)
+        cache.set(key, state, HEADER_STATE_TIMEOUT)
+    return state
@@ -0,0 +1,207 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django import forms
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+from .models import Product, ProductMedia
+from .page_cache import bump_vendor_version, bump_fragment_version
+from .blobs import media_file_names, track, retain, release
+
+# Product image variants
+# Uploads are stored as received. After the upload commits, a small worker
+# pool renders each ProductMedia into fixed-size VARIANTS, each as JPEG and
+# WebP, under products/variants/ (content-addressed, like uploads), and
+# records their URLs on the media row (ProductMedia.variants). Templates use
+# the smallest variant that fits (the product_picture tag) and fall back to
+# the original until then.
+# Media left pending by a restart are picked up by process_product_images.
+#
+# Each product also points at its first image (Product.primary_media) and
+# caches that image's thumbnail URL, so listings never query media per row.
+
+# name: ((width, height), crop to exactly that size rather than fit within it)
+VARIANTS = {
+    'thumbnail': ((160, 160), True),
+    'card': ((640, 400), True),
+    'detail': ((1600, 1600), False),
+}
+FORMATS = {
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+}
+EXTENSIONS = {'jpeg': 'jpg', 'webp': 'webp'}
+
+# Worker threads; 0 processes images inline when the upload commits
+IMAGE_WORKERS = getattr(settings, 'MARKET_IMAGE_WORKERS', 2)
+# Threads shared by all requests for validating and storing uploads
+UPLOAD_WORKERS = getattr(settings, 'MARKET_UPLOAD_WORKERS', 4)
+
+logger = logging.getLogger(__name__)
+_executor = None
+_upload_executor = None
+_executor_lock = threading.Lock()
+
+def variant_name(variant, fmt):
+    """Name to store one rendered variant under (the storage replaces it with a content hash)"""
+    return f'products/variants/{variant}.{EXTENSIONS[fmt]}'
+
+def _flatten(image):
+    """RGB copy of an image, with any transparency composited onto white"""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+def render_variants(source):
+    """Render every variant of an image file; returns {(variant, fmt): encoded bytes}"""
+    largest = max(max(size) for size, crop in VARIANTS.values())
+    with Image.open(source) as image:
+        # JPEGs can be decoded at a reduced scale, which is much cheaper
+        image.draft('RGB', (largest, largest))
+        image = _flatten(ImageOps.exif_transpose(image))
+
+    rendered = {}
+    for variant, (size, crop) in VARIANTS.items():
+        if crop:
+            resized = ImageOps.fit(image, size, Image.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+        for fmt, options in FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, **options)
+            rendered[(variant, fmt)] = buffer.getvalue()
+    return rendered
+
+def process_media(media_id):
+    """
+    Render and store a media item's variants and mark it ready (or failed if
+    the upload can't be read as an image). Returns True when variants were
+    stored.
+    """
+    media = ProductMedia.objects.filter(id=media_id).select_related('product').first()
+    if media is None:
+        return False
+    try:
+        with media.image.open('rb') as source:
+            rendered = render_variants(source)
+    except Exception:
+        logger.exception('Could not process product image %s', media_id)
+        ProductMedia.objects.filter(id=media_id).update(processing_state='failed')
+        return False
+
+    storage = media.image.storage
+    previous = media_file_names(media)[1:]
+    names = []
+    variants = {}
+    for (variant, fmt), data in rendered.items():
+        name = storage.save(variant_name(variant, fmt), ContentFile(data))
+        names.append(name)
+        variants.setdefault(variant, {})[fmt] = storage.url(name)
+
+    with transaction.atomic():
+        if not ProductMedia.objects.filter(id=media_id).update(variants=variants, processing_state='ready'):
+            # Deleted while we were working; leave the files to garbage collection
+            track(names)
+            return False
+        retain(names)
+        release(previous)
+    # The product's cached thumbnail can now point at the small variant; listing
+    # ETags (conditional.py) see the change through updated_at
+    Product.objects.filter(id=media.product_id, primary_media_id=media_id).update(
+        thumbnail_url=variants['thumbnail']['jpeg'],
+        updated_at=timezone.now(),
+    )
+    # update() sends no signals; expire pages that show the original instead
+    bump_vendor_version(media.product.vendor_id)
+    bump_fragment_version(media.product.vendor_id, 'products')
+    return True
+
+def thumbnail_url(media):
+    """URL for a media item's thumbnail, the original upload until it's processed"""
+    return media.variant_url('thumbnail') or media.image.url
+
+def refresh_primary_media(product_id):
+    """Point a product at its first image and cache that image's thumbnail URL"""
+    media = ProductMedia.objects.filter(product_id=product_id).order_by('-is_primary', 'order', 'uploaded_at').first()
+    Product.objects.filter(id=product_id).update(
+        primary_media=media,
+        thumbnail_url=thumbnail_url(media) if media else '',
+        updated_at=timezone.now(),
+    )
+
+def _executor_instance():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='market-images')
+        return _executor
+
+def _process_in_worker(media_id):
+    # Worker threads get their own database connections; don't leave them open
+    close_old_connections()
+    try:
+        process_media(media_id)
+    except Exception:
+        logger.exception('Product image worker failed on %s', media_id)
+    finally:
+        close_old_connections()
+
+def _submit(media_id):
+    if IMAGE_WORKERS <= 0:
+        process_media(media_id)
+    else:
+        _executor_instance().submit(_process_in_worker, media_id)
+
+def schedule_processing(media_id):
+    """Queue a media item for processing once the current transaction commits"""
+    transaction.on_commit(lambda: _submit(media_id))
+
+# Uploads
+# Multi-image uploads are validated (Pillow verify) and written to storage in
+# parallel on a bounded pool shared by all requests, so a request waits about
+# as long as its slowest image. The caller then inserts every ProductMedia row
+# with one bulk_create (see product_media_bulk_created in signals.py).
+
+def _upload_executor_instance():
+    global _upload_executor
+    with _executor_lock:
+        if _upload_executor is None:
+            _upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='market-uploads')
+        return _upload_executor
+
+def _store_upload(upload):
+    """Validate and store one upload; returns (storage name, None) or (None, error message)"""
+    try:
+        forms.ImageField().clean(upload)
+    except ValidationError as e:
+        return None, f'{upload.name}: {e.messages[0]}'
+    field = ProductMedia._meta.get_field('image')
+    name = field.storage.save(field.generate_filename(None, upload.name), upload, max_length=field.max_length)
+    return name, None
+
+def store_uploads(uploads):
+    """
+    Validate and store uploaded images in parallel. Returns (names, errors):
+    storage names in upload order, and one message per invalid image. When
+    anything is invalid the stored files are left for garbage collection.
+    """
+    if not uploads:
+        return [], []
+    if len(uploads) == 1:
+        results = [_store_upload(uploads[0])]
+    else:
+        results = list(_upload_executor_instance().map(_store_upload, uploads))
+    names = [name for name, error in results if name]
+    errors = [error for name, error in results if error]
+    if errors:
+        track(names)
+    return names, errors
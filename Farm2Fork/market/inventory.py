@@ -0,0 +1,164 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, When
+from django.utils import timezone
+from .models import Product, CartItem
+
+# Inventory reservations
+# Adding a tracked product to a signed-in shopper's cart places a hold on that
+# many units for HOLD_TTL. Holds are counted in Product.reserved_quantity and
+# recorded per cart item (CartItem.held_quantity / hold_expires_at), so
+#   available to promise = stock_quantity - reserved_quantity
+# and placing or releasing a hold is one conditional UPDATE on the product row
+# (WHERE stock_quantity - reserved_quantity >= n), which stays correct under
+# concurrent writers without locking anything up front.
+#
+# Expired holds keep counting until sweep_expired_holds() releases them in
+# batches. Reservation failures sweep the product's own expired holds first,
+# so an unswept hold never blocks another shopper.
+
+HOLD_TTL = timedelta(minutes=15)
+SWEEP_BATCH_SIZE = 500
+
+class InsufficientStock(Exception):
+    """Not enough unreserved stock; available is what could still be promised"""
+
+    def __init__(self, product, available):
+        self.product = product
+        self.available = max(available, 0)
+        super().__init__(f'Only {self.available} {product.name} available.')
+
+def hold_expiry():
+    """Expiry time for a hold placed now"""
+    return timezone.now() + HOLD_TTL
+
+def available_to_promise(product_id):
+    """Stock minus active holds for a tracked product, or None if untracked"""
+    row = Product.objects.filter(id=product_id).values('track_inventory', 'stock_quantity', 'reserved_quantity').first()
+    if row is None or not row['track_inventory']:
+        return None
+    return max((row['stock_quantity'] or 0) - row['reserved_quantity'], 0)
+
+def _try_reserve(product_id, quantity):
+    return Product.objects.filter(
+        id=product_id,
+        track_inventory=True,
+        stock_quantity__gte=F('reserved_quantity') + quantity,
+    ).update(reserved_quantity=F('reserved_quantity') + quantity) == 1
+
+def reserve(product, quantity):
+    """
+    Add quantity to a tracked product's reserved count with one conditional
+    UPDATE. Raises InsufficientStock if fewer units are available. The caller
+    records the hold on its cart item in the same transaction.
+    """
+    if quantity <= 0 or not product.track_inventory:
+        return
+    if _try_reserve(product.id, quantity):
+        return
+    # Expired holds may be what is in the way; release them and retry once
+    if release_expired(CartItem.objects.filter(product_id=product.id)) and _try_reserve(product.id, quantity):
+        return
+    raise InsufficientStock(product, available_to_promise(product.id) or 0)
+
+def release(product_id, quantity):
+    """Give quantity held units of a product back"""
+    if quantity > 0:
+        Product.objects.filter(id=product_id).update(reserved_quantity=F('reserved_quantity') - quantity)
+
+def _per_product(amounts):
+    """CASE expression mapping product ids to amounts"""
+    return Case(
+        *[When(id=product_id, then=amount) for product_id, amount in amounts.items()],
+        output_field=IntegerField(),
+    )
+
+class _Shortfall(Exception):
+    """A multi-product reservation could not cover every product"""
+
+def _try_reserve_many(amounts):
+    """One conditional UPDATE for all products, rolled back unless every row was covered"""
+    try:
+        with transaction.atomic():
+            updated = Product.objects.filter(
+                id__in=amounts, track_inventory=True,
+                stock_quantity__gte=F('reserved_quantity') + _per_product(amounts),
+            ).update(reserved_quantity=F('reserved_quantity') + _per_product(amounts))
+            if updated != len(amounts):
+                raise _Shortfall
+    except _Shortfall:
+        return False
+    return True
+
+def reserve_many(products, amounts):
+    """
+    Reserve amounts ({product_id: units}) for several tracked products with
+    one conditional UPDATE; either every product is reserved or none is.
+    products maps ids to Product instances for the error message. Raises
+    InsufficientStock naming a product that cannot be covered.
+    """
+    amounts = {product_id: amount for product_id, amount in amounts.items() if amount > 0}
+    if not amounts or _try_reserve_many(amounts):
+        return
+    if release_expired(CartItem.objects.filter(product_id__in=amounts)) and _try_reserve_many(amounts):
+        return
+    rows = Product.objects.filter(id__in=amounts).values_list('id', 'stock_quantity', 'reserved_quantity')
+    available = {product_id: (stock or 0) - reserved for product_id, stock, reserved in rows}
+    short = [product_id for product_id, amount in amounts.items() if available.get(product_id, 0) < amount]
+    product_id = short[0] if short else next(iter(amounts))
+    raise InsufficientStock(products[product_id], available.get(product_id, 0))
+
+def release_many(amounts):
+    """Give back held units for several products ({product_id: units}) in one UPDATE"""
+    amounts = {product_id: amount for product_id, amount in amounts.items() if amount > 0}
+    if amounts:
+        Product.objects.filter(id__in=amounts).update(reserved_quantity=F('reserved_quantity') - _per_product(amounts))
+
+def release_holds(items, clear=True):
+    """
+    Release every hold on a CartItem queryset in a fixed number of queries:
+    one grouped SUM, one UPDATE of the products and, with clear, one UPDATE
+    zeroing the items' holds (skip it when the items are about to be deleted).
+    Returns the number of units released.
+    """
+    held = dict(
+        items.filter(held_quantity__gt=0).order_by()
+        .values('product_id').annotate(held=Sum('held_quantity'))
+        .values_list('product_id', 'held')
+    )
+    if not held:
+        return 0
+    release_many(held)
+    if clear:
+        items.filter(held_quantity__gt=0).update(held_quantity=0, hold_expires_at=None)
+    return sum(held.values())
+
+def release_expired(items, now=None):
+    """Release the expired holds among a CartItem queryset; returns the units released"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        # Lock first: PostgreSQL rejects FOR UPDATE on release_holds' GROUP BY
+        locked_ids = list(
+            items.filter(held_quantity__gt=0, hold_expires_at__lte=now)
+            .select_for_update().values_list('id', flat=True)
+        )
+        if not locked_ids:
+            return 0
+        return release_holds(CartItem.objects.filter(id__in=locked_ids))
+
+def sweep_expired_holds(batch_size=SWEEP_BATCH_SIZE):
+    """
+    Release all expired holds, batch_size cart items per transaction so locks
+    are held briefly. Returns (items swept, units released).
+    """
+    now = timezone.now()
+    swept = released = 0
+    while True:
+        ids = list(
+            CartItem.objects.filter(held_quantity__gt=0, hold_expires_at__lte=now)
+            .order_by('hold_expires_at').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return swept, released
+        released += release_expired(CartItem.objects.filter(id__in=ids), now=now)
+        swept += len(ids)
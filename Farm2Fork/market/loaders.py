@@ -0,0 +1,69 @@
+from django.shortcuts import get_object_or_404
+from django.utils.functional import SimpleLazyObject
+from .models import Vendor, Product, Review, VendorTeamMember, VendorStats
+from .cart import get_cart_backend
+
+# Page loaders
+# Each loader fetches everything a page renders in a small, fixed number of
+# queries and returns ready-made template context.
+
+RECENT_REVIEWS = 5
+
+def load_vendor_page(request, vendor_id):
+    """
+    Context for vendor_detail.
+    Queries: vendor + stats, products, product media, recent reviews with
+    responses, and for signed-in users the cart count and team membership
+    (anonymous cart counts come from the session).
+    The count does not grow with the number of products or reviews, and the
+    product and review queries are skipped when their fragments are cached.
+    """
+    vendor = get_object_or_404(Vendor.objects.select_related('stats'), id=vendor_id, is_active=True)
+
+    # Aggregates come from the denormalized stats row; vendors without one
+    # (not yet backfilled) get an unsaved row computed on the fly
+    try:
+        stats = vendor.stats
+    except VendorStats.DoesNotExist:
+        stats = VendorStats(vendor=vendor, **VendorStats.review_values(vendor.id), **VendorStats.product_values(vendor.id))
+
+    # Products and reviews are only rendered inside cached template fragments,
+    # so they are loaded lazily and skipped entirely on a fragment cache hit
+    catalog = SimpleLazyObject(lambda: _load_vendor_products(vendor))
+    reviews = SimpleLazyObject(lambda: _load_recent_reviews(vendor))
+
+    user = request.user
+    cart_item_count = get_cart_backend(request).count(vendor.id)
+    can_manage_vendor = False
+    if user.is_authenticated:
+        can_manage_vendor = user.is_staff or VendorTeamMember.objects.filter(user=user, vendor=vendor).exists()
+
+    return {
+        'vendor': vendor,
+        'stats': stats,
+        'featured_products': SimpleLazyObject(lambda: catalog['featured_products']),
+        'products_by_category': SimpleLazyObject(lambda: catalog['products_by_category']),
+        'reviews': reviews,
+        'cart_item_count': cart_item_count,
+        'can_manage_vendor': can_manage_vendor,
+    }
+
+def _load_vendor_products(vendor):
+    """Vendor's products with their primary image, featured and grouped by category"""
+    products = Product.objects.filter(vendor=vendor).select_related('primary_media')
+
+    featured_products = []
+    products_by_category = {}
+    for product in products:
+        product.vendor = vendor
+        if product.is_featured:
+            featured_products.append(product)
+        products_by_category.setdefault(product.get_category_display(), []).append(product)
+    return {'featured_products': featured_products, 'products_by_category': products_by_category}
+
+def _load_recent_reviews(vendor):
+    """Latest reviews with their responses"""
+    reviews = list(Review.objects.filter(vendor=vendor).select_related('response')[:RECENT_REVIEWS])
+    for review in reviews:
+        review.vendor = vendor
+    return reviews
@@ -0,0 +1,79 @@
+import threading
+import time
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+from market.cart import add_item, CartError
+from market.models import Vendor, Product, CartItem
+
+
+class Command(BaseCommand):
+    help = 'Benchmark inventory holds on a single hot product: concurrent shoppers adding it to their carts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent shoppers (default 8)')
+        parser.add_argument('--adds', type=int, default=50, help='Add-to-cart attempts per shopper (default 50)')
+        parser.add_argument('--stock', type=int, default=200, help='Units in stock (default 200)')
+
+    def handle(self, *args, **options):
+        threads, adds, stock = options['threads'], options['adds'], options['stock']
+
+        # Scratch data, removed again at the end even if the run fails or is interrupted
+        vendor = Vendor.objects.create(
+            name=f'Reservation Benchmark {time.time_ns()}', email='benchmark@example.com', phone='0',
+            city='-', state='-', zip_code='0', country='-', is_active=False,
+        )
+        try:
+            self.benchmark(vendor, threads, adds, stock)
+        finally:
+            User.objects.filter(username__startswith=f'benchmark-{vendor.id}-').delete()
+            vendor.delete()
+
+    def benchmark(self, vendor, threads, adds, stock):
+        product = Product.objects.create(
+            vendor=vendor, name='Hot product', price=Decimal('1.00'),
+            max_quantity=adds, track_inventory=True, stock_quantity=stock,
+        )
+        users = [User.objects.create(username=f'benchmark-{vendor.id}-{i}') for i in range(threads)]
+
+        counts = {'held': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        start = threading.Barrier(threads + 1)
+
+        def shopper(user):
+            try:
+                start.wait()
+                for _ in range(adds):
+                    try:
+                        add_item(user, product, 1)
+                        outcome = 'held'
+                    except CartError:
+                        outcome = 'rejected'
+                    except OperationalError:
+                        outcome = 'errors'
+                    with lock:
+                        counts[outcome] += 1
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=shopper, args=(user,)) for user in users]
+        for worker in workers:
+            worker.start()
+        start.wait()
+        began = time.perf_counter()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - began
+
+        product.refresh_from_db()
+        in_carts = sum(CartItem.objects.filter(product=product).values_list('held_quantity', flat=True))
+        attempts = threads * adds
+        self.stdout.write(f'{attempts} attempts by {threads} shoppers in {elapsed:.2f}s: {attempts / elapsed:.0f} ops/s')
+        self.stdout.write(f"held {counts['held']}, rejected {counts['rejected']}, lock errors {counts['errors']}")
+        self.stdout.write(f'stock {product.stock_quantity}, reserved {product.reserved_quantity}, held in carts {in_carts}')
+
+        if product.reserved_quantity == in_carts == counts['held'] <= stock:
+            self.stdout.write(self.style.SUCCESS('Reservations consistent: no oversell, no lost holds'))
+        else:
+            self.stdout.write(self.style.ERROR('Reservation counts do not match'))
@@ -0,0 +1,35 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from market.blobs import recount, collect_garbage, collect_orphans, GC_GRACE, GC_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete stored media files that no product image references any more '
+        '(run periodically, e.g. nightly from cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=GC_GRACE.total_seconds() / 3600,
+                            help='Only delete files unreferenced for at least this long (default 24)')
+        parser.add_argument('--batch-size', type=int, default=GC_BATCH_SIZE, help=f'Blobs per batch (default {GC_BATCH_SIZE})')
+        parser.add_argument('--recount', action='store_true', help='Rebuild reference counts from the media records first')
+        parser.add_argument('--scan', action='store_true', help='Also delete files in media storage that nothing knows about')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+
+    def handle(self, *args, **options):
+        grace = timedelta(hours=options['grace_hours'])
+        dry_run = options['dry_run']
+
+        if options['recount']:
+            referenced = recount()
+            self.stdout.write(f'Recounted references: {referenced} file(s) in use')
+
+        deleted, freed = collect_garbage(grace=grace, batch_size=options['batch_size'], dry_run=dry_run)
+        if options['scan']:
+            orphans, orphan_bytes = collect_orphans(grace=grace, dry_run=dry_run)
+            deleted += orphans
+            freed += orphan_bytes
+
+        verb = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {deleted} unreferenced file(s), {freed / 1024 / 1024:.1f} MB'))
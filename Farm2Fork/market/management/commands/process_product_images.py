@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from market.images import process_media, IMAGE_WORKERS
+from market.models import ProductMedia
+
+
+class Command(BaseCommand):
+    help = (
+        'Render resized variants for product images that have not been processed yet '
+        '(e.g. uploads from before the image pipeline, or left pending by a restart)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-render every image, not only pending ones')
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry images that failed before')
+        parser.add_argument('--workers', type=int, default=max(IMAGE_WORKERS, 1), help='Images processed in parallel')
+
+    def handle(self, *args, **options):
+        media = ProductMedia.objects.order_by('id')
+        if not options['all']:
+            states = ['pending', 'failed'] if options['retry_failed'] else ['pending']
+            media = media.filter(processing_state__in=states)
+        media_ids = list(media.values_list('id', flat=True))
+
+        with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as pool:
+            results = list(pool.map(self.process, media_ids))
+
+        processed = sum(results)
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} of {len(media_ids)} image(s)'
+            + (f'; {len(media_ids) - processed} failed' if processed < len(media_ids) else '')
+        ))
+
+    def process(self, media_id):
+        close_old_connections()
+        try:
+            return process_media(media_id)
+        finally:
+            close_old_connections()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from market import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over vendors and their products'
+
+    def handle(self, *args, **options):
+        if not search.is_enabled():
+            self.stdout.write(self.style.ERROR('Full-text search requires the SQLite database backend'))
+            return
+        
+        indexed = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} vendor(s)'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from market.models import Vendor, VendorStats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized VendorStats rows (ratings, price ranges, product counts, categories)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vendor-id', type=int, help='Vendor ID to rebuild (rebuilds all vendors if not specified)')
+
+    def handle(self, *args, **options):
+        vendor_id = options.get('vendor_id')
+        
+        vendor_ids = Vendor.objects.order_by('id').values_list('id', flat=True)
+        if vendor_id:
+            vendor_ids = vendor_ids.filter(id=vendor_id)
+            if not vendor_ids.exists():
+                self.stdout.write(self.style.ERROR(f'Vendor with ID {vendor_id} not found'))
+                return
+        
+        rebuilt = 0
+        for vid in vendor_ids.iterator():
+            VendorStats.rebuild(vid)
+            rebuilt += 1
+        
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt stats for {rebuilt} vendor(s)'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from market.inventory import sweep_expired_holds, SWEEP_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Release expired inventory holds on cart items (run periodically, e.g. every few minutes from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE, help=f'Cart items per transaction (default {SWEEP_BATCH_SIZE})')
+
+    def handle(self, *args, **options):
+        swept, released = sweep_expired_holds(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {released} unit(s) held by {swept} cart item(s)'))
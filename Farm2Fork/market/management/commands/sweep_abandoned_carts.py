@@ -0,0 +1,134 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Sum, DecimalField
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from market.inventory import release_holds
+from market.models import Cart, CartItem, AbandonedCartStats
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete carts not touched in N days, batch by batch. Each batch is re-checked under lock, '
+        'summarised into AbandonedCartStats (per vendor and day) for the vendor dashboard and its '
+        'holds released in one short transaction; its items are then deleted in chunks of '
+        '--chunk-size rows, one transaction each, and the carts last.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Carts idle for at least this many days are removed (default 30)')
+        parser.add_argument('--batch-size', type=int, default=200, help='Carts per batch (default 200)')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Cart items per DELETE statement (default 500)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be removed')
+
+    def stale_carts(self, cutoff):
+        """Carts whose row and items were all last changed before the cutoff"""
+        recent_items = CartItem.objects.filter(cart=OuterRef('pk'), updated_at__gte=cutoff)
+        return Cart.objects.filter(updated_at__lt=cutoff).exclude(Exists(recent_items))
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        batch_size = options['batch_size']
+        chunk_size = options['chunk_size']
+
+        if options['dry_run']:
+            stale = self.stale_carts(cutoff)
+            items = CartItem.objects.filter(cart__in=stale).aggregate(count=Count('id'), quantity=Sum('quantity'))
+            self.stdout.write(f"Would remove {stale.count()} cart(s) with {items['count']} item row(s) ({items['quantity'] or 0} units)")
+            return
+
+        carts = items = 0
+        while True:
+            cart_ids = list(
+                self.stale_carts(cutoff).order_by('updated_at', 'id').values_list('id', flat=True)[:batch_size]
+            )
+            if not cart_ids:
+                break
+            removed_carts, removed_items = self.remove_batch(cart_ids, chunk_size, cutoff)
+            carts += removed_carts
+            items += removed_items
+            self.stdout.write(f'Removed {carts} cart(s) so far...')
+
+        self.stdout.write(self.style.SUCCESS(f'Removed {carts} abandoned cart(s) with {items} item row(s)'))
+
+    def remove_batch(self, cart_ids, chunk_size, cutoff):
+        """Record stats for a batch of carts, then delete them; returns (carts, item rows) deleted"""
+        # Lock the carts and re-check that they are still stale (a shopper may
+        # have touched one since the batch was selected), record them and
+        # release their holds; that is the only transaction spanning the batch
+        with transaction.atomic():
+            cart_ids = list(
+                self.stale_carts(cutoff).select_for_update().filter(id__in=cart_ids)
+                .order_by('id').values_list('id', flat=True)
+            )
+            if not cart_ids:
+                return 0, 0
+            self.record_stats(cart_ids)
+            release_holds(CartItem.objects.filter(cart_id__in=cart_ids))
+            item_ids = list(CartItem.objects.filter(cart_id__in=cart_ids).order_by('id').values_list('id', flat=True))
+
+        # Each chunk commits on its own, so no write lock outlives one DELETE.
+        # Items changed since the check above are in use again and stay, and so
+        # do their carts (stale_carts excludes them below)
+        items = 0
+        for start in range(0, len(item_ids), chunk_size):
+            with transaction.atomic():
+                chunk = CartItem.objects.filter(id__in=item_ids[start:start + chunk_size], updated_at__lt=cutoff)
+                items += chunk.delete()[1].get(CartItem._meta.label, 0)
+
+        # The Cart pre_delete receiver (signals.release_cart_holds) makes this
+        # fetch the carts and run one (empty) hold query per cart; that is
+        # bounded by --batch-size and keeps header state invalidation intact
+        with transaction.atomic():
+            carts = self.stale_carts(cutoff).filter(id__in=cart_ids).delete()[1].get(Cart._meta.label, 0)
+        return carts, items
+
+    def record_stats(self, cart_ids):
+        """Add a batch's carts, quantities and value to the per-vendor, per-day stats"""
+        carts = (
+            Cart.objects.filter(id__in=cart_ids).order_by()
+            .values('vendor_id', day=TruncDate('updated_at'))
+            .annotate(count=Count('id'))
+        )
+        contents = (
+            CartItem.objects.filter(cart_id__in=cart_ids).order_by()
+            .values('cart__vendor_id', day=TruncDate('cart__updated_at'))
+            .annotate(
+                units=Sum('quantity'),
+                value=Sum(F('quantity') * F('product__price'), output_field=DecimalField(max_digits=12, decimal_places=2)),
+            )
+        )
+        totals = {}
+        for row in carts:
+            totals[(row['vendor_id'], row['day'])] = [row['count'], 0, Decimal('0.00')]
+        for row in contents:
+            entry = totals.setdefault((row['cart__vendor_id'], row['day']), [0, 0, Decimal('0.00')])
+            entry[1] += row['units'] or 0
+            entry[2] += Decimal(row['value'] or 0).quantize(Decimal('0.01'))
+
+        existing = {
+            (stats.vendor_id, stats.date): stats
+            for stats in AbandonedCartStats.objects.filter(
+                vendor_id__in={vendor_id for vendor_id, day in totals},
+                date__in={day for vendor_id, day in totals},
+            )
+        }
+        to_create = []
+        to_update = []
+        for (vendor_id, day), (cart_count, item_count, value) in totals.items():
+            stats = existing.get((vendor_id, day))
+            if stats is None:
+                to_create.append(AbandonedCartStats(
+                    vendor_id=vendor_id, date=day,
+                    cart_count=cart_count, item_count=item_count, total_value=value,
+                ))
+            else:
+                stats.cart_count += cart_count
+                stats.item_count += item_count
+                stats.total_value += value
+                stats.updated_at = timezone.now()
+                to_update.append(stats)
+        AbandonedCartStats.objects.bulk_create(to_create)
+        AbandonedCartStats.objects.bulk_update(to_update, ['cart_count', 'item_count', 'total_value', 'updated_at'])
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0009_order_orderitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorStats',
+            fields=[
+                ('vendor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='market.vendor')),
+                ('review_count', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=6, null=True)),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=6, null=True)),
+                ('product_count', models.IntegerField(default=0, help_text='Number of available products')),
+                ('category_mask', models.IntegerField(default=0, help_text='Bitmask of product categories (bit index follows Product.CATEGORY_CHOICES)')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'vendor stats',
+            },
+        ),
+    ]
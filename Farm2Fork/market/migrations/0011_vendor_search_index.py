@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS market_vendorsearch USING fts5(
+            name, description, story_mission, service_area, product_names, product_descriptions,
+            tokenize = 'porter unicode61 remove_diacritics 2'
+        )
+    ''')
+    schema_editor.execute('''
+        INSERT INTO market_vendorsearch (rowid, name, description, story_mission, service_area, product_names, product_descriptions)
+        SELECT v.id, v.name, COALESCE(v.description, ''), COALESCE(v.story_mission, ''),
+               COALESCE(v.service_area, ''),
+               COALESCE((SELECT group_concat(p.name, ' ') FROM market_product p WHERE p.vendor_id = v.id), ''),
+               COALESCE((SELECT group_concat(p.description, ' ') FROM market_product p WHERE p.vendor_id = v.id), '')
+        FROM market_vendor v
+    ''')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS market_vendorsearch')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0010_vendorstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0011_vendor_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='held_quantity',
+            field=models.IntegerField(default=0, help_text='Units of this item reserved from stock (tracked products only)'),
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='hold_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='reserved_quantity',
+            field=models.IntegerField(default=0, editable=False, help_text="Units held in shoppers' carts (see inventory.py)"),
+        ),
+    ]
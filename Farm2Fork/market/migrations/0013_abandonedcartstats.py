@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:41
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0012_inventory_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AbandonedCartStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='Day the carts were last active')),
+                ('cart_count', models.IntegerField(default=0)),
+                ('item_count', models.IntegerField(default=0, help_text='Total quantity of items in the carts')),
+                ('total_value', models.DecimalField(decimal_places=2, default=Decimal('0.00'), help_text='Value of the carts at prices when swept', max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='abandoned_cart_stats', to='market.vendor')),
+            ],
+            options={
+                'verbose_name_plural': 'abandoned cart stats',
+                'ordering': ['-date'],
+                'unique_together': {('vendor', 'date')},
+            },
+        ),
+    ]
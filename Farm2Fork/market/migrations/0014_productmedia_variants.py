@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0013_abandonedcartstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productmedia',
+            name='processing_state',
+            field=models.CharField(choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='productmedia',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Resized image URLs by variant and format (see images.py)'),
+        ),
+    ]
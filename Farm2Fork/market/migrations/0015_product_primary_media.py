@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_primary_media(apps, schema_editor):
+    """Point existing products at their first image (primary first, then by order)"""
+    Product = apps.get_model('market', 'Product')
+    ProductMedia = apps.get_model('market', 'ProductMedia')
+    first = {}
+    for media in ProductMedia.objects.order_by('product_id', '-is_primary', 'order', 'uploaded_at').iterator():
+        first.setdefault(media.product_id, media)
+    products = []
+    for product_id, media in first.items():
+        thumbnail = (media.variants or {}).get('thumbnail', {}).get('jpeg') or media.image.url
+        products.append(Product(id=product_id, primary_media_id=media.id, thumbnail_url=thumbnail))
+    Product.objects.bulk_update(products, ['primary_media', 'thumbnail_url'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0014_productmedia_variants'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='productmedia',
+            options={'ordering': ['-is_primary', 'order', 'uploaded_at']},
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='primary_media',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='market.productmedia'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='thumbnail_url',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_primary_media, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:53
+
+from django.db import migrations, models
+import market.storage
+from collections import Counter
+
+
+def count_references(apps, schema_editor):
+    """Create blob rows for the files existing media use (uploads and variants)"""
+    ProductMedia = apps.get_model('market', 'ProductMedia')
+    MediaBlob = apps.get_model('market', 'MediaBlob')
+    base_url = market.storage.media_storage().base_url
+    counts = Counter()
+    for media in ProductMedia.objects.only('image', 'variants').iterator():
+        if media.image.name:
+            counts[media.image.name] += 1
+        for formats in (media.variants or {}).values():
+            for url in formats.values():
+                if url and url.startswith(base_url):
+                    counts[url[len(base_url):]] += 1
+    MediaBlob.objects.bulk_create(
+        [MediaBlob(name=name, ref_count=count) for name, count in counts.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0015_product_primary_media'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Storage name (content hash)', max_length=255, unique=True)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='productmedia',
+            name='image',
+            field=models.ImageField(storage=market.storage.media_storage, upload_to='products/'),
+        ),
+        migrations.RunPython(count_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:58
+
+from django.db import migrations, models
+
+
+def check_tracked_stock(apps, schema_editor):
+    """
+    Refuse to add the constraint over rows that break it. The data is left
+    for a person to fix: set the stock, or turn off inventory tracking.
+    """
+    Product = apps.get_model('market', 'Product')
+    offending = list(
+        Product.objects.filter(track_inventory=True)
+        .filter(models.Q(stock_quantity__isnull=True) | models.Q(stock_quantity__lt=0))
+        .order_by('id')
+        .values_list('id', 'name', 'stock_quantity')
+    )
+    if offending:
+        rows = '\n'.join(f'  product {id} ({name!r}): stock_quantity={stock}' for id, name, stock in offending)
+        raise RuntimeError(
+            'Products tracking inventory need a non-negative stock_quantity before '
+            'product_tracked_stock_non_negative can be added. Fix these rows and migrate again:\n' + rows
+        )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0016_mediablob'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_tracked_stock, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.CheckConstraint(check=models.Q(('track_inventory', False), models.Q(('stock_quantity__gte', 0), ('stock_quantity__isnull', False)), _connector='OR'), name='product_tracked_stock_non_negative'),
+        ),
+    ]
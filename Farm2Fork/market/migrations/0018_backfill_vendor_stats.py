@@ -0,0 +1,58 @@
+from django.db import migrations
+from django.db.models import Count, Max, Min, Q, Sum
+
+# Category keys in Product.CATEGORY_CHOICES order, which fixes the bits of category_mask
+CATEGORY_KEYS = ['vegetables', 'fruits', 'dairy', 'meat', 'grains', 'herbs', 'prepared', 'other']
+
+
+def backfill_vendor_stats(apps, schema_editor):
+    """Create the stats row of every vendor that has none"""
+    Vendor = apps.get_model('market', 'Vendor')
+    VendorStats = apps.get_model('market', 'VendorStats')
+    Product = apps.get_model('market', 'Product')
+    Review = apps.get_model('market', 'Review')
+    vendor_ids = list(Vendor.objects.filter(stats__isnull=True).values_list('id', flat=True))
+    if not vendor_ids:
+        return
+    reviews = {
+        row['vendor_id']: row
+        for row in Review.objects.filter(vendor_id__in=vendor_ids).order_by()
+        .values('vendor_id').annotate(review_count=Count('id'), rating_sum=Sum('rating'))
+    }
+    products = {
+        row['vendor_id']: row
+        for row in Product.objects.filter(vendor_id__in=vendor_ids).order_by()
+        .values('vendor_id').annotate(
+            min_price=Min('price'), max_price=Max('price'),
+            product_count=Count('id', filter=Q(is_available=True)),
+        )
+    }
+    masks = {}
+    for vendor_id, category in Product.objects.filter(vendor_id__in=vendor_ids).order_by().values_list('vendor_id', 'category').distinct():
+        if category in CATEGORY_KEYS:
+            masks[vendor_id] = masks.get(vendor_id, 0) | (1 << CATEGORY_KEYS.index(category))
+    rows = []
+    for vendor_id in vendor_ids:
+        review = reviews.get(vendor_id, {})
+        product = products.get(vendor_id, {})
+        rows.append(VendorStats(
+            vendor_id=vendor_id,
+            review_count=review.get('review_count', 0),
+            rating_sum=review.get('rating_sum') or 0,
+            min_price=product.get('min_price'),
+            max_price=product.get('max_price'),
+            product_count=product.get('product_count', 0),
+            category_mask=masks.get(vendor_id, 0),
+        ))
+    VendorStats.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0017_product_tracked_stock_check'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_vendor_stats, migrations.RunPython.noop),
+    ]
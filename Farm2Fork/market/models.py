@@ -1,7 +1,10 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from decimal import Decimal
+from .storage import media_storage
 
 # Vendor Application Model - stores applications before approval
 class VendorApplication(models.Model):
@@ -64,7 +67,11 @@ class Vendor(models.Model):
     
     @property
     def average_rating(self):
-        """Calculate average rating from reviews"""
+        """Average rating, read from the denormalized VendorStats row when available"""
+        try:
+            return self.stats.average_rating
+        except VendorStats.DoesNotExist:
+            pass
         reviews = self.reviews.all()
         if reviews.exists():
             return round(sum(review.rating for review in reviews) / reviews.count(), 1)
@@ -72,7 +79,11 @@ class Vendor(models.Model):
     
     @property
     def price_range(self):
-        """Get price range of vendor's products"""
+        """Price range of vendor's products, read from VendorStats when available"""
+        try:
+            return self.stats.price_range
+        except VendorStats.DoesNotExist:
+            pass
         products = self.products.all()
         if products.exists():
             prices = [product.price for product in products]
@@ -111,14 +122,27 @@ class Product(models.Model):
     max_quantity = models.IntegerField(default=100, help_text="Maximum quantity that can be ordered per customer")
     track_inventory = models.BooleanField(default=False, help_text="Enable inventory tracking for this product")
     stock_quantity = models.IntegerField(null=True, blank=True, help_text="Current stock quantity (required if inventory tracking enabled)")
+    reserved_quantity = models.IntegerField(default=0, editable=False, help_text="Units held in shoppers' carts (see inventory.py)")
     is_available = models.BooleanField(default=True, help_text="Product availability status")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name='products')
+    # Denormalized first image (primary first, then by order) and its thumbnail
+    # URL, kept current by the ProductMedia signals so listings need no media queries
+    primary_media = models.ForeignKey('ProductMedia', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
+    thumbnail_url = models.CharField(max_length=255, blank=True, default='', editable=False)
     
     class Meta:
         app_label = 'market'
         ordering = ['-is_featured', 'name']
+        constraints = [
+            # Same invariant as clean(), enforced for writes that skip it
+            # (queryset updates, bulk_create/bulk_update, save_changed(validate=False))
+            models.CheckConstraint(
+                check=models.Q(track_inventory=False) | models.Q(stock_quantity__isnull=False, stock_quantity__gte=0),
+                name='product_tracked_stock_non_negative',
+            ),
+        ]
     
     def __str__(self):
         return self.name
@@ -130,9 +154,82 @@ class Product(models.Model):
                 'stock_quantity': 'Stock quantity is required and must be non-negative when inventory tracking is enabled.'
             })
     
+    @property
+    def available_to_promise(self):
+        """Stock not held in carts, or None when inventory is not tracked"""
+        if not self.track_inventory:
+            return None
+        return max((self.stock_quantity or 0) - self.reserved_quantity, 0)
+    
+    MAINTAINED_FIELDS = ('reserved_quantity', 'primary_media', 'thumbnail_url')
+    
+    # Change tracking
+    # Instances remember the values they were loaded with, so internal writers
+    # (e.g. ProductForm) can save_changed() and write only the fields that
+    # changed. reserved_quantity (inventory.py) and the primary image fields
+    # (images.py) only change through targeted updates and are never written
+    # back from an instance.
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_values()
+        return instance
+    
+    def refresh_from_db(self, *args, fields=None, **kwargs):
+        super().refresh_from_db(*args, fields=fields, **kwargs)
+        self._remember_values(fields)
+    
+    def _remember_values(self, fields=None):
+        loaded = self.__dict__.setdefault('_loaded_values', {})
+        for field in self._meta.concrete_fields:
+            if field.attname in self.__dict__ and (fields is None or field.name in fields or field.attname in fields):
+                loaded[field.attname] = self.__dict__[field.attname]
+    
+    def changed_fields(self):
+        """Names of the editable fields that differ from the values last loaded or saved"""
+        loaded = self.__dict__.get('_loaded_values', {})
+        return [
+            field.name for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.name not in self.MAINTAINED_FIELDS
+            # Deferred and never assigned: nothing to write
+            and field.attname in self.__dict__
+            and (field.attname not in loaded or loaded[field.attname] != self.__dict__[field.attname])
+        ]
+    
+    def validate_constraints(self, exclude=None):
+        # clean() already reports the stock invariant against stock_quantity;
+        # the CHECK constraint is the database's backstop, not a second message
+        super().validate_constraints(exclude=set(exclude or ()) | {'stock_quantity'})
+    
     def save(self, *args, **kwargs):
-        self.full_clean()
+        self.full_clean(exclude=self.MAINTAINED_FIELDS)
+        if not self._state.adding and self.pk is not None and 'update_fields' not in kwargs:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.MAINTAINED_FIELDS
+            ]
         super().save(*args, **kwargs)
+        self._remember_values(kwargs.get('update_fields'))
+    
+    def save_changed(self, validate=True, using=None):
+        """
+        Write only the fields that changed since the product was loaded (plus
+        updated_at), validating only those; no field or FK queries run for
+        values that didn't change. Pass validate=False when the values were
+        already validated, e.g. by a ModelForm.
+        """
+        if self._state.adding or self.pk is None:
+            raise ValueError('save_changed() needs a product loaded from the database; use save().')
+        update_fields = self.changed_fields() + ['updated_at']
+        if validate:
+            self.full_clean(
+                exclude=[field.name for field in self._meta.concrete_fields if field.name not in update_fields],
+                validate_unique=False,
+            )
+        super().save(using=using, update_fields=update_fields)
+        self._remember_values(update_fields)
 
 class Review(models.Model):
     RATING_CHOICES = [
@@ -161,6 +258,171 @@ class Review(models.Model):
         """Check if this review has a vendor response"""
         return hasattr(self, 'response')
 
+# Vendor Stats Model - denormalized per-vendor aggregates for listing pages
+class VendorStats(models.Model):
+    """Review, price and category aggregates kept in sync by signals (see signals.py)"""
+    vendor = models.OneToOneField(Vendor, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    review_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    min_price = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+    product_count = models.IntegerField(default=0, help_text="Number of available products")
+    category_mask = models.IntegerField(default=0, help_text="Bitmask of product categories (bit index follows Product.CATEGORY_CHOICES)")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        app_label = 'market'
+        verbose_name_plural = 'vendor stats'
+    
+    def __str__(self):
+        return f"Stats for vendor #{self.vendor_id}"
+    
+    @staticmethod
+    def category_bit(category):
+        """Bit for a category key in category_mask"""
+        keys = [key for key, label in Product.CATEGORY_CHOICES]
+        return 1 << keys.index(category)
+    
+    @property
+    def categories(self):
+        """Category keys present in category_mask"""
+        return [
+            key for key, label in Product.CATEGORY_CHOICES
+            if self.category_mask & self.category_bit(key)
+        ]
+    
+    @property
+    def average_rating(self):
+        """Average rating rounded to one decimal place"""
+        if self.review_count:
+            return round(self.rating_sum / self.review_count, 1)
+        return 0
+    
+    @property
+    def price_range(self):
+        """Formatted price range of vendor's products"""
+        if self.min_price is None:
+            return "No products"
+        if self.min_price == self.max_price:
+            return f"${self.min_price}"
+        return f"${self.min_price} - ${self.max_price}"
+    
+    @classmethod
+    def review_values(cls, vendor_id):
+        """Compute review aggregates for a vendor"""
+        totals = Review.objects.filter(vendor_id=vendor_id).aggregate(
+            review_count=models.Count('id'),
+            rating_sum=models.Sum('rating'),
+        )
+        return {
+            'review_count': totals['review_count'],
+            'rating_sum': totals['rating_sum'] or 0,
+        }
+    
+    @classmethod
+    def product_values(cls, vendor_id):
+        """Compute price, availability and category aggregates for a vendor in one query"""
+        category_flags = {
+            f'has_{key}': models.Max(models.Case(
+                models.When(category=key, then=models.Value(1)),
+                default=models.Value(0),
+                output_field=models.IntegerField(),
+            ))
+            for key, label in Product.CATEGORY_CHOICES
+        }
+        totals = Product.objects.filter(vendor_id=vendor_id).aggregate(
+            min_price=models.Min('price'),
+            max_price=models.Max('price'),
+            product_count=models.Count('id', filter=models.Q(is_available=True)),
+            **category_flags
+        )
+        category_mask = 0
+        for key, label in Product.CATEGORY_CHOICES:
+            if totals.pop(f'has_{key}'):
+                category_mask |= cls.category_bit(key)
+        totals['category_mask'] = category_mask
+        return totals
+    
+    @classmethod
+    def refresh_reviews(cls, vendor_id):
+        """Recompute review aggregates for an existing stats row"""
+        cls.objects.filter(vendor_id=vendor_id).update(
+            updated_at=timezone.now(), **cls.review_values(vendor_id)
+        )
+    
+    @classmethod
+    def refresh_products(cls, vendor_id):
+        """Recompute product aggregates for an existing stats row"""
+        cls.objects.filter(vendor_id=vendor_id).update(
+            updated_at=timezone.now(), **cls.product_values(vendor_id)
+        )
+    
+    # Product fields the aggregates depend on
+    PRODUCT_FIELDS = ('vendor', 'price', 'is_available', 'category')
+    
+    @classmethod
+    def apply_product_change(cls, old, new):
+        """
+        Apply one product write to the stats incrementally. old and new map
+        PRODUCT_FIELDS attnames to the product's values before and after the
+        write (None for a created or deleted product). Only the price range
+        is re-aggregated, and only when an extreme price went away; a category
+        bit is cleared only when no product is left in that category.
+        """
+        if old == new:
+            return
+        if old and new and old['vendor_id'] != new['vendor_id']:
+            cls.apply_product_change(old, None)
+            cls.apply_product_change(None, new)
+            return
+        vendor_id = (new or old)['vendor_id']
+        stats = cls.objects.filter(vendor_id=vendor_id).values('min_price', 'max_price').first()
+        if stats is None:
+            return
+        values = {'updated_at': timezone.now()}
+        
+        available = (1 if new and new['is_available'] else 0) - (1 if old and old['is_available'] else 0)
+        if available:
+            values['product_count'] = models.F('product_count') + available
+        
+        old_price = old['price'] if old else None
+        new_price = new['price'] if new else None
+        if old_price != new_price:
+            if old_price is not None and old_price in (stats['min_price'], stats['max_price']):
+                values.update(Product.objects.filter(vendor_id=vendor_id).aggregate(
+                    min_price=models.Min('price'), max_price=models.Max('price'),
+                ))
+            elif new_price is not None:
+                price = models.Value(new_price, output_field=models.DecimalField(max_digits=6, decimal_places=2))
+                values['min_price'] = models.Case(
+                    models.When(models.Q(min_price__isnull=True) | models.Q(min_price__gt=new_price), then=price),
+                    default=models.F('min_price'),
+                )
+                values['max_price'] = models.Case(
+                    models.When(models.Q(max_price__isnull=True) | models.Q(max_price__lt=new_price), then=price),
+                    default=models.F('max_price'),
+                )
+        
+        old_category = old['category'] if old else None
+        new_category = new['category'] if new else None
+        if old_category != new_category:
+            mask = models.F('category_mask')
+            if new_category:
+                mask = mask.bitor(cls.category_bit(new_category))
+            if old_category and not Product.objects.filter(vendor_id=vendor_id, category=old_category).exists():
+                mask = mask.bitand(~cls.category_bit(old_category))
+            values['category_mask'] = mask
+        
+        cls.objects.filter(vendor_id=vendor_id).update(**values)
+    
+    @classmethod
+    def rebuild(cls, vendor_id):
+        """Create or fully recompute the stats row for a vendor"""
+        values = cls.review_values(vendor_id)
+        values.update(cls.product_values(vendor_id))
+        stats, created = cls.objects.update_or_create(vendor_id=vendor_id, defaults=values)
+        return stats
+
 # Vendor Team Member Model - links users to vendors
 class VendorTeamMember(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='vendor_teams')
@@ -181,17 +443,28 @@ class VendorTeamMember(models.Model):
 # Product Media Model - stores product images
 class ProductMedia(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='media_items')
-    image = models.ImageField(upload_to='products/')
+    image = models.ImageField(upload_to='products/', storage=media_storage)
     is_primary = models.BooleanField(default=False, help_text="Main product image")
     uploaded_at = models.DateTimeField(auto_now_add=True)
     order = models.IntegerField(default=0, help_text="Order for sorting images")
+    PROCESSING_CHOICES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+    variants = models.JSONField(default=dict, blank=True, editable=False, help_text="Resized image URLs by variant and format (see images.py)")
+    processing_state = models.CharField(max_length=10, choices=PROCESSING_CHOICES, default='pending', editable=False)
     
     class Meta:
         app_label = 'market'
-        ordering = ['is_primary', 'order', 'uploaded_at']
+        ordering = ['-is_primary', 'order', 'uploaded_at']
     
     def __str__(self):
         return f"Image for {self.product.name}"
+    
+    def variant_url(self, variant, fmt='jpeg'):
+        """URL of a resized variant; None until the image has been processed"""
+        return (self.variants or {}).get(variant, {}).get(fmt)
 
 # Review Response Model - vendor responses to reviews
 class ReviewResponse(models.Model):
@@ -247,6 +520,29 @@ class Consumer(models.Model):
     def __str__(self):
         return self.name
 
+class CartQuerySet(models.QuerySet):
+    """Cart queries that compute totals in the database"""
+
+    def with_totals(self):
+        """Annotate each cart with SUM(quantity) and SUM(quantity * price) of its items"""
+        return self.annotate(
+            items_quantity=Coalesce(models.Sum('items__quantity'), models.Value(0)),
+            items_total=Coalesce(
+                models.Sum(
+                    models.F('items__quantity') * models.F('items__product__price'),
+                    output_field=models.DecimalField(max_digits=10, decimal_places=2),
+                ),
+                models.Value(Decimal('0.00')),
+                output_field=models.DecimalField(max_digits=10, decimal_places=2),
+            ),
+        )
+
+    def with_items(self):
+        """Prefetch each cart's items together with their products"""
+        return self.prefetch_related(
+            models.Prefetch('items', queryset=CartItem.objects.select_related('product'))
+        )
+
 class Cart(models.Model):
     """Shopping cart for a user and vendor pair"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='carts')
@@ -254,6 +550,8 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = CartQuerySet.as_manager()
+    
     class Meta:
         app_label = 'market'
         unique_together = ['user', 'vendor']
@@ -265,11 +563,16 @@ class Cart(models.Model):
     @property
     def total_price(self):
         """Calculate total price of all items in cart"""
-        return sum(item.subtotal for item in self.items.all())
+        if hasattr(self, 'items_total'):
+            # SQLite returns computed decimals unquantized
+            return self.items_total.quantize(Decimal('0.01'))
+        return sum((item.subtotal for item in self.items.all()), Decimal('0.00'))
     
     @property
     def item_count(self):
         """Get total number of items in cart"""
+        if hasattr(self, 'items_quantity'):
+            return self.items_quantity
         return sum(item.quantity for item in self.items.all())
 
 class CartItem(models.Model):
@@ -277,6 +580,8 @@ class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='cart_items')
     quantity = models.IntegerField(default=1)
+    held_quantity = models.IntegerField(default=0, help_text="Units of this item reserved from stock (tracked products only)")
+    hold_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -368,3 +673,37 @@ class OrderItem(models.Model):
             self.subtotal = Decimal(self.quantity) * self.unit_price
         super().save(*args, **kwargs)
 
+
+# Abandoned Cart Stats Model - daily per-vendor summary of carts removed by the abandoned-cart sweeper
+class AbandonedCartStats(models.Model):
+    """What abandoned carts held, recorded by sweep_abandoned_carts before they are deleted"""
+    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE, related_name='abandoned_cart_stats')
+    date = models.DateField(help_text="Day the carts were last active")
+    cart_count = models.IntegerField(default=0)
+    item_count = models.IntegerField(default=0, help_text="Total quantity of items in the carts")
+    total_value = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), help_text="Value of the carts at prices when swept")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        app_label = 'market'
+        unique_together = ['vendor', 'date']
+        ordering = ['-date']
+        verbose_name_plural = 'abandoned cart stats'
+    
+    def __str__(self):
+        return f"{self.cart_count} abandoned cart(s) for {self.vendor.name} on {self.date}"
+
+# Media Blob Model - reference counts for content-addressed media files
+class MediaBlob(models.Model):
+    """One stored media file and how many media records use it (see blobs.py)"""
+    name = models.CharField(max_length=255, unique=True, help_text="Storage name (content hash)")
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    class Meta:
+        app_label = 'market'
+        ordering = ['name']
+    
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} reference(s))"
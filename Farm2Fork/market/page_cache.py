@@ -0,0 +1,110 @@
+import hashlib
+import time
+from functools import wraps
+from urllib.parse import urlencode
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from .cart import has_session_cart
+
+# Full-page cache for anonymous storefront requests
+# Cache keys embed a content version. Saving a vendor, product, media item or
+# review bumps that vendor's version and the global (listing) version, so stale
+# pages are never served and nothing has to be flushed.
+# Vendor pages also cache their product grid and review list as template
+# fragments for signed-in users; those are keyed on per-section versions.
+PAGE_CACHE_TIMEOUT = 60 * 5
+GLOBAL_SCOPE = 'global'
+
+def vendor_scope(vendor_id):
+    return f'vendor:{vendor_id}'
+
+def vendor_fragment_scope(vendor_id, fragment):
+    """Scope for one cached section of a vendor page, e.g. 'products' or 'reviews'"""
+    return f'vendor:{vendor_id}:{fragment}'
+
+def _version_key(scope):
+    return f'market:version:{scope}'
+
+def _initial_version():
+    # Versions start from the clock rather than 1, so a version key that was
+    # evicted from the cache never restarts at a value old pages were keyed on
+    return int(time.time() * 1000)
+
+def get_version(scope):
+    """Current content version for a scope"""
+    key = _version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        initial = _initial_version()
+        cache.add(key, initial, None)
+        version = cache.get(key, initial)
+    return version
+
+def bump_version(scope):
+    """Invalidate every cached page keyed on a scope"""
+    key = _version_key(scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_version(), None)
+
+def bump_vendor_version(vendor_id):
+    """Invalidate a vendor's pages and the listing pages that show it"""
+    bump_version(vendor_scope(vendor_id))
+    bump_version(GLOBAL_SCOPE)
+
+def bump_fragment_version(vendor_id, fragment):
+    """Invalidate one cached section of a vendor page"""
+    bump_version(vendor_fragment_scope(vendor_id, fragment))
+
+def normalized_query(request):
+    """Sorted query string without blank parameters"""
+    params = sorted(
+        (key, value)
+        for key, values in request.GET.lists()
+        for value in values
+        if value != ''
+    )
+    return urlencode(params)
+
+def page_cache_key(request, scope):
+    raw = f'{request.path}?{normalized_query(request)}'
+    digest = hashlib.md5(raw.encode()).hexdigest()
+    return f'market:response:{scope}:{get_version(scope)}:{digest}'
+
+def cache_anonymous_page(vendor_kwarg=None, timeout=PAGE_CACHE_TIMEOUT):
+    """
+    Cache the rendered page for anonymous GET requests.
+    Pages taking a vendor id (vendor_kwarg) are keyed on that vendor's version,
+    other pages on the global version. Requests with pending flash messages
+    bypass the cache so messages are neither lost nor cached, as do shoppers
+    with a session cart, whose pages show their cart count.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if (request.method not in ('GET', 'HEAD')
+                    or request.user.is_authenticated
+                    or len(get_messages(request))
+                    or has_session_cart(request)):
+                return view_func(request, *args, **kwargs)
+
+            if vendor_kwarg:
+                scope = vendor_scope(kwargs.get(vendor_kwarg))
+            else:
+                scope = GLOBAL_SCOPE
+            key = page_cache_key(request, scope)
+
+            cached = cache.get(key)
+            if cached is not None:
+                content, headers = cached
+                return HttpResponse(content, headers=headers)
+
+            response = view_func(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming and not response.cookies:
+                # Headers are replayed on a hit, so a hit answers like the miss
+                cache.set(key, (response.content, dict(response.items())), timeout)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,172 @@
+import base64
+import binascii
+import datetime
+import json
+from functools import reduce
+from operator import and_, or_
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+class InvalidCursor(Exception):
+    """Raised when a pagination cursor cannot be decoded"""
+
+class CursorEncoder(DjangoJSONEncoder):
+    """JSON encoder that keeps full datetime precision (DjangoJSONEncoder drops microseconds)"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+class KeysetPage:
+    """One page of results from a KeysetPaginator"""
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor, count=None, count_is_estimate=False):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.count = count
+        self.count_is_estimate = count_is_estimate
+        self.next_query = ''
+        self.previous_query = ''
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+class KeysetPaginator:
+    """
+    Cursor (keyset) paginator for ordered querysets.
+
+    Instead of OFFSET, each page continues from the ordering values of the last
+    row seen (WHERE (a, b, pk) > (x, y, z)), so every page costs the same as the
+    first one. The queryset's ordering (or the model's Meta.ordering) is used,
+    with the primary key appended as a tiebreaker. Ordering fields must be
+    concrete fields or annotations on the model itself, not related lookups.
+
+    Cursors are opaque url-safe strings. count_limit enables a bounded total
+    count: counting stops at count_limit rows and the page reports whether the
+    figure is an estimate.
+    """
+
+    def __init__(self, queryset, per_page, count_limit=None):
+        self.per_page = per_page
+        self.count_limit = count_limit
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not any(field.lstrip('-') in ('pk', queryset.model._meta.pk.name) for field in ordering):
+            ordering.append('pk')
+        self.ordering = ordering
+        self.queryset = queryset.order_by(*ordering)
+
+    def _field(self, name):
+        """Model field or annotation output field used to decode cursor values"""
+        annotations = self.queryset.query.annotations
+        if name in annotations:
+            return annotations[name].output_field
+        if name == 'pk':
+            return self.queryset.model._meta.pk
+        return self.queryset.model._meta.get_field(name)
+
+    def _key(self, obj):
+        """Ordering values of a row"""
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def encode_cursor(self, key, direction):
+        payload = json.dumps({'k': key, 'd': direction}, cls=CursorEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+            key, direction = payload['k'], payload['d']
+            if direction not in ('next', 'prev') or len(key) != len(self.ordering):
+                raise ValueError
+            values = [
+                self._field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, key)
+            ]
+        except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError, ValidationError):
+            raise InvalidCursor(cursor)
+        return values, direction
+
+    def _seek(self, values, forward):
+        """
+        WHERE clause selecting rows after (or before) the key, expanded as
+        (a > x) OR (a = x AND b > y) OR ... to support mixed sort directions
+        """
+        clauses = []
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            descending = field.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            equal = [Q(**{self.ordering[j].lstrip('-'): values[j]}) for j in range(i)]
+            clauses.append(reduce(and_, equal + [Q(**{f'{name}__{lookup}': values[i]})]))
+        return reduce(or_, clauses)
+
+    def _count(self):
+        if self.count_limit is None:
+            return None, False
+        count = self.queryset.order_by()[:self.count_limit + 1].count()
+        if count > self.count_limit:
+            return self.count_limit, True
+        return count, False
+
+    def page(self, cursor=None):
+        """Return the page that starts after (or ends before) the given cursor"""
+        queryset = self.queryset
+        direction = 'next'
+        if cursor:
+            values, direction = self.decode_cursor(cursor)
+            forward = direction == 'next'
+            queryset = queryset.filter(self._seek(values, forward))
+            if not forward:
+                queryset = queryset.reverse()
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if direction == 'prev':
+            rows.reverse()
+            has_next, has_previous = bool(cursor), has_more
+        else:
+            has_next, has_previous = has_more, bool(cursor)
+
+        next_cursor = self.encode_cursor(self._key(rows[-1]), 'next') if rows and has_next else None
+        previous_cursor = self.encode_cursor(self._key(rows[0]), 'prev') if rows and has_previous else None
+        count, count_is_estimate = self._count()
+        return KeysetPage(rows, has_next, has_previous, next_cursor, previous_cursor, count, count_is_estimate)
+
+def paginate(request, queryset, per_page, count_limit=None, cursor_param='cursor'):
+    """
+    Paginate a queryset from the request's cursor parameter.
+    Invalid cursors fall back to the first page. The returned page carries
+    next_query / previous_query strings that preserve the other GET parameters.
+    """
+    paginator = KeysetPaginator(queryset, per_page, count_limit=count_limit)
+    try:
+        page = paginator.page(request.GET.get(cursor_param))
+    except InvalidCursor:
+        page = paginator.page()
+
+    params = request.GET.copy()
+    if page.next_cursor:
+        params[cursor_param] = page.next_cursor
+        page.next_query = params.urlencode()
+    if page.previous_cursor:
+        params[cursor_param] = page.previous_cursor
+        page.previous_query = params.urlencode()
+    return page
@@ -0,0 +1,72 @@
+from decimal import Decimal, ROUND_HALF_UP
+from django.db.models import F, Max, Value, DecimalField
+from django.db.models.functions import Greatest, Round
+from django.utils import timezone
+from .models import Product
+
+# Bulk repricing
+# Each operation is a single UPDATE computed in the database. Results are
+# rounded to cents (half away from zero, like Decimal ROUND_HALF_UP) and
+# clamped at zero; the whole batch is validated once, up front, against the
+# largest price that fits Product.price.
+
+CENT = Decimal('0.01')
+PRICE_FIELD = Product._meta.get_field('price')
+MAX_PRICE = Decimal(10) ** (PRICE_FIELD.max_digits - PRICE_FIELD.decimal_places) - CENT
+
+class PricingError(ValueError):
+    """A bulk price change was rejected; the message is safe to show to the user"""
+
+def _new_price(action, amount):
+    """Expression for a product's price after the operation"""
+    price = F('price')
+    amount = Value(amount, output_field=DecimalField(max_digits=12, decimal_places=4))
+    if action == 'price_set':
+        return amount
+    if action == 'price_increase':
+        return price + amount
+    if action == 'price_decrease':
+        return Greatest(price - amount, Value(Decimal('0.00'), output_field=PRICE_FIELD))
+    return price * amount
+
+def _highest_result(products, action, amount):
+    """The largest price the operation would produce, from one MAX query"""
+    if action == 'price_set':
+        return amount
+    highest = products.aggregate(highest=Max('price'))['highest'] or Decimal('0')
+    if action == 'price_increase':
+        return highest + amount
+    if action == 'price_multiply':
+        return (highest * amount).quantize(CENT, rounding=ROUND_HALF_UP)
+    return highest
+
+def validate_amount(action, amount):
+    """Check an operation's amount; returns it as a Decimal rounded for the operation"""
+    if action not in ('price_set', 'price_increase', 'price_decrease', 'price_multiply'):
+        raise PricingError('Unknown price operation.')
+    if amount is None or amount > MAX_PRICE:
+        raise PricingError('Invalid multiplier value.' if action == 'price_multiply' else 'Invalid price value.')
+    if action == 'price_set' and amount <= 0:
+        raise PricingError('Price must be greater than zero.')
+    if action in ('price_increase', 'price_decrease') and amount < 0:
+        raise PricingError('Amount cannot be negative.')
+    if action == 'price_multiply':
+        if amount <= 0:
+            raise PricingError('Invalid multiplier value.')
+        return amount.quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP)
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+def bulk_reprice(products, action, amount):
+    """
+    Apply a price_set / price_increase / price_decrease / price_multiply
+    operation to a Product queryset in one UPDATE. Raises PricingError before
+    writing anything if the amount is invalid or any resulting price would not
+    fit the price field. Returns the number of products updated.
+    """
+    amount = validate_amount(action, amount)
+    if _highest_result(products, action, amount) > MAX_PRICE:
+        raise PricingError(f'Prices cannot exceed ${MAX_PRICE}.')
+    return products.update(
+        price=Round(_new_price(action, amount), 2, output_field=PRICE_FIELD),
+        updated_at=timezone.now(),
+    )
@@ -0,0 +1,81 @@
+from decimal import Decimal, InvalidOperation
+from django.db.models import Q, Exists, OuterRef, Value, BooleanField
+from .models import Product, Vendor
+from . import search
+
+def parse_price(value):
+    """Parse a price filter value, returning None for blank or invalid input"""
+    if value in (None, ''):
+        return None
+    try:
+        price = Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return None
+    if not price.is_finite():
+        return None
+    return price
+
+def vendor_products(**filters):
+    """Product subquery correlated to the outer vendor row"""
+    return Product.objects.filter(vendor=OuterRef('pk'), **filters)
+
+def search_vendors(search_query='', location_filter='', category_filter='', min_price=None, max_price=None, vendors=None):
+    """
+    Build the market_home vendor queryset.
+
+    Every filter is expressed as a WHERE clause or an EXISTS subquery so the
+    results page is a single lazy query no matter how many vendors match.
+    Each vendor is annotated with has_products_below_min / has_products_above_max
+    for the price warnings shown on the vendor cards.
+    """
+    if vendors is None:
+        vendors = Vendor.objects.filter(is_active=True).order_by('-feature_priority', 'name')
+    # Ratings and price ranges on the vendor cards come from VendorStats
+    vendors = vendors.select_related('stats')
+
+    # Full-text search over vendor profiles and product names, ranked by
+    # relevance when the search index is available
+    if search_query:
+        if search.is_enabled():
+            vendors = search.rank_vendors(vendors, search_query)
+        else:
+            vendors = vendors.filter(
+                Q(name__icontains=search_query) |
+                Q(description__icontains=search_query) |
+                Exists(vendor_products(name__icontains=search_query))
+            )
+
+    if location_filter:
+        vendors = vendors.filter(
+            Q(city__icontains=location_filter) |
+            Q(state__icontains=location_filter) |
+            Q(service_area__icontains=location_filter)
+        )
+
+    # Vendors with at least one product in the selected category
+    if category_filter:
+        vendors = vendors.filter(Exists(vendor_products(category=category_filter)))
+
+    # Vendors with ANY product inside the price range
+    price_filters = {}
+    if min_price is not None:
+        price_filters['price__gte'] = min_price
+    if max_price is not None:
+        price_filters['price__lte'] = max_price
+    if price_filters:
+        vendors = vendors.filter(Exists(vendor_products(**price_filters)))
+
+    # Price warning flags
+    if min_price is not None:
+        has_products_below_min = Exists(vendor_products(price__lt=min_price))
+    else:
+        has_products_below_min = Value(False, output_field=BooleanField())
+    if max_price is not None:
+        has_products_above_max = Exists(vendor_products(price__gt=max_price))
+    else:
+        has_products_above_max = Value(False, output_field=BooleanField())
+
+    return vendors.annotate(
+        has_products_below_min=has_products_below_min,
+        has_products_above_max=has_products_above_max,
+    )
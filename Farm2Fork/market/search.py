@@ -0,0 +1,109 @@
+import re
+from django.db import connection
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from .models import Vendor, Product
+
+# Full-text search over vendors and their products
+# The index is an SQLite FTS5 virtual table keyed by vendor id (rowid) and is
+# created by migration 0011. Other database backends fall back to icontains.
+SEARCH_TABLE = 'market_vendorsearch'
+
+# Product fields the index is built from; saves that write none of them skip re-indexing
+PRODUCT_FIELDS = ('vendor', 'name', 'description')
+
+SEARCH_COLUMNS = ['name', 'description', 'story_mission', 'service_area', 'product_names', 'product_descriptions']
+
+# bm25 column weights, in SEARCH_COLUMNS order
+SEARCH_WEIGHTS = [10.0, 2.0, 1.0, 1.0, 5.0, 1.0]
+
+def is_enabled():
+    """Full-text search is only available on SQLite"""
+    return connection.vendor == 'sqlite'
+
+def build_match_query(text):
+    """
+    Turn user input into an FTS5 MATCH expression.
+    Every word becomes a quoted prefix term, so "tom farm" matches
+    "tomatoes" and "farmstead", and user input can never inject FTS syntax.
+    """
+    terms = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def rank_vendors(vendors, text):
+    """
+    Restrict a vendor queryset to full-text matches, ordered by BM25 relevance.
+    The rank is a regular annotation (search_rank, lower is better), so the
+    queryset stays lazy and can be filtered or paginated on it.
+    """
+    match = build_match_query(text)
+    if not match:
+        return vendors.none()
+    weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+    vendor_table = Vendor._meta.db_table
+    matching_ids = RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [match])
+    search_rank = RawSQL(
+        f'SELECT bm25({SEARCH_TABLE}, {weights}) FROM {SEARCH_TABLE} '
+        f'WHERE {SEARCH_TABLE} MATCH %s AND {SEARCH_TABLE}.rowid = {vendor_table}.id',
+        [match],
+        output_field=FloatField(),
+    )
+    return vendors.filter(id__in=matching_ids).annotate(search_rank=search_rank).order_by('search_rank')
+
+def index_vendor(vendor_id):
+    """Insert or replace the search entry for a vendor"""
+    if not is_enabled():
+        return
+    vendor = Vendor.objects.filter(id=vendor_id).values(
+        'name', 'description', 'story_mission', 'service_area'
+    ).first()
+    if vendor is None:
+        remove_vendor(vendor_id)
+        return
+    products = Product.objects.filter(vendor_id=vendor_id).order_by().values_list('name', 'description')
+    product_names = ' '.join(name for name, description in products)
+    product_descriptions = ' '.join(description for name, description in products if description)
+    values = [
+        vendor['name'],
+        vendor['description'] or '',
+        vendor['story_mission'] or '',
+        vendor['service_area'] or '',
+        product_names,
+        product_descriptions,
+    ]
+    columns = ', '.join(SEARCH_COLUMNS)
+    placeholders = ', '.join(['%s'] * len(SEARCH_COLUMNS))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [vendor_id])
+        cursor.execute(
+            f'INSERT INTO {SEARCH_TABLE} (rowid, {columns}) VALUES (%s, {placeholders})',
+            [vendor_id] + values,
+        )
+
+def remove_vendor(vendor_id):
+    """Delete the search entry for a vendor"""
+    if not is_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [vendor_id])
+
+def rebuild_index():
+    """Rebuild the whole search index with two set-based statements"""
+    if not is_enabled():
+        return 0
+    vendor_table = Vendor._meta.db_table
+    product_table = Product._meta.db_table
+    columns = ', '.join(SEARCH_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(f'''
+            INSERT INTO {SEARCH_TABLE} (rowid, {columns})
+            SELECT v.id, v.name, COALESCE(v.description, ''), COALESCE(v.story_mission, ''),
+                   COALESCE(v.service_area, ''),
+                   COALESCE((SELECT group_concat(p.name, ' ') FROM {product_table} p WHERE p.vendor_id = v.id), ''),
+                   COALESCE((SELECT group_concat(p.description, ' ') FROM {product_table} p WHERE p.vendor_id = v.id), '')
+            FROM {vendor_table} v
+        ''')
+        cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT count(*) FROM {SEARCH_TABLE}')
+        return cursor.fetchone()[0]
@@ -0,0 +1,170 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from .storage import is_content_addressed, IMMUTABLE_CACHE_CONTROL
+
+# Media serving
+# Uploaded files are served without reading them into memory:
+#   - conditional requests (If-None-Match / If-Modified-Since) get a 304;
+#   - single byte ranges get a 206 with just those bytes;
+#   - bodies go out through FileResponse, which WSGI servers with
+#     wsgi.file_wrapper (e.g. gunicorn) send with sendfile(2);
+#   - with MARKET_MEDIA_OFFLOAD set, the body is left to the front-end server
+#     via X-Accel-Redirect (nginx) or X-Sendfile (Apache, lighttpd), so no
+#     worker is tied up at all.
+# Content-addressed files (storage.py) carry their hash as a strong ETag and
+# are cacheable forever; other files are revalidated after MEDIA_MAX_AGE.
+# Only media types are served, and nothing under a dot-named segment (such as
+# the .upload-* files storage.py writes before moving them into place).
+
+MEDIA_MAX_AGE = 60 * 60
+# Content type prefixes of servable files (uploads are images)
+MEDIA_TYPES = ('image/',)
+MEDIA_CACHE_CONTROL = f'public, max-age={MEDIA_MAX_AGE}'
+
+# None, 'x-accel-redirect' or 'x-sendfile'
+MEDIA_OFFLOAD = getattr(settings, 'MARKET_MEDIA_OFFLOAD', None)
+# nginx internal location that maps onto MEDIA_ROOT, for X-Accel-Redirect
+MEDIA_ACCEL_PREFIX = getattr(settings, 'MARKET_MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def _etag(path, stat):
+    if is_content_addressed(path):
+        return '"%s"' % os.path.splitext(os.path.basename(path))[0]
+    return '"%x-%x"' % (stat.st_size, stat.st_mtime_ns)
+
+def parse_range(header, size):
+    """
+    (start, end) of a single 'bytes=' range, end inclusive; None when the
+    header should be ignored (absent, malformed or several ranges) and
+    'unsatisfiable' when it asks for bytes past the end of the file
+    """
+    match = _RANGE.match((header or '').replace(' ', ''))
+    if not match or not size or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return 'unsatisfiable'
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        return 'unsatisfiable'
+    return start, end
+
+def _range_applies(request, etag, last_modified):
+    """If-Range: only honour the range if the client's copy is still current"""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return if_range == last_modified
+
+class _FileRange:
+    """Read-only view of bytes [start, start + length) of an open file"""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def tell(self):
+        return self.file.tell()
+
+    def fileno(self):
+        # Lets the server sendfile() the range: it starts at the current
+        # offset and stops at Content-Length
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+def _offload(response, relative_path, full_path):
+    if MEDIA_OFFLOAD == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + quote(relative_path)
+    else:
+        response['X-Sendfile'] = full_path
+    return response
+
+def serve_media(request, path):
+    """Response for a media file under MEDIA_ROOT"""
+    if any(segment.startswith('.') for segment in re.split(r'[\\/]', path)):
+        raise Http404('Not found')
+    content_type = mimetypes.guess_type(path)[0]
+    if not content_type or not content_type.startswith(MEDIA_TYPES):
+        raise Http404('Not found')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404('Not found')
+    try:
+        stat = os.stat(full_path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404('Not found')
+    if not os.path.isfile(full_path):
+        raise Http404('Not found')
+
+    etag = _etag(path, stat)
+    last_modified = http_date(stat.st_mtime)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if is_content_addressed(path) else MEDIA_CACHE_CONTROL,
+        'Accept-Ranges': 'bytes',
+    }
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified[header] = value
+        return not_modified
+
+    if MEDIA_OFFLOAD:
+        # The front-end server streams the file and handles Range itself
+        response = HttpResponse(content_type=content_type, headers=headers)
+        return _offload(response, path, full_path)
+
+    size = stat.st_size
+    byte_range = parse_range(request.META.get('HTTP_RANGE'), size) if _range_applies(request, etag, last_modified) else None
+    if byte_range == 'unsatisfiable':
+        response = HttpResponse(status=416, headers=headers)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['Content-Length'] = size
+        return response
+
+    file = open(full_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type, headers=headers)
+    else:
+        start, end = byte_range
+        response = FileResponse(_FileRange(file, start, end - start + 1), status=206, content_type=content_type, headers=headers)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    return response
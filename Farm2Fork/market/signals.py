@@ -0,0 +1,273 @@
+from django.db.models import F
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Vendor, Product, ProductMedia, Review, ReviewResponse, VendorStats, Cart, CartItem, Message, VendorTeamMember
+from . import search
+from . import facets
+from .facets import invalidate_global_facets
+from .page_cache import bump_vendor_version, bump_fragment_version
+from .cart import merge_session_cart
+from .inventory import release_holds
+from .header_state import invalidate_header_state
+from .images import schedule_processing, refresh_primary_media
+from .blobs import media_file_names, retain, release
+
+# VendorStats maintenance
+# Handlers only update existing stats rows; rows are created with the vendor
+# (or by the rebuild_vendor_stats command) so cascading vendor deletes never
+# recreate a stats row for a vendor that is being removed. Single writes are
+# applied as deltas from the values the instance was loaded with; only bulk
+# writes (products_bulk_updated) and instances without those values re-aggregate.
+
+@receiver(post_save, sender=Vendor)
+def create_vendor_stats(sender, instance, created, raw=False, **kwargs):
+    """Create an empty stats row for new vendors"""
+    if created and not raw:
+        VendorStats.objects.get_or_create(vendor=instance)
+
+@receiver(post_init, sender=Review)
+def review_loaded(sender, instance, **kwargs):
+    """Remember the vendor and rating a review was loaded with"""
+    # None when the field was deferred (or for new reviews)
+    instance._stored_vendor_rating = (instance.__dict__.get('vendor_id'), instance.__dict__.get('rating'))
+
+def _add_review(vendor_id, count, rating):
+    VendorStats.objects.filter(vendor_id=vendor_id).update(
+        review_count=F('review_count') + count,
+        rating_sum=F('rating_sum') + rating,
+        updated_at=timezone.now(),
+    )
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, raw=False, **kwargs):
+    """Add a new review to the vendor's rating totals, or move a changed one"""
+    if raw:
+        return
+    previous_vendor_id, previous_rating = instance._stored_vendor_rating
+    instance._stored_vendor_rating = (instance.vendor_id, instance.rating)
+    if created:
+        _add_review(instance.vendor_id, 1, instance.rating)
+    elif previous_vendor_id is None or previous_rating is None:
+        # Loaded without its old values; recompute from the vendor's reviews
+        VendorStats.refresh_reviews(instance.vendor_id)
+    elif previous_vendor_id != instance.vendor_id:
+        _add_review(previous_vendor_id, -1, -previous_rating)
+        _add_review(instance.vendor_id, 1, instance.rating)
+    elif previous_rating != instance.rating:
+        _add_review(instance.vendor_id, 0, instance.rating - previous_rating)
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    """Remove a deleted review from the vendor's rating totals"""
+    _add_review(instance.vendor_id, -1, -instance.rating)
+
+def _writes_any(update_fields, fields):
+    """Whether a product save limited to update_fields (None: all fields) may have changed any of fields"""
+    if update_fields is None:
+        return True
+    return any(
+        name in update_fields or Product._meta.get_field(name).attname in update_fields
+        for name in fields
+    )
+
+def _product_stats_values(source):
+    """A product's VendorStats.PRODUCT_FIELDS values from source (a dict keyed by attname), or None if any are missing"""
+    attnames = [Product._meta.get_field(name).attname for name in VendorStats.PRODUCT_FIELDS]
+    if all(attname in source for attname in attnames):
+        return {attname: source[attname] for attname in attnames}
+    return None
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """Apply a product's change to the vendor's price range, product count and categories"""
+    if raw or not _writes_any(update_fields, VendorStats.PRODUCT_FIELDS):
+        return
+    loaded = instance.__dict__.get('_loaded_values', {})
+    old = None if created else _product_stats_values(loaded)
+    current = dict(instance.__dict__)
+    if update_fields is not None:
+        # Fields that were not written still hold their loaded values
+        for name in VendorStats.PRODUCT_FIELDS:
+            attname = Product._meta.get_field(name).attname
+            if name not in update_fields and attname not in update_fields and attname in loaded:
+                current[attname] = loaded[attname]
+    new = _product_stats_values(current)
+    if (old is None and not created) or new is None:
+        VendorStats.refresh_products(instance.vendor_id)
+        return
+    VendorStats.apply_product_change(old, new)
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    """Remove a deleted product from the vendor's price range, product count and categories"""
+    old = _product_stats_values({**instance.__dict__, **instance.__dict__.get('_loaded_values', {})})
+    if old is None:
+        VendorStats.refresh_products(instance.vendor_id)
+    else:
+        VendorStats.apply_product_change(old, None)
+
+# Product images and their stored files
+
+@receiver(post_init, sender=ProductMedia)
+def product_media_loaded(sender, instance, **kwargs):
+    """Remember the file a media item was loaded with, to notice replacements"""
+    image = instance.__dict__.get('image')
+    # None when the field was deferred
+    instance._stored_image_name = getattr(image, 'name', image)
+
+@receiver(post_save, sender=ProductMedia)
+def product_media_files(sender, instance, created, raw=False, **kwargs):
+    """Reference a new or replaced upload and render its variants in the background"""
+    if raw:
+        return
+    previous = instance._stored_image_name
+    current = instance.image.name
+    if created:
+        retain([current])
+    elif previous is not None and previous != current:
+        retain([current])
+        release([previous])
+    else:
+        return
+    instance._stored_image_name = current
+    schedule_processing(instance.id)
+
+@receiver(post_save, sender=ProductMedia)
+@receiver(post_delete, sender=ProductMedia)
+def product_media_primary(sender, instance, raw=False, origin=None, **kwargs):
+    """Keep the product's primary image pointer and thumbnail URL current"""
+    if raw:
+        return
+    # Cascades from deleting a product (or its vendor) take the product row
+    # too; only deletes that start at the media themselves need a recompute
+    if origin is not None and getattr(origin, 'model', type(origin)) is not ProductMedia:
+        return
+    refresh_primary_media(instance.product_id)
+
+@receiver(post_delete, sender=ProductMedia)
+def product_media_release_files(sender, instance, **kwargs):
+    """Drop a deleted media item's references to its upload and variants"""
+    release(media_file_names(instance))
+
+# Search index maintenance
+
+@receiver(post_save, sender=Vendor)
+def vendor_saved_reindex(sender, instance, raw=False, **kwargs):
+    """Re-index a vendor when its profile changes"""
+    if not raw:
+        search.index_vendor(instance.id)
+
+@receiver(post_delete, sender=Vendor)
+def vendor_deleted_reindex(sender, instance, **kwargs):
+    """Drop a deleted vendor from the search index"""
+    search.remove_vendor(instance.id)
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed_reindex(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Re-index the vendor when one of its products changes"""
+    if not raw and _writes_any(update_fields, search.PRODUCT_FIELDS):
+        search.index_vendor(instance.vendor_id)
+
+# Facet cache invalidation
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Vendor)
+@receiver(post_delete, sender=Vendor)
+def catalog_changed_facets(sender, update_fields=None, **kwargs):
+    """Drop cached global facets when products or vendor visibility change"""
+    if sender is Product and not _writes_any(update_fields, facets.PRODUCT_FIELDS):
+        return
+    invalidate_global_facets()
+
+# Page cache versioning
+
+@receiver(post_save, sender=Vendor)
+@receiver(post_delete, sender=Vendor)
+def vendor_changed_pages(sender, instance, **kwargs):
+    """Expire cached pages for a changed vendor"""
+    bump_vendor_version(instance.id)
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed_pages(sender, instance, **kwargs):
+    """Expire cached pages and the product grid for a product's vendor"""
+    bump_vendor_version(instance.vendor_id)
+    bump_fragment_version(instance.vendor_id, 'products')
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=ReviewResponse)
+@receiver(post_delete, sender=ReviewResponse)
+def review_changed_pages(sender, instance, **kwargs):
+    """Expire cached pages and the review list for a review's vendor"""
+    bump_vendor_version(instance.vendor_id)
+    bump_fragment_version(instance.vendor_id, 'reviews')
+
+@receiver(post_save, sender=ProductMedia)
+@receiver(post_delete, sender=ProductMedia)
+def product_media_changed_pages(sender, instance, **kwargs):
+    """Expire cached pages and the product grid for the vendor of a product's media"""
+    vendor_id = Product.objects.filter(id=instance.product_id).values_list('vendor_id', flat=True).first()
+    if vendor_id is not None:
+        bump_vendor_version(vendor_id)
+        bump_fragment_version(vendor_id, 'products')
+
+def products_bulk_updated(vendor_id):
+    """
+    Queryset.update() sends no signals; call this after bulk product updates
+    to refresh everything the signal handlers above would have
+    """
+    VendorStats.refresh_products(vendor_id)
+    invalidate_global_facets()
+    bump_vendor_version(vendor_id)
+    bump_fragment_version(vendor_id, 'products')
+
+def product_media_bulk_created(product, media):
+    """
+    bulk_create sends no signals; call this after bulk-creating a product's
+    media to do everything the ProductMedia signal handlers above would have
+    """
+    if not media:
+        return
+    retain([item.image.name for item in media])
+    for item in media:
+        schedule_processing(item.id)
+    refresh_primary_media(product.id)
+    bump_vendor_version(product.vendor_id)
+    bump_fragment_version(product.vendor_id, 'products')
+
+# Anonymous carts
+
+@receiver(user_logged_in)
+def merge_cart_on_login(sender, request, user, **kwargs):
+    """Move the shopper's session cart into their database carts"""
+    if request is not None and hasattr(request, 'session'):
+        merge_session_cart(request.session, user)
+
+# Inventory holds
+
+@receiver(pre_delete, sender=Cart)
+def release_cart_holds(sender, instance, **kwargs):
+    """
+    Return a deleted cart's held stock, including carts removed by cascade
+    (e.g. with their user). Code that releases holds in bulk first leaves
+    nothing for this to do.
+    """
+    release_holds(CartItem.objects.filter(cart=instance), clear=False)
+    invalidate_header_state(instance.user_id)
+
+# Header state
+
+@receiver([post_save, post_delete], sender=Message)
+def message_changed_header(sender, instance, **kwargs):
+    """Unread counts are part of the recipient's header state"""
+    invalidate_header_state(instance.recipient_id)
+
+@receiver([post_save, post_delete], sender=VendorTeamMember)
+def team_changed_header(sender, instance, **kwargs):
+    """Team memberships are part of the member's header state"""
+    invalidate_header_state(instance.user_id)
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import re
+import tempfile
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+from django.utils import timezone
+
+# Content-addressed media storage
+# Product media are stored under the SHA-256 of their bytes, e.g.
+#   products/3f/3fa2...e1.jpg
+# so identical uploads share one file and a name always means the same bytes,
+# which lets media be cached forever (IMMUTABLE_CACHE_CONTROL). Nothing here
+# deletes files: MediaBlob rows count references and the collect_media_garbage
+# command removes unreferenced blobs (see blobs.py).
+# Files are written to a temporary name and renamed onto the hashed name, so
+# concurrent saves of the same bytes both end up at that name. Reusing a file
+# that is already stored first touches its blob row, which keeps garbage
+# collection away from it; when the row is gone (collected meanwhile) the
+# file is written again.
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]+)?$')
+
+def is_content_addressed(name):
+    """Whether a storage name is a content hash, i.e. its bytes can never change"""
+    return bool(HASHED_NAME.search(name))
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that names files by content hash and stores each one once"""
+
+    def hashed_name(self, name, content):
+        """Name for content: the requested directory, then the digest with the original extension"""
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        hexdigest = digest.hexdigest()
+        return os.path.join(directory, hexdigest[:2], hexdigest + extension).replace('\\', '/')
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        validate_file_name(name, allow_relative_path=True)
+        if max_length is not None and len(name) > max_length:
+            raise SuspiciousFileOperation(f'Storage name "{name}" is longer than {max_length} characters.')
+        # Already stored: the bytes are identical by construction
+        if self.exists(name) and self._claim(name):
+            return name
+        return self._save(name, content)
+
+    def _claim(self, name):
+        """Touch a stored file's blob row; False when there is none (e.g. just collected)"""
+        from .models import MediaBlob
+        return bool(MediaBlob.objects.filter(name=name).update(updated_at=timezone.now()))
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+        fd, temporary_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as temporary:
+                for chunk in content.chunks():
+                    temporary.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary_path, self.file_permissions_mode)
+            os.replace(temporary_path, full_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        return name
+
+_media_storage = ContentAddressedStorage()
+
+def media_storage():
+    """Storage for product media (a callable, so migrations don't serialize the instance)"""
+    return _media_storage
@@ -1,5 +1,6 @@
 from django import template
 from ..models import VendorTeamMember, Vendor
+from ..page_cache import get_version, vendor_fragment_scope
 
 register = template.Library()
 
@@ -31,3 +32,22 @@ def get_item(dictionary, key):
         return dictionary.get(key, 0)
     return 0
 
+
+@register.simple_tag
+def fragment_version(fragment, vendor_id):
+    """Content version of a cached vendor page fragment ('products' or 'reviews')"""
+    return get_version(vendor_fragment_scope(vendor_id, fragment))
+
+@register.inclusion_tag('market/product_picture.html')
+def product_picture(media, variant, alt='', css_class='', lazy=False):
+    """
+    A ProductMedia image at a resized variant ('thumbnail', 'card' or 'detail'),
+    offering WebP with a JPEG fallback; the original upload until it's processed
+    """
+    return {
+        'webp': media.variant_url(variant, 'webp'),
+        'src': media.variant_url(variant) or media.image.url,
+        'alt': alt,
+        'css_class': css_class,
+        'lazy': lazy,
+    }
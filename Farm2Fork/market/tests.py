@@ -1,3 +1,979 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+from datetime import timedelta
+from decimal import Decimal
+from PIL import Image
+from django.contrib import messages
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.db import SessionStore
+from django.http import Http404, HttpResponse
+from django.core.cache import cache
+from django.db import connection, DatabaseError, IntegrityError, transaction
+from django.db.models import F
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import CaptureQueriesContext
+from .models import Vendor, VendorStats, VendorTeamMember, Product, ProductMedia, MediaBlob, Review, Cart, CartItem, Order, AbandonedCartStats
+from . import cart as cart_service
+from .cart import SESSION_CART_KEY, SessionCartBackend, merge_session_cart
+from .header_state import get_header_state
+from .inventory import sweep_expired_holds
+from .checkout import checkout, CheckoutError
+from .management.commands.sweep_abandoned_carts import Command as SweepAbandonedCarts
+from .catalog import import_catalog, stream_catalog
+from .images import render_variants, process_media, store_uploads
+from .blobs import collect_garbage
+from .storage import media_storage, IMMUTABLE_CACHE_CONTROL
+from .serving import serve_media
+from .queries import search_vendors
+from .page_cache import cache_anonymous_page
+from .facets import global_facets
+from .pagination import KeysetPaginator, InvalidCursor, paginate
+from . import search
+from .pricing import MAX_PRICE, PricingError, bulk_reprice
+
+# Test data
+def create_vendor(name, **fields):
+    """A vendor with the required contact fields filled in"""
+    defaults = dict(email='farm@example.com', phone='555-0100', city='Springfield', state='IL', zip_code='62701', country='USA')
+    return Vendor.objects.create(name=name, **{**defaults, **fields})
+
+
+def image_upload(name='photo.jpg', size=(1000, 500), color=(200, 40, 40)):
+    """A small JPEG upload"""
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), 'image/jpeg')
+
+
+class MediaTestCase(TestCase):
+    """TestCase with a throwaway MEDIA_ROOT"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, True)
+        media_settings = self.settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.vendor = create_vendor('Media Farm')
+        self.product = Product.objects.create(vendor=self.vendor, name='Eggs', price=Decimal('4.00'))
+
+
+# Cart concurrency
+class CartConcurrencyTests(TransactionTestCase):
+    """Concurrent cart writes must not lose updates or exceed max_quantity"""
+
+    THREADS = 8
+    ADDS_PER_THREAD = 10
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper', password='secret')
+        self.vendor = create_vendor('Stress Farm')
+        self.product = Product.objects.create(
+            vendor=self.vendor, name='Eggs', price=Decimal('4.00'), max_quantity=50,
+        )
+
+    def _hammer(self, action):
+        """Run action concurrently from several threads; returns the per-call results"""
+        results = []
+        errors = []
+        lock = threading.Lock()
+        start = threading.Barrier(self.THREADS)
+
+        def worker():
+            try:
+                start.wait()
+                for _ in range(self.ADDS_PER_THREAD):
+                    outcome = action()
+                    with lock:
+                        results.append(outcome)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_concurrent_adds_are_not_lost_and_respect_max_quantity(self):
+        product = Product.objects.get(id=self.product.id)
+
+        def add_one():
+            try:
+                cart_service.add_item(self.user, product, 1)
+                return True
+            except cart_service.CartError:
+                return False
+
+        results = self._hammer(add_one)
+        accepted = sum(results)
+
+        items = CartItem.objects.filter(cart__user=self.user, product=self.product)
+        self.assertEqual(items.count(), 1)
+        self.assertEqual(items.get().quantity, accepted)
+        self.assertEqual(accepted, self.product.max_quantity)
+
+    def test_concurrent_quantity_updates_stay_within_limit(self):
+        cart_service.add_item(self.user, self.product, 1)
+        item = CartItem.objects.select_related('product').get(cart__user=self.user)
+
+        def set_quantity():
+            quantity = threading.get_ident() % self.product.max_quantity + 1
+            cart_service.set_item_quantity(item, quantity)
+            return quantity
+
+        results = self._hammer(set_quantity)
+
+        item.refresh_from_db()
+        self.assertIn(item.quantity, results)
+        self.assertLessEqual(item.quantity, self.product.max_quantity)
+
+    def test_concurrent_holds_never_oversell(self):
+        Product.objects.filter(id=self.product.id).update(track_inventory=True, stock_quantity=30)
+        product = Product.objects.get(id=self.product.id)
+
+        def add_one():
+            try:
+                cart_service.add_item(self.user, product, 1)
+                return True
+            except cart_service.CartError:
+                return False
+
+        accepted = sum(self._hammer(add_one))
+
+        product.refresh_from_db()
+        item = CartItem.objects.get(cart__user=self.user, product=product)
+        self.assertEqual(accepted, 30)
+        self.assertEqual(product.reserved_quantity, 30)
+        self.assertEqual(item.held_quantity, item.quantity)
+
+    def test_sweep_releases_expired_holds(self):
+        Product.objects.filter(id=self.product.id).update(track_inventory=True, stock_quantity=10)
+        cart_service.add_item(self.user, Product.objects.get(id=self.product.id), 4)
+        CartItem.objects.update(hold_expires_at=timezone.now() - timedelta(minutes=1))
+
+        self.assertEqual(sweep_expired_holds(), (1, 4))
+        self.assertEqual(Product.objects.get(id=self.product.id).reserved_quantity, 0)
+        self.assertEqual(CartItem.objects.get().held_quantity, 0)
+
+# Catalog import and export
+class CatalogImportTests(TestCase):
+    """Imports upsert by name, report bad rows and round-trip with exports"""
+
+    def setUp(self):
+        self.vendor = create_vendor('Catalog Farm')
+        Product.objects.create(vendor=self.vendor, name='Eggs', price=Decimal('4.00'))
+
+    def test_csv_upsert_and_error_report(self):
+        data = (
+            'name,price,category,track_inventory,stock_quantity\n'
+            'Eggs,4.50,,,\n'
+            'Honey,9.99,Herbs,yes,12\n'
+            'Jam,1.234,,,\n'
+            'Milk,,dairy,,\n'
+            'Honey,3.00,,,\n'
+        )
+        report = import_catalog(self.vendor, io.BytesIO(data.encode()), 'csv', batch_size=2)
+
+        self.assertEqual((report.rows, report.created, report.updated), (5, 1, 1))
+        self.assertEqual([number for number, message in report.errors], [3, 4, 5])
+        self.assertEqual(Product.objects.get(name='Eggs').price, Decimal('4.50'))
+        honey = Product.objects.get(name='Honey')
+        self.assertEqual((honey.category, honey.track_inventory, honey.stock_quantity), ('herbs', True, 12))
+
+    def test_json_export_round_trips(self):
+        Product.objects.create(vendor=self.vendor, name='Honey', price=Decimal('9.99'), track_inventory=True, stock_quantity=3)
+        exported = ''.join(stream_catalog(self.vendor, 'json', chunk_size=1))
+        Product.objects.all().delete()
+
+        report = import_catalog(self.vendor, io.BytesIO(exported.encode()), 'json')
+
+        self.assertEqual((report.created, report.errors), (2, []))
+        honey = Product.objects.get(name='Honey')
+        self.assertEqual((honey.price, honey.stock_quantity), (Decimal('9.99'), 3))
+
+
+class ProductSaveTests(TestCase):
+    """save_changed() writes only changed fields; the stock invariant holds for bulk writes too"""
+
+    def setUp(self):
+        vendor = create_vendor('Save Farm')
+        self.product = Product.objects.create(vendor=vendor, name='Eggs', price=Decimal('4.00'))
+
+    def test_save_changed_writes_only_changed_fields(self):
+        product = Product.objects.get(id=self.product.id)
+        Product.objects.filter(id=product.id).update(price=Decimal('5.00'))
+        product.is_available = False
+
+        with CaptureQueriesContext(connection) as queries:
+            product.save_changed()
+
+        update = queries.captured_queries[0]['sql']
+        self.assertTrue(update.startswith('UPDATE'))
+        self.assertIn('"is_available"', update)
+        self.assertNotIn('"price"', update)
+        self.assertEqual(Product.objects.get(id=product.id).price, Decimal('5.00'))
+        self.assertEqual(product.changed_fields(), [])
+
+    def test_save_changed_after_delete_raises(self):
+        product = Product.objects.get(id=self.product.id)
+        Product.objects.filter(id=product.id).delete()
+        product.price = Decimal('6.00')
+        with self.assertRaises(DatabaseError):
+            product.save_changed()
+
+    def test_save_copies_loaded_product(self):
+        product = Product.objects.get(id=self.product.id)
+        product.pk = None
+        product.save()
+        self.assertEqual(Product.objects.filter(name='Eggs').count(), 2)
+
+    def test_stock_only_save_skips_stats_and_search(self):
+        product = Product.objects.get(id=self.product.id)
+        product.stock_quantity = 7
+        with CaptureQueriesContext(connection) as queries:
+            product.save_changed()
+        statements = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('market_vendorstats', statements)
+        self.assertNotIn('market_vendorsearch', statements)
+
+    def test_check_constraint_guards_queryset_updates(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Product.objects.filter(id=self.product.id).update(track_inventory=True)
+
+
+class ConditionalGetTests(TestCase):
+    """ETags change with everything a page renders; deletions included"""
+
+    def setUp(self):
+        cache.clear()
+        self.vendor = create_vendor('Etag Farm')
+        self.product = Product.objects.create(vendor=self.vendor, name='Eggs', price=Decimal('4.00'))
+        self.review = Review.objects.create(vendor=self.vendor, consumer_name='Ann', rating=5)
+
+    def assertRevalidates(self, url, change):
+        """304 for the current ETag, then 200 with a new ETag once change() has run"""
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_vendor_detail_revalidates_after_deletions(self):
+        url = reverse('vendor_detail', args=[self.vendor.id])
+        self.assertRevalidates(url, self.review.delete)
+        self.assertRevalidates(url, self.product.delete)
+
+    def test_catalog_revalidates_after_deletion(self):
+        self.assertRevalidates(reverse('product_list'), self.product.delete)
+
+    def test_no_last_modified_validator(self):
+        url = reverse('vendor_detail', args=[self.vendor.id])
+        response = self.client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT')
+        self.assertEqual(response.status_code, 200)
+
+
+class ProductImageTests(MediaTestCase):
+    """Variants are rendered to size and products track their primary image"""
+
+    def test_render_variants(self):
+        rendered = render_variants(image_upload())
+
+        self.assertEqual(len(rendered), 6)
+        sizes = {key: Image.open(io.BytesIO(data)).size for key, data in rendered.items()}
+        self.assertEqual(sizes[('thumbnail', 'webp')], (160, 160))
+        self.assertEqual(sizes[('card', 'jpeg')], (640, 400))
+        # Fit-within variants are never upscaled
+        self.assertEqual(sizes[('detail', 'jpeg')], (1000, 500))
+
+    def test_primary_media_denormalized(self):
+        first = ProductMedia.objects.create(product=self.product, image=image_upload('a.jpg'), order=0)
+        primary = ProductMedia.objects.create(
+            product=self.product, image=image_upload('b.jpg', color=(0, 90, 0)), order=1, is_primary=True,
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_media, primary)
+        self.assertEqual(self.product.thumbnail_url, primary.image.url)
+
+        updated_at = self.product.updated_at
+        self.assertTrue(process_media(primary.id))
+        primary.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual(primary.processing_state, 'ready')
+        self.assertEqual(self.product.thumbnail_url, primary.variant_url('thumbnail'))
+        self.assertGreater(self.product.updated_at, updated_at)
+
+        primary.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.primary_media, first)
+
+    def test_product_delete_skips_primary_recompute(self):
+        for name in ('a.jpg', 'b.jpg'):
+            ProductMedia.objects.create(product=self.product, image=image_upload(name))
+        with CaptureQueriesContext(connection) as queries:
+            self.product.delete()
+        # The collector nulls primary_media itself; no recompute writes the thumbnail
+        self.assertNotIn('"thumbnail_url"', ' '.join(query['sql'] for query in queries.captured_queries))
+        self.assertFalse(ProductMedia.objects.exists())
+
+
+class AbandonedCartSweepTests(TestCase):
+    """The sweeper removes stale carts but spares carts touched after selection"""
+
+    def setUp(self):
+        vendor = create_vendor('Sweep Farm')
+        self.product = Product.objects.create(
+            vendor=vendor, name='Eggs', price=Decimal('4.00'), track_inventory=True, stock_quantity=10,
+        )
+        Product.objects.filter(id=self.product.id).update(reserved_quantity=4)
+        self.carts = []
+        for name in ('stale', 'touched'):
+            cart = Cart.objects.create(user=User.objects.create_user(name), vendor=vendor)
+            CartItem.objects.create(cart=cart, product=self.product, quantity=2, held_quantity=2)
+            self.carts.append(cart)
+        old = timezone.now() - timedelta(days=40)
+        Cart.objects.update(updated_at=old)
+        CartItem.objects.update(updated_at=old)
+
+    def test_cart_touched_after_selection_is_kept(self):
+        command = SweepAbandonedCarts()
+        cutoff = timezone.now() - timedelta(days=30)
+        cart_ids = list(command.stale_carts(cutoff).values_list('id', flat=True))
+        stale, touched = self.carts
+        CartItem.objects.filter(cart=touched).update(quantity=3, updated_at=timezone.now())
+
+        self.assertEqual(command.remove_batch(cart_ids, 500, cutoff), (1, 1))
+
+        self.assertFalse(Cart.objects.filter(id=stale.id).exists())
+        self.assertEqual(CartItem.objects.get(cart=touched).held_quantity, 2)
+        self.assertEqual(Product.objects.get(id=self.product.id).reserved_quantity, 2)
+        self.assertEqual(AbandonedCartStats.objects.get().cart_count, 1)
+
+    def test_items_deleted_in_chunks(self):
+        command = SweepAbandonedCarts()
+        cutoff = timezone.now() - timedelta(days=30)
+        cart_ids = list(command.stale_carts(cutoff).values_list('id', flat=True))
+
+        self.assertEqual(command.remove_batch(cart_ids, 1, cutoff), (2, 2))
+
+        self.assertFalse(Cart.objects.exists())
+        self.assertEqual(Product.objects.get(id=self.product.id).reserved_quantity, 0)
+        self.assertEqual(AbandonedCartStats.objects.get().cart_count, 2)
+
+
+class MediaBlobTests(MediaTestCase):
+    """Identical uploads share one file, counted until garbage collection removes it"""
+
+    def test_refcount_and_garbage_collection(self):
+        first = ProductMedia.objects.create(product=self.product, image=image_upload('a.jpg'))
+        second = ProductMedia.objects.create(product=self.product, image=image_upload('b.jpg'))
+        name = first.image.name
+        self.assertEqual(second.image.name, name)
+        self.assertEqual(MediaBlob.objects.get(name=name).ref_count, 2)
+
+        first.delete()
+        self.assertEqual(collect_garbage(grace=timedelta(0)), (0, 0))
+        second.delete()
+        self.assertEqual(MediaBlob.objects.get(name=name).ref_count, 0)
+        # Still within the grace period
+        self.assertEqual(collect_garbage()[0], 0)
+
+        deleted, freed = collect_garbage(grace=timedelta(0))
+        self.assertEqual(deleted, 1)
+        self.assertGreater(freed, 0)
+        self.assertFalse(media_storage().exists(name))
+        self.assertFalse(MediaBlob.objects.filter(name=name).exists())
+
+    def test_reuse_after_collection_rewrites_file(self):
+        storage = media_storage()
+        name = storage.save('products/a.jpg', image_upload())
+        MediaBlob.objects.create(name=name)
+        self.assertEqual(storage.save('products/b.jpg', image_upload()), name)
+
+        # The blob was collected after exists() saw the file: write it again
+        MediaBlob.objects.filter(name=name).delete()
+        with open(storage.path(name), 'wb') as partial:
+            partial.write(b'partial')
+        self.assertEqual(storage.save('products/c.jpg', image_upload()), name)
+        self.assertEqual(storage.size(name), image_upload().size)
+
+    def test_same_name_is_replaced_not_renamed(self):
+        storage = media_storage()
+        name = storage.save('products/a.jpg', image_upload())
+        # What a concurrent save of the same bytes does once both missed exists()
+        self.assertEqual(storage._save(name, image_upload()), name)
+        self.assertEqual(storage.listdir(os.path.dirname(name))[1], [os.path.basename(name)])
+
+
+class HeaderStateTests(TestCase):
+    """Cached header state is dropped only once cart changes commit"""
+
+    def test_invalidated_on_commit(self):
+        user = User.objects.create_user('shopper')
+        vendor = create_vendor('Header Farm')
+        product = Product.objects.create(vendor=vendor, name='Eggs', price=Decimal('4.00'))
+        cache.clear()
+        self.assertEqual(get_header_state(user, None)['carts'], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cart_service.add_item(user, product, 2)
+            # Not committed yet: a concurrent request would still see the old state
+            self.assertEqual(get_header_state(user, None)['carts'], [])
+
+        self.assertEqual(get_header_state(user, None)['carts'][0]['item_count'], 2)
+
+    def test_cart_count_reads_one_cart(self):
+        user = User.objects.create_user('shopper')
+        vendor = create_vendor('Header Farm')
+        cart_service.add_item(user, Product.objects.create(vendor=vendor, name='Eggs', price=Decimal('4.00')), 3)
+        self.client.force_login(user)
+        url = reverse('cart_count', args=[vendor.id])
+        cache.clear()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.json(), {'count': 3})
+        statements = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('market_message', statements)
+        self.assertNotIn('market_vendorteammember', statements)
+
+
+class VendorStatsTests(TestCase):
+    """Incrementally maintained stats always match a full re-aggregate"""
+
+    def setUp(self):
+        self.vendors = [create_vendor(f'Stats Farm {n}') for n in range(2)]
+
+    def assertStatsCurrent(self):
+        for vendor in self.vendors:
+            stats = VendorStats.objects.get(vendor=vendor)
+            expected = {**VendorStats.review_values(vendor.id), **VendorStats.product_values(vendor.id)}
+            self.assertEqual({field: getattr(stats, field) for field in expected}, expected)
+
+    def test_product_changes(self):
+        first, second = self.vendors
+        cheap = Product.objects.create(vendor=first, name='Eggs', price=Decimal('2.00'), category='dairy')
+        dear = Product.objects.create(vendor=first, name='Beef', price=Decimal('30.00'), category='meat')
+        Product.objects.create(vendor=first, name='Milk', price=Decimal('5.00'), category='dairy')
+        self.assertStatsCurrent()
+
+        dear = Product.objects.get(id=dear.id)
+        dear.price = Decimal('12.00')
+        dear.save()
+        self.assertStatsCurrent()
+        dear.category = 'other'
+        dear.is_available = False
+        dear.save()
+        self.assertStatsCurrent()
+        cheap = Product.objects.get(id=cheap.id)
+        cheap.vendor = second
+        cheap.save()
+        self.assertStatsCurrent()
+        cheap.stock_quantity = 4
+        cheap.save()
+        self.assertStatsCurrent()
+        Product.objects.get(id=dear.id).delete()
+        cheap.delete()
+        self.assertStatsCurrent()
+
+    def test_review_changes(self):
+        first, second = self.vendors
+        review = Review.objects.create(vendor=first, consumer_name='Ann', rating=2)
+        Review.objects.create(vendor=first, consumer_name='Bob', rating=5)
+        review = Review.objects.get(id=review.id)
+        review.rating = 4
+        review.save()
+        self.assertStatsCurrent()
+        review.vendor = second
+        review.save()
+        self.assertStatsCurrent()
+        review.delete()
+        self.assertStatsCurrent()
+
+
+class VendorFilterTests(TestCase):
+    """market_home filters are EXISTS subqueries with price warning flags"""
+
+    def setUp(self):
+        self.dairy = create_vendor('Dairy Barn')
+        Product.objects.create(vendor=self.dairy, name='Milk', price=Decimal('3.00'), category='dairy')
+        Product.objects.create(vendor=self.dairy, name='Cheese', price=Decimal('12.00'), category='dairy')
+        self.orchard = create_vendor('Orchard', city='Shelbyville')
+        Product.objects.create(vendor=self.orchard, name='Apples', price=Decimal('5.00'), category='fruits')
+
+    def test_category_and_price_filters(self):
+        self.assertEqual(list(search_vendors(category_filter='dairy')), [self.dairy])
+        vendors = list(search_vendors(min_price=Decimal('4.00'), max_price=Decimal('6.00')))
+        self.assertEqual(vendors, [self.orchard])
+        self.assertEqual(list(search_vendors(location_filter='shelby')), [self.orchard])
+
+    def test_price_warning_flags(self):
+        dairy = search_vendors(max_price=Decimal('5.00')).get(id=self.dairy.id)
+        self.assertTrue(dairy.has_products_above_max)
+        self.assertFalse(dairy.has_products_below_min)
+
+
+class SearchTests(TestCase):
+    """Full-text search ranks by relevance and falls back to icontains elsewhere"""
+
+    def setUp(self):
+        self.by_product = create_vendor('Green Acres', description='Family farm')
+        Product.objects.create(vendor=self.by_product, name='Heirloom tomatoes', price=Decimal('4.00'))
+        self.by_name = create_vendor('Tomato Hill', description='Tomatoes and more tomatoes')
+        create_vendor('Dairy Barn', description='Milk and cheese')
+
+    def test_ranked_by_relevance(self):
+        self.assertEqual(list(search_vendors('tomato')), [self.by_name, self.by_product])
+        # Prefix matching: "tom hill" finds "Tomato Hill"
+        self.assertEqual(list(search_vendors('tom hill')), [self.by_name])
+
+    def test_index_follows_product_changes(self):
+        Product.objects.create(vendor=self.by_product, name='Sourdough', price=Decimal('6.00'))
+        self.assertEqual(list(search_vendors('sourdough')), [self.by_product])
+
+    def test_icontains_fallback(self):
+        with mock.patch.object(search, 'is_enabled', return_value=False):
+            vendors = set(search_vendors('tomato'))
+        self.assertEqual(vendors, {self.by_name, self.by_product})
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursors continue from the last row seen, whatever is inserted meanwhile"""
+
+    def setUp(self):
+        vendor = create_vendor('Paging Farm')
+        # Duplicate names exercise the primary key tiebreaker
+        for name in ['Apples', 'Beans', 'Beans', 'Carrots', 'Dill', 'Eggs', 'Figs']:
+            Product.objects.create(vendor=vendor, name=name, price=Decimal('1.00'))
+        self.vendor = vendor
+
+    def test_pages_are_stable_under_inserts(self):
+        paginator = KeysetPaginator(Product.objects.order_by('name'), 3)
+        first = paginator.page()
+        # Rows inserted before the cursor must not shift the next page
+        Product.objects.create(vendor=self.vendor, name='Aardvark beans', price=Decimal('1.00'))
+        second = paginator.page(first.next_cursor)
+        third = paginator.page(second.next_cursor)
+
+        names = [product.name for page in (first, second, third) for product in page]
+        self.assertEqual(names, ['Apples', 'Beans', 'Beans', 'Carrots', 'Dill', 'Eggs', 'Figs'])
+        self.assertFalse(third.has_next)
+        self.assertEqual(list(paginator.page(second.previous_cursor)), list(first))
+
+    def test_invalid_cursor(self):
+        paginator = KeysetPaginator(Product.objects.order_by('name'), 3)
+        for cursor in ('not-a-cursor', 'eyJrIjpbMV0sImQiOiJuZXh0In0'):
+            with self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
+        # Views fall back to the first page
+        page = paginate(RequestFactory().get('/', {'cursor': 'not-a-cursor'}), Product.objects.order_by('name'), 3)
+        self.assertEqual([product.name for product in page], ['Apples', 'Beans', 'Beans'])
+
+
+class FacetTests(TestCase):
+    """Global facets are cached until a product change can affect them"""
+
+    def setUp(self):
+        cache.clear()
+        self.vendor = create_vendor('Facet Farm')
+        self.product = Product.objects.create(vendor=self.vendor, name='Milk', price=Decimal('3.00'), category='dairy')
+
+    def category_counts(self):
+        return {row['value']: row['product_count'] for row in global_facets()['categories'] if row['product_count']}
+
+    def test_invalidated_by_product_changes(self):
+        self.assertEqual(self.category_counts(), {'dairy': 1})
+        Product.objects.create(vendor=self.vendor, name='Apples', price=Decimal('9.00'), category='fruits')
+        self.assertEqual(self.category_counts(), {'dairy': 1, 'fruits': 1})
+        self.assertEqual(global_facets()['price_range']['max'], Decimal('9.00'))
+        self.product.delete()
+        self.assertEqual(self.category_counts(), {'fruits': 1})
+
+    def test_cached_between_changes(self):
+        global_facets()
+        # Queryset updates send no signals, so the cached facets stay as they were
+        Product.objects.update(category='meat')
+        self.assertEqual(self.category_counts(), {'dairy': 1})
+        product = Product.objects.get(id=self.product.id)
+        product.stock_quantity = 3
+        product.save_changed()
+        self.assertEqual(self.category_counts(), {'dairy': 1})
+
+
+class AnonymousPageCacheTests(TestCase):
+    """Only plain anonymous GETs are served from the page cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+        @cache_anonymous_page()
+        def view(request):
+            self.calls += 1
+            return HttpResponse('page', headers={'Vary': 'Accept-Language', 'X-Page': 'storefront'})
+        self.view = view
+
+    def request(self, user=None):
+        request = RequestFactory().get('/market/')
+        request.user = user or AnonymousUser()
+        request.session = SessionStore()
+        request._messages = FallbackStorage(request)
+        return request
+
+    def test_plain_anonymous_requests_are_cached(self):
+        miss = self.view(self.request())
+        hit = self.view(self.request())
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(hit.content, b'page')
+        self.assertEqual(dict(hit.items()), dict(miss.items()))
+
+    def test_bypassed_for_messages_session_carts_and_users(self):
+        with_message = self.request()
+        messages.info(with_message, 'Added to cart')
+        with_cart = self.request()
+        with_cart.session[SESSION_CART_KEY] = {'1': {'items': {'1': 2}}}
+        signed_in = self.request(User.objects.create_user('shopper'))
+
+        for request in (with_message, with_cart, signed_in):
+            self.view(request)
+        self.assertEqual(self.calls, 3)
+        # Nothing they rendered was cached for plain visitors
+        self.view(self.request())
+        self.assertEqual(self.calls, 4)
+
+
+class VendorFragmentCacheTests(TestCase):
+    """Signed-in vendor pages reuse cached fragments until their section changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.vendor = create_vendor('Fragment Farm')
+        self.product = Product.objects.create(vendor=self.vendor, name='Milk', price=Decimal('3.00'))
+        self.client.force_login(User.objects.create_user('shopper'))
+        self.url = reverse('vendor_detail', args=[self.vendor.id])
+
+    def test_product_grid_fragment(self):
+        self.assertContains(self.client.get(self.url), 'Milk')
+        # update() sends no signals: the cached grid is still served
+        Product.objects.filter(id=self.product.id).update(name='Buttermilk')
+        self.assertNotContains(self.client.get(self.url), 'Buttermilk')
+
+        Product.objects.create(vendor=self.vendor, name='Cream', price=Decimal('4.00'))
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Buttermilk')
+        self.assertContains(response, 'Cream')
+
+    def test_review_fragment(self):
+        self.client.get(self.url)
+        Review.objects.create(vendor=self.vendor, consumer_name='Ann', rating=5, comment='Lovely cheese')
+        self.assertContains(self.client.get(self.url), 'Lovely cheese')
+
+
+class VendorPageQueryTests(TestCase):
+    """vendor_detail runs a fixed number of queries and revalidates on viewer changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.vendor = create_vendor('Query Farm')
+        self.user = User.objects.create_user('shopper')
+        self.client.force_login(self.user)
+        self.url = reverse('vendor_detail', args=[self.vendor.id])
+
+    def add_catalog(self, count):
+        for n in range(count):
+            product = Product.objects.create(vendor=self.vendor, name=f'Product {n}', price=Decimal('1.00'), category='fruits')
+            Review.objects.create(vendor=self.vendor, consumer_name=f'Reviewer {n}', rating=4)
+            ProductMedia.objects.bulk_create([ProductMedia(product=product, image=f'products/{n}.jpg')])
+
+    def queries_for_page(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow(self):
+        self.add_catalog(2)
+        baseline = self.queries_for_page()
+        self.add_catalog(10)
+        self.assertEqual(self.queries_for_page(), baseline)
+
+    def test_etag_follows_cart_and_team(self):
+        product = Product.objects.create(vendor=self.vendor, name='Milk', price=Decimal('3.00'))
+        etag = self.client.get(self.url)['ETag']
+        cart_service.add_item(self.user, product, 1)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get(self.url)['ETag']
+        VendorTeamMember.objects.create(user=self.user, vendor=self.vendor)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CartTotalsTests(TestCase):
+    """Cart totals and counts computed in the database match the items"""
+
+    def test_with_totals(self):
+        user = User.objects.create_user('shopper')
+        vendor = create_vendor('Totals Farm')
+        cart = Cart.objects.create(user=user, vendor=vendor)
+        Cart.objects.create(user=user, vendor=create_vendor('Empty Farm'))
+        for name, price, quantity in [('Milk', '3.10', 3), ('Honey', '7.25', 2)]:
+            product = Product.objects.create(vendor=vendor, name=name, price=Decimal(price))
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+
+        totals = {c.vendor_id: (c.item_count, c.total_price) for c in Cart.objects.with_totals()}
+        self.assertEqual(totals[vendor.id], (5, Decimal('23.80')))
+        self.assertEqual(totals[vendor.id], (cart.item_count, cart.total_price))
+        self.assertEqual(sorted(totals.values())[0], (0, Decimal('0.00')))
+
+
+class SessionCartTests(TestCase):
+    """Anonymous carts live in the session and merge into the database on login"""
+
+    def test_merge_on_login(self):
+        vendor = create_vendor('Session Farm')
+        milk = Product.objects.create(vendor=vendor, name='Milk', price=Decimal('3.00'), max_quantity=5)
+        honey = Product.objects.create(vendor=vendor, name='Honey', price=Decimal('7.00'))
+        user = User.objects.create_user('shopper')
+        cart_service.add_item(user, milk, 3)
+
+        session = SessionStore()
+        backend = SessionCartBackend(session)
+        backend.add(milk, 4)
+        backend.add(honey, 1)
+        self.assertEqual(backend.count(vendor.id), 5)
+        self.assertFalse(CartItem.objects.filter(product=honey).exists())
+
+        merge_session_cart(session, user)
+
+        quantities = dict(CartItem.objects.filter(cart__user=user).values_list('product__name', 'quantity'))
+        # Merged quantities are capped at max_quantity
+        self.assertEqual(quantities, {'Milk': 5, 'Honey': 1})
+        self.assertNotIn(SESSION_CART_KEY, session)
+
+    def test_merge_holds_only_available_stock(self):
+        vendor = create_vendor('Session Farm')
+        eggs = Product.objects.create(vendor=vendor, name='Eggs', price=Decimal('4.00'), track_inventory=True, stock_quantity=6)
+        user = User.objects.create_user('shopper')
+        cart_service.add_item(user, eggs, 2)
+
+        session = SessionStore()
+        SessionCartBackend(session).add(eggs, 3)
+        # Another shopper holds units after the session cart was filled
+        cart_service.add_item(User.objects.create_user('rival'), eggs, 3)
+
+        merge_session_cart(session, user)
+
+        item = CartItem.objects.get(cart__user=user)
+        self.assertEqual((item.quantity, item.held_quantity), (3, 3))
+        self.assertEqual(Product.objects.get(id=eggs.id).reserved_quantity, 6)
+
+    def test_merge_retries_after_insert_conflict(self):
+        vendor = create_vendor('Session Farm')
+        milk = Product.objects.create(vendor=vendor, name='Milk', price=Decimal('3.00'))
+        user = User.objects.create_user('shopper')
+        session = SessionStore()
+        SessionCartBackend(session).add(milk, 2)
+        bulk_create = CartItem.objects.bulk_create
+        calls = []
+
+        def conflict_once(items):
+            # As if another tab inserted the same item between the read and the insert
+            calls.append(items)
+            if len(calls) == 1:
+                raise IntegrityError('UNIQUE constraint failed')
+            return bulk_create(items)
+
+        with mock.patch.object(CartItem.objects, 'bulk_create', side_effect=conflict_once):
+            merge_session_cart(session, user)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(CartItem.objects.get(cart__user=user).quantity, 2)
+
+
+class CheckoutTests(TestCase):
+    """Checkout writes nothing when any product is short of stock"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper')
+        self.vendor = create_vendor('Checkout Farm')
+        self.eggs = Product.objects.create(vendor=self.vendor, name='Eggs', price=Decimal('4.00'), track_inventory=True, stock_quantity=10)
+        self.honey = Product.objects.create(vendor=self.vendor, name='Honey', price=Decimal('9.00'), track_inventory=True, stock_quantity=5)
+        cart_service.add_item(self.user, self.eggs, 2)
+        cart_service.add_item(self.user, self.honey, 3)
+
+    def test_insufficient_stock_rolls_back(self):
+        # Stock sold elsewhere since the items were added
+        Product.objects.filter(id=self.honey.id).update(stock_quantity=3, reserved_quantity=F('reserved_quantity') + 2)
+
+        with self.assertRaisesMessage(CheckoutError, 'Honey (1 left)'):
+            checkout(self.user, self.vendor.id)
+
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), 2)
+        stock = dict(Product.objects.values_list('name', 'stock_quantity'))
+        self.assertEqual(stock, {'Eggs': 10, 'Honey': 3})
+
+    def test_checkout(self):
+        order = checkout(self.user, self.vendor.id)
+
+        self.assertEqual(order.total_price, Decimal('35.00'))
+        self.assertEqual(order.items.count(), 2)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+        eggs = Product.objects.get(id=self.eggs.id)
+        self.assertEqual((eggs.stock_quantity, eggs.reserved_quantity), (8, 0))
+
+
+class CartBatchUpdateTests(TestCase):
+    """The batched cart endpoint applies all changes or none"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('shopper')
+        self.client.force_login(self.user)
+        self.vendor = create_vendor('Batch Farm')
+        self.milk = Product.objects.create(vendor=self.vendor, name='Milk', price=Decimal('3.00'), max_quantity=5)
+        self.honey = Product.objects.create(vendor=self.vendor, name='Honey', price=Decimal('7.00'))
+        cart_service.add_item(self.user, self.milk, 1)
+        cart_service.add_item(self.user, self.honey, 1)
+        self.items = dict(CartItem.objects.values_list('product__name', 'id'))
+        self.url = reverse('update_cart_items', args=[self.vendor.id])
+
+    def post(self, changes):
+        items = [{'item_id': self.items[name], 'quantity': quantity} for name, quantity in changes.items()]
+        return self.client.post(self.url, json.dumps({'items': items}), content_type='application/json')
+
+    def test_applies_changes(self):
+        response = self.post({'Milk': 4, 'Honey': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(dict(CartItem.objects.values_list('product__name', 'quantity')), {'Milk': 4})
+
+    def test_invalid_change_applies_nothing(self):
+        response = self.post({'Milk': 9, 'Honey': 0})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(self.items['Milk']), response.json()['errors'])
+        self.assertEqual(dict(CartItem.objects.values_list('product__name', 'quantity')), {'Milk': 1, 'Honey': 1})
+
+
+class BulkRepriceTests(TestCase):
+    """Bulk price changes round half-up to cents and respect the price field"""
+
+    def setUp(self):
+        self.vendor = create_vendor('Price Farm')
+        self.jam = Product.objects.create(vendor=self.vendor, name='Jam', price=Decimal('3.33'))
+        self.tea = Product.objects.create(vendor=self.vendor, name='Tea', price=Decimal('1.05'))
+        self.products = Product.objects.filter(vendor=self.vendor)
+
+    def prices(self):
+        return dict(self.products.values_list('name', 'price'))
+
+    def test_multiply_rounds_half_up(self):
+        self.assertEqual(bulk_reprice(self.products, 'price_multiply', Decimal('1.5')), 2)
+        self.assertEqual(self.prices(), {'Jam': Decimal('5.00'), 'Tea': Decimal('1.58')})
+
+    def test_decrease_clamps_at_zero(self):
+        bulk_reprice(self.products, 'price_decrease', Decimal('2.00'))
+        self.assertEqual(self.prices(), {'Jam': Decimal('1.33'), 'Tea': Decimal('0.00')})
+
+    def test_result_above_max_price_writes_nothing(self):
+        with self.assertRaises(PricingError):
+            bulk_reprice(self.products, 'price_increase', MAX_PRICE - Decimal('1.00'))
+        self.assertEqual(self.prices(), {'Jam': Decimal('3.33'), 'Tea': Decimal('1.05')})
+        bulk_reprice(self.products, 'price_increase', MAX_PRICE - Decimal('3.33'))
+        self.assertEqual(self.prices()['Jam'], MAX_PRICE)
+
+
+class MediaServingTests(MediaTestCase):
+    """serve_media answers conditional and range requests from the file on disk"""
+
+    def setUp(self):
+        super().setUp()
+        self.name = media_storage().save('products/photo.jpg', ContentFile(b'0123456789'))
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        return serve_media(self.factory.get('/media/' + self.name, **headers), self.name)
+
+    def test_full_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+
+    def test_ranges(self):
+        response = self.get(HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+
+        response = self.get(HTTP_RANGE='bytes=-3')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        response = self.get(HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_if_range_mismatch_sends_whole_file(self):
+        response = self.get(HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_hidden_and_non_media_files_not_found(self):
+        for name in ('products/.upload-abc123', 'products/.cache/photo.jpg', 'products/notes.txt'):
+            path = media_storage().path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(b'secret')
+            with self.assertRaises(Http404):
+                serve_media(self.factory.get('/media/' + name), name)
+
+    def test_if_none_match(self):
+        etag = self.get()['ETag']
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+
+class StoreUploadsTests(MediaTestCase):
+    """Uploads are validated and stored in parallel, keeping their order"""
+
+    def setUp(self):
+        super().setUp()
+        # Worker threads would use their own connections and wait on this
+        # test's open transaction; run the uploads in the test thread instead
+        inline = mock.patch('market.images._upload_executor_instance', return_value=mock.Mock(map=map))
+        inline.start()
+        self.addCleanup(inline.stop)
+
+    def test_names_in_upload_order(self):
+        uploads = [image_upload('red.jpg'), image_upload('blue.jpg', color=(0, 0, 200)), image_upload('red-again.jpg')]
+        names, errors = store_uploads(uploads)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(names), 3)
+        self.assertNotEqual(names[0], names[1])
+        self.assertEqual(names[0], names[2])
+        self.assertTrue(all(media_storage().exists(name) for name in names))
+
+    def test_invalid_upload_reported_by_name(self):
+        names, errors = store_uploads([image_upload('good.jpg'), SimpleUploadedFile('bad.jpg', b'not an image', 'image/jpeg')])
+        self.assertEqual(len(names), 1)
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].startswith('bad.jpg: '))
 
-# Create your tests here.
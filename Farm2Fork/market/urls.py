@@ -14,7 +14,10 @@ urlpatterns = [
     path('cart/update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
     path('cart/remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('cart/clear/<int:vendor_id>/', views.clear_cart, name='clear_cart'),
+    path('cart/vendor/<int:vendor_id>/items/', views.update_cart_items, name='update_cart_items'),
     path('cart/count/<int:vendor_id>/', views.cart_count, name='cart_count'),
+    path('cart/checkout/<int:vendor_id>/', views.checkout, name='checkout'),
+    path('header-state/', views.header_state, name='header_state'),
     # Vendor Application
     path('apply-to-be-vendor/', views.apply_to_be_vendor, name='apply_to_be_vendor'),
     # Vendor Team Management
@@ -29,6 +32,8 @@ urlpatterns = [
     path('vendor/<int:vendor_id>/products/<int:product_id>/edit/', views.edit_product, name='edit_product'),
     path('vendor/<int:vendor_id>/products/<int:product_id>/delete/', views.delete_product, name='delete_product'),
     path('vendor/<int:vendor_id>/products/bulk/', views.bulk_product_operations, name='bulk_product_operations'),
+    path('vendor/<int:vendor_id>/products/export/', views.export_products, name='export_products'),
+    path('vendor/<int:vendor_id>/products/import/', views.import_products, name='import_products'),
     # Review Management
     path('vendor/<int:vendor_id>/reviews/', views.vendor_reviews, name='vendor_reviews'),
     path('vendor/<int:vendor_id>/reviews/<int:review_id>/respond/', views.respond_to_review, name='respond_to_review'),
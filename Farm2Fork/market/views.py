@@ -1,25 +1,47 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from django.db import transaction
 from django.db.models import Q, Min, Max, Count, Sum, Avg, F, DecimalField
 from django.db.models.functions import TruncDate, TruncMonth
 from django.utils import timezone
 from datetime import timedelta
 from decimal import Decimal
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404, StreamingHttpResponse
+from django.utils.text import slugify
+from django.views.decorators.http import condition, require_POST, require_safe
+from django.views.decorators.csrf import ensure_csrf_cookie
 import json
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, update_session_auth_hash
 from django.contrib.auth.views import LoginView
-from .models import Product, Vendor, Consumer, Review, Cart, CartItem, Order, OrderItem, VendorApplication, VendorTeamMember, ProductMedia, ReviewResponse, Message
+from .models import Product, Vendor, Consumer, Review, Cart, CartItem, Order, OrderItem, VendorApplication, VendorTeamMember, ProductMedia, ReviewResponse, Message, AbandonedCartStats
 from .forms import VendorApplicationForm, VendorEditForm, ProductForm, ReviewResponseForm, UserProfileForm, PasswordChangeFormCustom
 from .decorators import vendor_team_required, vendor_owner_required
+from .queries import search_vendors, parse_price
+from .pagination import paginate
+from .facets import global_facets, result_facets
+from .page_cache import cache_anonymous_page
+from .loaders import load_vendor_page
+from .conditional import catalog_etag, vendor_detail_etag
+from .signals import products_bulk_updated, product_media_bulk_created
+from . import cart as cart_service
+from .header_state import get_header_state
+from .checkout import checkout as checkout_cart, CheckoutError, SHIPPING_FIELDS
+from .pricing import bulk_reprice, PricingError
+from .serving import serve_media
+from .images import store_uploads
+from .catalog import CATALOG_FIELDS, CATALOG_FORMATS, stream_catalog, import_catalog
 from .utils import send_private_review_response_notification, send_new_message_notification
 
+# Page sizes for the catalog listings
+VENDORS_PER_PAGE = 24
+LIST_PER_PAGE = 50
+LIST_COUNT_LIMIT = 1000
+
+@cache_anonymous_page()
 def market_home(request):
     """Main market page with vendor listings and search/filter functionality"""
-    vendors = Vendor.objects.filter(is_active=True)
-    
     # Search functionality
     search_query = request.GET.get('search', '')
     location_filter = request.GET.get('location', '')
@@ -27,175 +49,90 @@ def market_home(request):
     min_price = request.GET.get('min_price', '')
     max_price = request.GET.get('max_price', '')
     
-    if search_query:
-        vendors = vendors.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query)
-        )
-    
-    if location_filter:
-        vendors = vendors.filter(
-            Q(city__icontains=location_filter) | 
-            Q(state__icontains=location_filter) |
-            Q(service_area__icontains=location_filter)
-        )
+    # Text, location, category and price filters plus the price warning
+    # flags are all resolved in a single query
+    vendors = search_vendors(
+        search_query=search_query,
+        location_filter=location_filter,
+        category_filter=category_filter,
+        min_price=parse_price(min_price),
+        max_price=parse_price(max_price),
+    )
     
-    # Filter by product category if specified
-    if category_filter:
-        vendors_with_category = vendors.filter(products__category=category_filter).distinct()
-        vendors = vendors_with_category
-    
-    # Filter by price range if specified - include vendors who have ANY products in range
-    if min_price or max_price:
-        filtered_vendors = []
-        for vendor in vendors:
-            vendor_products = vendor.products.all()
-            if vendor_products.exists():
-                # Check if vendor has ANY products within the price range
-                has_products_in_range = False
-                
-                if min_price and max_price:
-                    # Both min and max specified
-                    has_products_in_range = vendor_products.filter(
-                        price__gte=float(min_price),
-                        price__lte=float(max_price)
-                    ).exists()
-                elif min_price:
-                    # Only min price specified
-                    has_products_in_range = vendor_products.filter(
-                        price__gte=float(min_price)
-                    ).exists()
-                elif max_price:
-                    # Only max price specified
-                    has_products_in_range = vendor_products.filter(
-                        price__lte=float(max_price)
-                    ).exists()
-                
-                if has_products_in_range:
-                    filtered_vendors.append(vendor)
-        vendors = filtered_vendors
-    
-    # Get all available categories for filter dropdown
-    all_categories = Product.CATEGORY_CHOICES
-    
-    # Get price range for filter
-    all_products = Product.objects.all()
-    if all_products.exists():
-        price_range = {
-            'min': all_products.aggregate(Min('price'))['price__min'],
-            'max': all_products.aggregate(Max('price'))['price__max']
-        }
+    # Price range and category counts for the filter bar. Global facets are
+    # cached; when filtering, categories are counted within the results
+    # (ignoring the category filter itself so other options stay visible).
+    facets = global_facets()
+    if search_query or location_filter or min_price or max_price:
+        category_facets = result_facets(search_vendors(
+            search_query=search_query,
+            location_filter=location_filter,
+            min_price=parse_price(min_price),
+            max_price=parse_price(max_price),
+        ))['categories']
     else:
-        price_range = {'min': 0, 'max': 0}
-    
-    # Add price warning information to each vendor
-    vendors_with_warnings = []
-    for vendor in vendors:
-        vendor_dict = {
-            'vendor': vendor,
-            'has_products_below_min': False,
-            'has_products_above_max': False,
-        }
-        
-        if min_price:
-            vendor_dict['has_products_below_min'] = vendor.has_products_below_price(min_price)
-        if max_price:
-            vendor_dict['has_products_above_max'] = vendor.has_products_above_price(max_price)
-            
-        vendors_with_warnings.append(vendor_dict)
+        category_facets = facets['categories']
+    
+    # Keyset pagination; search results are ordered by relevance
+    page = paginate(request, vendors, VENDORS_PER_PAGE)
     
     context = {
-        'vendors_with_warnings': vendors_with_warnings,
+        'vendors': page,
+        'page': page,
         'search_query': search_query,
         'location_filter': location_filter,
         'category_filter': category_filter,
         'min_price': min_price,
         'max_price': max_price,
-        'categories': all_categories,
-        'price_range': price_range,
+        'categories': category_facets,
+        'price_range': facets['price_range'],
     }
     
     return render(request, 'market/market_home.html', context)
 
+@condition(etag_func=vendor_detail_etag)
+@cache_anonymous_page(vendor_kwarg='vendor_id')
 def vendor_detail(request, vendor_id):
     """Individual vendor home page with products tab"""
-    vendor = get_object_or_404(Vendor, id=vendor_id, is_active=True)
-    
-    # Get all products for this vendor, ordered by featured first, then by category
-    all_products = vendor.products.all()
-    featured_products = all_products.filter(is_featured=True)
-    
-    # Group products by category
-    products_by_category = {}
-    for product in all_products:
-        category = product.get_category_display()
-        if category not in products_by_category:
-            products_by_category[category] = []
-        products_by_category[category].append(product)
-    
-    # Get reviews for this vendor
-    reviews = vendor.reviews.all()[:5]  # Show latest 5 reviews
-    
-    # Get cart information if user is authenticated
-    cart_item_count = 0
-    if request.user.is_authenticated:
-        cart_item_count = get_cart_item_count(request.user, vendor)
-    
-    context = {
-        'vendor': vendor,
-        'featured_products': featured_products,
-        'products_by_category': products_by_category,
-        'reviews': reviews,
-        'cart_item_count': cart_item_count,
-    }
-    
+    context = load_vendor_page(request, vendor_id)
     return render(request, 'market/vendor_detail.html', context)
 
+@condition(etag_func=catalog_etag)
 def product_list(request):
-    products = Product.objects.all() #type: ignore
-    return render(request, 'market/product_list.html', {'products': products})
+    products = Product.objects.select_related('vendor') #type: ignore
+    page = paginate(request, products, LIST_PER_PAGE, count_limit=LIST_COUNT_LIMIT)
+    return render(request, 'market/product_list.html', {'products': page, 'page': page})
 
+@condition(etag_func=catalog_etag)
 def vendor_list(request):
-    vendors = Vendor.objects.all() #type: ignore
-    return render(request, 'market/vendor_list.html', {'vendors': vendors})
+    vendors = Vendor.objects.order_by('-feature_priority', 'name').prefetch_related('products') #type: ignore
+    page = paginate(request, vendors, LIST_PER_PAGE, count_limit=LIST_COUNT_LIMIT)
+    return render(request, 'market/vendor_list.html', {'vendors': page, 'page': page})
 
 def consumer_list(request):
-    consumers = Consumer.objects.all() #type: ignore
-    return render(request, 'market/consumer_list.html', {'consumers': consumers})
-
-# Cart helper functions
-def get_or_create_cart(user, vendor):
-    """Get or create a cart for a user and vendor"""
-    cart, created = Cart.objects.get_or_create(user=user, vendor=vendor)
-    return cart
-
-def get_cart_item_count(user, vendor):
-    """Get the total item count for a user's cart with a specific vendor"""
-    try:
-        cart = Cart.objects.get(user=user, vendor=vendor)
-        return cart.item_count
-    except Cart.DoesNotExist:
-        return 0
+    consumers = Consumer.objects.order_by('name') #type: ignore
+    page = paginate(request, consumers, LIST_PER_PAGE, count_limit=LIST_COUNT_LIMIT)
+    return render(request, 'market/consumer_list.html', {'consumers': page, 'page': page})
 
 # Cart views
-@login_required
+# Carts work for anonymous shoppers too: the cart backend keeps their carts in
+# the session until they log in (see cart.py)
 def cart_detail(request, vendor_id):
     """View cart for a specific vendor"""
     vendor = get_object_or_404(Vendor, id=vendor_id)
-    cart = get_or_create_cart(request.user, vendor)
+    cart, items = cart_service.get_cart_backend(request).get_cart(vendor)
     
     context = {
         'cart': cart,
         'vendor': vendor,
-        'items': cart.items.all(),
+        'items': items,
     }
     
     return render(request, 'market/cart_detail.html', context)
 
-@login_required
 def my_carts(request):
-    """View all carts for the logged-in user"""
-    carts = Cart.objects.filter(user=request.user).select_related('vendor').prefetch_related('items')
+    """View all carts for the current shopper"""
+    carts = cart_service.get_cart_backend(request).carts()
     
     context = {
         'carts': carts,
@@ -203,107 +140,135 @@ def my_carts(request):
     
     return render(request, 'market/my_carts.html', context)
 
-@login_required
+def _posted_quantity(request):
+    """Quantity from the POST data; invalid values become 0 and are rejected by the cart"""
+    try:
+        return int(request.POST.get('quantity', 1))
+    except (TypeError, ValueError):
+        return 0
+
 def add_to_cart(request, product_id):
     """Add a product to the cart"""
     if request.method == 'POST':
         product = get_object_or_404(Product, id=product_id)
-        quantity = int(request.POST.get('quantity', 1))
-        
-        # Validate quantity
-        if quantity < 1:
-            messages.error(request, 'Quantity must be at least 1.')
-            return redirect('vendor_detail', vendor_id=product.vendor.id)
+        quantity = _posted_quantity(request)
         
-        if quantity > product.max_quantity:
-            messages.error(request, f'Maximum quantity allowed is {product.max_quantity}.')
-            return redirect('vendor_detail', vendor_id=product.vendor.id)
-        
-        # Get or create cart for this vendor
-        cart = get_or_create_cart(request.user, product.vendor)
-        
-        # Check if item already exists in cart
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            # Update quantity if item already exists
-            new_quantity = cart_item.quantity + quantity
-            if new_quantity > product.max_quantity:
-                messages.error(request, f'Adding {quantity} would exceed the maximum quantity of {product.max_quantity}.')
-                return redirect('vendor_detail', vendor_id=product.vendor.id)
-            cart_item.quantity = new_quantity
-            cart_item.save()
+        try:
+            cart_service.get_cart_backend(request).add(product, quantity)
+        except cart_service.CartError as e:
+            messages.error(request, str(e))
+            return redirect('vendor_detail', vendor_id=product.vendor_id)
         
         messages.success(request, f'Added {quantity} {product.name} to your cart.')
-        return redirect('vendor_detail', vendor_id=product.vendor.id)
+        return redirect('vendor_detail', vendor_id=product.vendor_id)
     
     return redirect('market_home')
 
-@login_required
 def update_cart_item(request, item_id):
     """Update the quantity of a cart item"""
     if request.method == 'POST':
-        cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
-        quantity = int(request.POST.get('quantity', 1))
+        cart = cart_service.get_cart_backend(request)
+        cart_item = cart.get_item(item_id)
+        if cart_item is None:
+            raise Http404('Cart item not found')
+        vendor_id = cart_item.product.vendor_id
+        quantity = _posted_quantity(request)
         
-        # Validate quantity
-        if quantity < 1:
-            messages.error(request, 'Quantity must be at least 1.')
-            return redirect('cart_detail', vendor_id=cart_item.cart.vendor.id)
-        
-        if quantity > cart_item.product.max_quantity:
-            messages.error(request, f'Maximum quantity allowed is {cart_item.product.max_quantity}.')
-            return redirect('cart_detail', vendor_id=cart_item.cart.vendor.id)
-        
-        cart_item.quantity = quantity
-        cart_item.save()
+        try:
+            cart.set_quantity(cart_item, quantity)
+        except cart_service.CartError as e:
+            messages.error(request, str(e))
+            return redirect('cart_detail', vendor_id=vendor_id)
         
         messages.success(request, f'Updated {cart_item.product.name} quantity to {quantity}.')
-        return redirect('cart_detail', vendor_id=cart_item.cart.vendor.id)
+        return redirect('cart_detail', vendor_id=vendor_id)
     
     return redirect('market_home')
 
-@login_required
 def remove_from_cart(request, item_id):
     """Remove an item from the cart"""
     if request.method == 'POST':
-        cart_item = get_object_or_404(CartItem, id=item_id, cart__user=request.user)
-        product_name = cart_item.product.name
-        vendor_id = cart_item.cart.vendor.id
-        cart_item.delete()
+        cart = cart_service.get_cart_backend(request)
+        cart_item = cart.get_item(item_id)
+        if cart_item is None:
+            raise Http404('Cart item not found')
+        cart.remove(cart_item)
         
-        messages.success(request, f'Removed {product_name} from your cart.')
-        return redirect('cart_detail', vendor_id=vendor_id)
+        messages.success(request, f'Removed {cart_item.product.name} from your cart.')
+        return redirect('cart_detail', vendor_id=cart_item.product.vendor_id)
     
     return redirect('market_home')
 
-@login_required
+@require_POST
+def update_cart_items(request, vendor_id):
+    """
+    Apply several quantity changes to one cart (AJAX endpoint).
+    Expects {"items": [{"item_id": 1, "quantity": 2}, ...]}; quantity 0 removes
+    the item. Returns the changed items and the new cart totals, or a 400 with
+    per-item errors when nothing was applied.
+    """
+    try:
+        payload = json.loads(request.body)
+        changes = {}
+        for change in payload['items']:
+            item_id, quantity = int(change['item_id']), int(change['quantity'])
+            if item_id in changes:
+                raise ValueError
+            changes[item_id] = quantity
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({'error': 'Expected {"items": [{"item_id": ..., "quantity": ...}]} with each item once.'}, status=400)
+    if not changes:
+        return JsonResponse({'error': 'No changes given.'}, status=400)
+    
+    try:
+        summary = cart_service.get_cart_backend(request).update_items(vendor_id, changes)
+    except cart_service.CartError as e:
+        return JsonResponse({'error': str(e), 'errors': e.errors}, status=400)
+    return JsonResponse(summary)
+
 def clear_cart(request, vendor_id):
     """Clear all items from a cart and delete the cart"""
     if request.method == 'POST':
         vendor = get_object_or_404(Vendor, id=vendor_id)
-        try:
-            cart = Cart.objects.get(user=request.user, vendor=vendor)
-            cart.delete()
+        if cart_service.get_cart_backend(request).clear(vendor.id):
             messages.success(request, f'Cart for {vendor.name} has been cleared.')
-        except Cart.DoesNotExist:
+        else:
             messages.info(request, 'Cart is already empty.')
         
         return redirect('vendor_detail', vendor_id=vendor_id)
     
     return redirect('market_home')
 
-@login_required
 def cart_count(request, vendor_id):
-    """Get cart item count for a vendor (AJAX endpoint)"""
+    """Get cart item count for a vendor (AJAX endpoint; header_state answers for all vendors at once)"""
     vendor = get_object_or_404(Vendor, id=vendor_id)
-    count = get_cart_item_count(request.user, vendor)
+    count = cart_service.get_cart_backend(request).count(vendor.id)
     return JsonResponse({'count': count})
 
+@ensure_csrf_cookie
+def header_state(request):
+    """Cart counts and totals for every vendor, unread messages and vendor teams (AJAX endpoint)"""
+    state = get_header_state(request.user, cart_service.get_cart_backend(request))
+    return JsonResponse(state)
+
+@login_required
+def checkout(request, vendor_id):
+    """Place an order for everything in the cart for a vendor"""
+    if request.method == 'POST':
+        vendor = get_object_or_404(Vendor, id=vendor_id)
+        shipping = {field: request.POST.get(field, '').strip() for field in SHIPPING_FIELDS}
+        
+        try:
+            order = checkout_cart(request.user, vendor.id, shipping=shipping, notes=request.POST.get('notes', '').strip())
+        except CheckoutError as e:
+            messages.error(request, str(e))
+            return redirect('cart_detail', vendor_id=vendor.id)
+        
+        messages.success(request, f'Order #{order.id} placed with {vendor.name}. Total: ${order.total_price}.')
+        return redirect('my_carts')
+    
+    return redirect('cart_detail', vendor_id=vendor_id)
+
 # Vendor Application Views
 def apply_to_be_vendor(request):
     """Public page for users to apply to become a vendor"""
@@ -477,7 +442,7 @@ def edit_vendor_profile(request, vendor_id):
 def vendor_products_list(request, vendor_id):
     """List all products for a vendor"""
     vendor = get_object_or_404(Vendor, id=vendor_id)
-    products = Product.objects.filter(vendor=vendor).select_related('vendor').prefetch_related('media_items')
+    products = Product.objects.filter(vendor=vendor).select_related('vendor')
     
     # Filter by category if provided
     category_filter = request.GET.get('category', '')
@@ -507,18 +472,23 @@ def create_product(request, vendor_id):
     if request.method == 'POST':
         form = ProductForm(request.POST, request.FILES, vendor=vendor)
         if form.is_valid():
-            product = form.save(commit=True)
-            
-            # Handle image uploads
-            images = request.FILES.getlist('images')
-            if images:
-                for idx, image in enumerate(images):
-                    ProductMedia.objects.create(
+            # Validate and store the images in parallel before touching the database
+            names, errors = store_uploads(request.FILES.getlist('images'))
+            for error in errors:
+                form.add_error('images', error)
+        if form.is_valid():
+            with transaction.atomic():
+                product = form.save(commit=True)
+                media = ProductMedia.objects.bulk_create([
+                    ProductMedia(
                         product=product,
-                        image=image,
+                        image=name,
                         is_primary=(idx == 0),  # First image is primary
                         order=idx
                     )
+                    for idx, name in enumerate(names)
+                ])
+                product_media_bulk_created(product, media)
             
             messages.success(request, f'Product "{product.name}" created successfully!')
             return redirect('vendor_products_list', vendor_id=vendor.id)
@@ -536,26 +506,32 @@ def create_product(request, vendor_id):
 def edit_product(request, vendor_id, product_id):
     """Edit an existing product"""
     vendor = get_object_or_404(Vendor, id=vendor_id)
-    product = get_object_or_404(Product, id=product_id, vendor=vendor)
+    # Current max media order comes with the product, for appending new images
+    product = get_object_or_404(
+        Product.objects.annotate(last_media_order=Max('media_items__order')),
+        id=product_id, vendor=vendor,
+    )
     
     if request.method == 'POST':
         form = ProductForm(request.POST, request.FILES, instance=product, vendor=vendor)
         if form.is_valid():
-            product = form.save(commit=True)
-            
-            # Handle new image uploads
-            images = request.FILES.getlist('images')
-            if images:
-                # Get current max order
-                from django.db.models import Max
-                max_order = product.media_items.aggregate(Max('order'))['order__max'] or -1
-                for idx, image in enumerate(images):
-                    ProductMedia.objects.create(
+            names, errors = store_uploads(request.FILES.getlist('images'))
+            for error in errors:
+                form.add_error('images', error)
+        if form.is_valid():
+            first_order = 0 if product.last_media_order is None else product.last_media_order + 1
+            with transaction.atomic():
+                product = form.save(commit=True)
+                media = ProductMedia.objects.bulk_create([
+                    ProductMedia(
                         product=product,
-                        image=image,
+                        image=name,
                         is_primary=False,  # Don't auto-set as primary when adding to existing
-                        order=max_order + idx + 1
+                        order=first_order + idx
                     )
+                    for idx, name in enumerate(names)
+                ])
+                product_media_bulk_created(product, media)
             
             messages.success(request, f'Product "{product.name}" updated successfully!')
             return redirect('vendor_products_list', vendor_id=vendor.id)
@@ -616,64 +592,38 @@ def bulk_product_operations(request, vendor_id):
         selected_products_qs = products.filter(id__in=selected_products)
         count = selected_products_qs.count()
         
-        if action == 'price_set':
-            try:
-                price = float(request.POST.get('price_value', 0))
-                if price <= 0:
-                    raise ValueError
-                selected_products_qs.update(price=price)
-                messages.success(request, f'Updated price to ${price:.2f} for {count} product(s).')
-            except (ValueError, TypeError):
-                messages.error(request, 'Invalid price value.')
-        
-        elif action == 'price_increase':
+        if action in ('price_set', 'price_increase', 'price_decrease', 'price_multiply'):
+            # One UPDATE for the whole selection, computed and rounded in the database
+            amount = parse_price(request.POST.get('price_value'))
             try:
-                amount = float(request.POST.get('price_value', 0))
-                if amount < 0:
-                    raise ValueError
-                for product in selected_products_qs:
-                    product.price += amount
-                    product.save()
-                messages.success(request, f'Increased price by ${amount:.2f} for {count} product(s).')
-            except (ValueError, TypeError):
-                messages.error(request, 'Invalid price value.')
-        
-        elif action == 'price_decrease':
-            try:
-                amount = float(request.POST.get('price_value', 0))
-                if amount < 0:
-                    raise ValueError
-                for product in selected_products_qs:
-                    product.price = max(0, product.price - amount)
-                    product.save()
-                messages.success(request, f'Decreased price by ${amount:.2f} for {count} product(s).')
-            except (ValueError, TypeError):
-                messages.error(request, 'Invalid price value.')
-        
-        elif action == 'price_multiply':
-            try:
-                multiplier = float(request.POST.get('price_value', 1))
-                if multiplier <= 0:
-                    raise ValueError
-                for product in selected_products_qs:
-                    product.price *= multiplier
-                    product.save()
-                messages.success(request, f'Multiplied price by {multiplier:.2f} for {count} product(s).')
-            except (ValueError, TypeError):
-                messages.error(request, 'Invalid multiplier value.')
+                bulk_reprice(selected_products_qs, action, amount)
+            except PricingError as e:
+                messages.error(request, str(e))
+            else:
+                products_bulk_updated(vendor.id)
+                if action == 'price_set':
+                    messages.success(request, f'Updated price to ${amount:.2f} for {count} product(s).')
+                elif action == 'price_increase':
+                    messages.success(request, f'Increased price by ${amount:.2f} for {count} product(s).')
+                elif action == 'price_decrease':
+                    messages.success(request, f'Decreased price by ${amount:.2f} for {count} product(s).')
+                else:
+                    messages.success(request, f'Multiplied price by {amount:.2f} for {count} product(s).')
         
         elif action == 'toggle_availability':
             # Toggle availability (set all to True or False based on first product)
             first_product = selected_products_qs.first()
             new_value = not first_product.is_available if first_product else True
-            selected_products_qs.update(is_available=new_value)
+            selected_products_qs.update(is_available=new_value, updated_at=timezone.now())
+            products_bulk_updated(vendor.id)
             status = 'available' if new_value else 'unavailable'
             messages.success(request, f'Set {count} product(s) to {status}.')
         
         elif action == 'set_category':
             category = request.POST.get('category_value')
             if category:
-                selected_products_qs.update(category=category)
+                selected_products_qs.update(category=category, updated_at=timezone.now())
+                products_bulk_updated(vendor.id)
                 category_name = dict(Product.CATEGORY_CHOICES).get(category, category)
                 messages.success(request, f'Set category to {category_name} for {count} product(s).')
             else:
@@ -695,6 +645,47 @@ def bulk_product_operations(request, vendor_id):
     
     return render(request, 'market/bulk_product_operations.html', context)
 
+@vendor_team_required()
+def export_products(request, vendor_id):
+    """Download a vendor's product catalog as CSV or JSON"""
+    vendor = get_object_or_404(Vendor, id=vendor_id)
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in CATALOG_FORMATS:
+        raise Http404('Unknown export format')
+    
+    response = StreamingHttpResponse(stream_catalog(vendor, fmt), content_type=f'{CATALOG_FORMATS[fmt]}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{slugify(vendor.name) or "vendor"}-products.{fmt}"'
+    return response
+
+@vendor_team_required()
+def import_products(request, vendor_id):
+    """Create or update a vendor's products from a CSV or JSON file"""
+    vendor = get_object_or_404(Vendor, id=vendor_id)
+    report = None
+    
+    if request.method == 'POST':
+        upload = request.FILES.get('catalog_file')
+        fmt = request.POST.get('format') or (upload.name.rsplit('.', 1)[-1].lower() if upload else '')
+        if not upload:
+            messages.error(request, 'Please choose a file to import.')
+        elif fmt not in CATALOG_FORMATS:
+            messages.error(request, 'Please upload a .csv or .json file.')
+        else:
+            report = import_catalog(vendor, upload, fmt)
+            if report.created or report.updated:
+                messages.success(request, f'Imported {report.created} new and {report.updated} updated product(s).')
+            if report.error_count:
+                messages.error(request, f'{report.error_count} row(s) could not be imported; see the report below.')
+    
+    context = {
+        'vendor': vendor,
+        'report': report,
+        'catalog_fields': CATALOG_FIELDS,
+        'categories': Product.CATEGORY_CHOICES,
+    }
+    
+    return render(request, 'market/product_import.html', context)
+
 # Review Management Views
 @vendor_team_required()
 def vendor_reviews(request, vendor_id):
@@ -949,6 +940,11 @@ def vendor_dashboard(request):
         total=Sum(F('quantity') * F('product__price'), output_field=DecimalField())
     )['total'] or Decimal('0.00')
     
+    # Abandoned carts (summarised by the sweep_abandoned_carts command before removal)
+    abandoned = AbandonedCartStats.objects.filter(
+        vendor=selected_vendor, date__gte=start.date(), date__lte=end.date()
+    ).aggregate(carts=Sum('cart_count'), value=Sum('total_value'))
+    
     # Reviews stats
     total_reviews = reviews_qs.count()
     avg_rating = reviews_qs.aggregate(avg=Avg('rating'))['avg'] or 0
@@ -1041,6 +1037,8 @@ def vendor_dashboard(request):
         'completed_orders': completed_orders,
         'total_revenue': total_revenue,
         'potential_revenue': potential_revenue,
+        'abandoned_carts': abandoned['carts'] or 0,
+        'abandoned_value': abandoned['value'] or Decimal('0.00'),
         'total_reviews': total_reviews,
         'avg_rating': round(avg_rating, 1) if avg_rating else 0,
         'response_rate': round(response_rate, 1),
@@ -1089,4 +1087,10 @@ def logout_view(request):
     messages.success(request, 'You have been successfully logged out.')
     return redirect('market_home')
 
+# Media files
+@require_safe
+def media_file(request, path):
+    """Serve an uploaded file with caching headers, range requests and optional front-end offload"""
+    return serve_media(request, path)
+
 # Create your views here.